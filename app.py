@@ -6,6 +6,7 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 import io 
+import json
 load_dotenv()
 # Make text and widgets larger + center content wider
 st.markdown(
@@ -234,25 +235,43 @@ with tab1:
                     for f in uploaded_fi:
                         files.append(("field_issues", (f.name, f.getvalue(), "application/octet-stream")))
 
-                # Call backend API
+                # Call backend API (NDJSON stream → entries show up as soon as they are generated)
                 response = requests.post(
-                    f"{API_BASE}/dfmea/generate",
+                    f"{API_BASE}/dfmea/generate/stream",
                     data={
                         "products": products,
                         "subproducts": subproducts,
                         "focus": st.session_state.get("focus_prompt", "")
                     },
-                    files=files
+                    files=files,
+                    stream=True
                 )
 
                 if response.status_code == 200:
-                    result = response.json()
-
-                    # 🔹 Save backend response JSON into session state
-                    st.session_state["dfmea_entries"] = result.get("dfmea_entries", [])
-
-                    # ✅ Replace spinner with success alert in SAME place
-                    st.success("🎉 Pipeline run complete! Go to **DFMEA Output TAB** to view results and download.")
+                    entries, status, message = [], "success", ""
+                    live = st.empty()
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        if event.get("type") == "entry":
+                            entries.append(event["entry"])
+                            live.info(f"📝 {len(entries)} DFMEA entries received so far...")
+                        elif event.get("status") == "error":
+                            status, message = "error", event.get("message", "")
+                        elif event.get("type") == "done":
+                            # Backend writes the XLSX export in the background
+                            st.session_state["dfmea_file_id"] = event.get("file_id")
+
+                    # 🔹 Save streamed entries into session state
+                    st.session_state["dfmea_entries"] = entries
+                    live.empty()
+
+                    if status == "success":
+                        # ✅ Replace spinner with success alert in SAME place
+                        st.success("🎉 Pipeline run complete! Go to **DFMEA Output TAB** to view results and download.")
+                    else:
+                        st.error(f"❌ Backend error: {message}")
                 else:
                     st.error(f"❌ Backend error: {response.status_code}")
 
@@ -327,6 +346,20 @@ with tab2:
             except Exception:
                 st.warning("⚠️ Could not render DFMEA entries as table.")
 
+            # Download the backend's XLSX export
+            file_id = st.session_state.get("dfmea_file_id")
+            if file_id and st.button("📥 Prepare XLSX download"):
+                resp = requests.get(f"{API_BASE}/download/{file_id}", params={"format": "xlsx"})
+                if resp.headers.get("content-type", "").startswith("application/json"):
+                    st.info(f"⏳ {resp.json().get('message', 'Export not ready yet, try again.')}")
+                else:
+                    st.download_button(
+                        "⬇️ Download DFMEA (XLSX)",
+                        data=resp.content,
+                        file_name=f"DFMEA_{file_id}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    )
+
             # Show JSON
             st.subheader("Raw JSON Response")
             st.json(dfmea_entries)
@@ -0,0 +1 @@
+"""Offline benchmark suite for the DFMEA agents (see run_benchmarks.py)."""
@@ -0,0 +1,294 @@
+# benchmarks/corpus.py
+"""Seeded synthetic DFMEA corpus: PRD, knowledge-base and field-issue rows.
+
+Rows have the same shape ``server.utils.file_parser.parse_file`` returns for the real
+spreadsheets (one dict per row, column name → cell), so they can be fed straight
+into ``ChunkingAgent.run`` or written to CSV/XLSX and uploaded to the API. The same
+seed and scale always produce the same corpus.
+"""
+
+import csv
+import random
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List
+
+# Zebra product families and the subproducts (assemblies) a DFMEA is scoped to. Families
+# share assemblies (battery, display, scan engine …), so the product × subproduct pairs
+# the UI sends are real combinations; families are ordered so the first few overlap.
+PRODUCTS = {
+    "TC52 Mobile Computer": ["Battery", "Display", "Scan Engine", "Charging Contacts", "Housing"],
+    "TC57 Mobile Computer": ["Battery", "Display", "Scan Engine", "WWAN Radio", "Housing"],
+    "DS8178 Handheld Scanner": ["Battery", "Scan Engine", "Trigger Switch", "Charging Contacts", "Housing"],
+    "ZQ630 Mobile Printer": ["Battery", "Printhead", "Platen Roller", "Media Sensor", "Housing"],
+    "ZT411 Industrial Printer": ["Printhead", "Platen Roller", "Ribbon Drive", "Media Sensor", "Power Supply"],
+}
+
+# Per subproduct: what it does, how it fails and why. A pair's evidence only covers its
+# own subproduct's failure modes, as in a real knowledge bank, so a pair runs out of
+# new failure modes after a few batches.
+COMPONENTS = {
+    "Battery": {
+        "functions": ["power the device for a full shift", "report state of charge to the host"],
+        "failure_modes": ["cell swelling", "capacity fade below 80% before rated cycles",
+                          "fuel gauge misreports charge", "battery latch fails to retain pack"],
+        "causes": ["charging at high ambient temperature", "cell supplier lot variation",
+                   "fuel gauge not recalibrated after deep discharge", "latch spring fatigue"],
+    },
+    "Display": {
+        "functions": ["show the user interface in sunlight", "accept touch input with gloves"],
+        "failure_modes": ["cracked cover glass", "touch panel ghost touches", "backlight flicker",
+                          "display delamination"],
+        "causes": ["drop onto concrete from 1.8 m", "moisture ingress at the bezel gasket",
+                   "ESD discharge through the bezel", "adhesive degradation at high humidity"],
+    },
+    "Scan Engine": {
+        "functions": ["decode 1D/2D barcodes at working range", "aim with a visible laser dot"],
+        "failure_modes": ["no-read on damaged barcodes", "scan window scratched", "imager focus drift",
+                          "aimer dot not visible"],
+        "causes": ["exit window coating wear", "lens mount loosened by vibration",
+                   "firmware decode timeout too short", "laser diode degradation"],
+    },
+    "Charging Contacts": {
+        "functions": ["carry charge current from the cradle", "keep contact under vibration"],
+        "failure_modes": ["contact corrosion", "intermittent charging in cradle", "pogo pin stuck down"],
+        "causes": ["hand sanitizer residue on contacts", "insufficient gold plating thickness",
+                   "debris in the pogo pin barrel"],
+    },
+    "Housing": {
+        "functions": ["protect electronics against drops and tumbles", "seal to IP65/IP67"],
+        "failure_modes": ["housing crack at corner", "IP seal failure", "screw boss stripped"],
+        "causes": ["repeated tumble-test impacts", "gasket compression set",
+                   "over-torque during depot repair"],
+    },
+    "WWAN Radio": {
+        "functions": ["hold a cellular data connection", "meet carrier certification limits"],
+        "failure_modes": ["dropped cellular connection", "antenna detuning", "SIM not detected"],
+        "causes": ["hand-grip detuning of the antenna", "SIM tray spring deformation",
+                   "modem firmware roaming bug"],
+    },
+    "Trigger Switch": {
+        "functions": ["start a scan on press", "survive millions of actuations"],
+        "failure_modes": ["trigger sticks", "double trigger on a single press", "trigger boot tear"],
+        "causes": ["switch debounce too short", "dust ingress under the trigger boot",
+                   "boot elastomer hardening at low temperature"],
+    },
+    "Printhead": {
+        "functions": ["print labels at rated darkness and speed", "heat dots uniformly across the width"],
+        "failure_modes": ["printhead dot-line failure", "light or faded print", "printhead abrasion"],
+        "causes": ["abrasive label stock", "darkness setting above media rating",
+                   "static discharge from the ribbon"],
+    },
+    "Platen Roller": {
+        "functions": ["drive media under the printhead", "hold print registration"],
+        "failure_modes": ["platen roller wear causing skew", "media slip", "adhesive buildup on roller"],
+        "causes": ["linerless media adhesive transfer", "roller durometer out of spec",
+                   "cleaning interval not followed"],
+    },
+    "Media Sensor": {
+        "functions": ["detect label gaps and black marks", "calibrate to new media"],
+        "failure_modes": ["missed label gap", "false media-out error", "calibration drift"],
+        "causes": ["dust on the sensor window", "pre-printed media with low contrast",
+                   "sensor LED output decay"],
+    },
+    "Ribbon Drive": {
+        "functions": ["keep ribbon tension constant", "detect ribbon-out"],
+        "failure_modes": ["ribbon wrinkle", "ribbon breaks mid-job", "ribbon-out not detected"],
+        "causes": ["supply spindle tension mis-set", "ribbon narrower than media",
+                   "encoder wheel contamination"],
+    },
+    "Power Supply": {
+        "functions": ["supply regulated power to the print engine", "ride through brown-outs"],
+        "failure_modes": ["PSU output ripple resets the printer", "PSU fan failure", "inrush trips breaker"],
+        "causes": ["electrolytic capacitor aging at high temperature", "fan bearing wear",
+                   "NTC thermistor undersized"],
+    },
+}
+
+EFFECTS = [
+    "worker cannot complete the shift on one charge", "device reboots during a scan session",
+    "barcodes must be keyed in manually", "labels rejected by ISO/IEC 15416 grading",
+    "shipments delayed at the dock", "unit returned through the repair depot",
+    "customer escalation under a service contract", "printer stops with an error mid-job",
+]
+
+PREVENTION = [
+    "drop and tumble design review", "thermal simulation of the charge path",
+    "DFM review with the contract manufacturer", "ESD design review per IEC 61000-4-2",
+    "supplier PPAP for cells and gaskets", "firmware code review and static analysis",
+]
+
+DETECTION = [
+    "1.8 m drop test per MIL-STD-810H", "1 m tumble test (2000 tumbles)", "IP65/IP67 ingress test",
+    "battery cycle-life test", "end-of-line functional test", "print quality grading per ISO/IEC 15415",
+    "HALT", "ESD test per IEC 61000-4-2",
+]
+
+REGIONS = ["EU", "NA", "APAC", "LATAM", "MEA"]
+PRIORITIES = ["Must", "Should", "Could"]
+
+
+@dataclass
+class CorpusSpec:
+    prd_rows: int = 50
+    kb_rows: int = 200
+    fi_rows: int = 200
+    seed: int = 1234
+    # Share of rows carrying a long free-text note (exercises token slicing)
+    long_text_ratio: float = 0.05
+    long_text_sentences: int = 120
+
+
+SCALES = {
+    "tiny": CorpusSpec(prd_rows=10, kb_rows=40, fi_rows=40),
+    "small": CorpusSpec(prd_rows=50, kb_rows=200, fi_rows=200),
+    "medium": CorpusSpec(prd_rows=500, kb_rows=2000, fi_rows=2000),
+    "large": CorpusSpec(prd_rows=5000, kb_rows=20000, fi_rows=20000),
+}
+
+
+def spec_for(scale: str, seed: int = None) -> CorpusSpec:
+    spec = CorpusSpec(**asdict(SCALES[scale]))
+    if seed is not None:
+        spec.seed = seed
+    return spec
+
+
+def select_pairs(products: int, subproducts: int):
+    """The first ``products`` families and the ``subproducts`` they share most.
+
+    Every product × subproduct combination the API will be asked for then exists in
+    the corpus, as it does when users pick from the real product tree.
+    """
+    chosen = list(PRODUCTS)[:products]
+    counts = {}
+    for product in chosen:
+        for subproduct in PRODUCTS[product]:
+            counts[subproduct] = counts.get(subproduct, 0) + 1
+    shared = sorted(counts, key=lambda s: (-counts[s], s))
+    return chosen, shared[:subproducts]
+
+
+class CorpusGenerator:
+    """Builds the three row sets from one ``random.Random(seed)``."""
+
+    def __init__(self, spec: CorpusSpec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+
+    def _pair(self):
+        product = self.rng.choice(list(PRODUCTS))
+        return product, self.rng.choice(PRODUCTS[product])
+
+    def _component(self, subproduct: str) -> Dict[str, str]:
+        component = COMPONENTS[subproduct]
+        return {key: self.rng.choice(values) for key, values in component.items()}
+
+    def _sentence(self) -> str:
+        rng = self.rng
+        picked = self._component(rng.choice(list(COMPONENTS)))
+        return (f"The {picked['failure_modes']} was traced to {picked['causes']}; "
+                f"impact: {rng.choice(EFFECTS)}.")
+
+    def _note(self) -> str:
+        if self.rng.random() >= self.spec.long_text_ratio:
+            return ""
+        return " ".join(self._sentence() for _ in range(self.spec.long_text_sentences))
+
+    def prd_rows(self) -> List[Dict]:
+        rows = []
+        for i in range(self.spec.prd_rows):
+            product, subproduct = self._pair()
+            picked = self._component(subproduct)
+            rows.append({
+                "Requirement ID": f"PRD-{i + 1:05d}",
+                "Product": product,
+                "Subproduct": subproduct,
+                "Requirement": f"The {subproduct.lower()} shall {picked['functions']}.",
+                "Acceptance Criteria": f"Passes {self.rng.choice(DETECTION)} with no {picked['failure_modes']}.",
+                "Priority": self.rng.choice(PRIORITIES),
+                "Notes": self._note(),
+            })
+        return rows
+
+    def kb_rows(self) -> List[Dict]:
+        rows = []
+        for _ in range(self.spec.kb_rows):
+            product, subproduct = self._pair()
+            component = COMPONENTS[subproduct]
+            severity, occurrence, detection = (self.rng.randint(1, 10) for _ in range(3))
+            rows.append({
+                "Product": product,
+                "Subproducts": subproduct,
+                "Function": self.rng.choice(component["functions"]),
+                "Potential Failure Mode": self.rng.choice(component["failure_modes"]),
+                "Potential Effects": self.rng.choice(EFFECTS),
+                "Potential Causes": "; ".join(self.rng.sample(component["causes"], self.rng.randint(1, 2))),
+                "Severity": severity,
+                "Occurrence": occurrence,
+                "Detection": detection,
+                "RPN": severity * occurrence * detection,
+                "Controls Prevention": self.rng.choice(PREVENTION),
+                "Controls Detection": self.rng.choice(DETECTION),
+                "Notes": self._note(),
+            })
+        return rows
+
+    def fi_rows(self) -> List[Dict]:
+        rows = []
+        for i in range(self.spec.fi_rows):
+            product, subproduct = self._pair()
+            picked = self._component(subproduct)
+            rows.append({
+                "Case ID": f"RMA-{i + 1:06d}",
+                "Product": product,
+                "Subproduct": subproduct,
+                "Serial Number": f"{self.rng.randint(10, 29)}{self.rng.randint(100, 366):03d}"
+                                 f"{self.rng.randint(0, 99999):05d}",
+                "Reported Date": f"2024-{self.rng.randint(1, 12):02d}-{self.rng.randint(1, 28):02d}",
+                "Region": self.rng.choice(REGIONS),
+                "Customer Complaint": self.rng.choice(EFFECTS),
+                "Failure Mode": picked["failure_modes"],
+                "Root Cause": picked["causes"],
+                "Corrective Action": self.rng.choice(PREVENTION),
+                "Units Affected": self.rng.randint(1, 500),
+                "Technician Notes": self._note(),
+            })
+        return rows
+
+    def generate(self) -> Dict[str, List[Dict]]:
+        """``{"prds", "knowledge_base", "field_issues"}`` → rows (the upload field names)."""
+        return {"prds": self.prd_rows(), "knowledge_base": self.kb_rows(), "field_issues": self.fi_rows()}
+
+
+def generate_corpus(spec: CorpusSpec) -> Dict[str, List[Dict]]:
+    return CorpusGenerator(spec).generate()
+
+
+def write_corpus(corpus: Dict[str, List[Dict]], out_dir, fmt: str = "csv") -> Dict[str, Path]:
+    """Write one file per upload field (``prds.csv`` …); returns field → path."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = {}
+    for field, rows in corpus.items():
+        path = out_dir / f"{field}.{fmt}"
+        columns = list(rows[0]) if rows else []
+        if fmt == "csv":
+            with open(path, "w", newline="", encoding="utf-8") as fh:
+                writer = csv.DictWriter(fh, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(rows)
+        elif fmt == "xlsx":
+            from openpyxl import Workbook
+
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet(field)
+            ws.append(columns)
+            for row in rows:
+                ws.append([row.get(col) for col in columns])
+            wb.save(path)
+        else:
+            raise ValueError(f"Unsupported corpus format '{fmt}' (expected csv or xlsx)")
+        paths[field] = path
+    return paths
+
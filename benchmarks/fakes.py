@@ -0,0 +1,161 @@
+# benchmarks/fakes.py
+"""In-process stand-ins for the Azure OpenAI clients used by the agents.
+
+They expose just the surface the agents call (``client.embeddings.create`` and
+``client.chat.completions.create``, streamed or not) and return deterministic data.
+Latency is simulated with ``time.sleep``, the same blocking behaviour as the real SDK
+inside ``asyncio.to_thread``.
+"""
+
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from .corpus import PRODUCTS, COMPONENTS, EFFECTS, PREVENTION, DETECTION
+
+# Lines of the pair context (see PromptBuilder.pair_context) naming what entries may be tagged with
+_ALLOWED_PAIRS = re.compile(r"^- Allowed Product/Subproduct pairs[^:]*: (.+)$", re.MULTILINE)
+_LISTED = re.compile(r"^- (Products|Subproducts): (.+)$", re.MULTILINE)
+
+
+def deterministic_embedding(text: str, dim: int = 1536) -> List[float]:
+    """Unit-length pseudo-embedding seeded by the text (same text → same vector)."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def _prompt_text(messages: List[Dict]) -> str:
+    return "\n".join(str(m.get("content", "")) for m in messages)
+
+
+def _allowed_pairs(prompt: str) -> List[tuple]:
+    """Pairs an entry may be tagged with, read from the prompt's pair context.
+
+    A fused prompt lists its pairs explicitly; otherwise every listed product ×
+    subproduct combination that exists in the product tree is allowed.
+    """
+    match = _ALLOWED_PAIRS.search(prompt)
+    if match:
+        return [tuple(pair.split(" / ", 1)) for pair in match.group(1).split("; ") if " / " in pair]
+    listed = {name: value.split(", ") for name, value in _LISTED.findall(prompt)}
+    products = [p for p in listed.get("Products", []) if p in PRODUCTS] or list(PRODUCTS)[:1]
+    subproducts = listed.get("Subproducts", [])
+    pairs = [(p, s) for p in products for s in subproducts if s in PRODUCTS[p]]
+    return pairs or [(products[0], PRODUCTS[products[0]][0])]
+
+
+def canned_dfmea_entries(prompt: str, entries: int = 3) -> List[Dict]:
+    """Plausible DFMEA entries derived from the prompt (deterministic per prompt).
+
+    Entries are tagged only with the product/subproduct pairs the prompt allows, so
+    fused prompts map back to their pairs as real completions would. Failure modes
+    and causes come from the subproduct's own set, preferring those the batch text
+    mentions, so a pair stops yielding new modes after a few batches (early stop).
+    """
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+    pairs = _allowed_pairs(prompt)
+    out = []
+    for _ in range(entries):
+        product, subproduct = rng.choice(pairs)
+        component = COMPONENTS.get(subproduct) or COMPONENTS[rng.choice(list(COMPONENTS))]
+        modes = [m for m in component["failure_modes"] if m in prompt] or component["failure_modes"]
+        causes = [c for c in component["causes"] if c in prompt] or component["causes"]
+        severity, occurrence, detection = (rng.randint(1, 10) for _ in range(3))
+        out.append({
+            "Product": product,
+            "Subproducts": subproduct,
+            "Function": rng.choice(component["functions"]),
+            "Potential Failure Mode": rng.choice(modes),
+            "Potential Effects": rng.sample(EFFECTS, 2),
+            "Potential Causes": [rng.choice(causes)],
+            "Severity": severity,
+            "Occurrence": occurrence,
+            "Detection": detection,
+            "RPN": severity * occurrence * detection,
+            "Controls Prevention": [rng.choice(PREVENTION)],
+            "Controls Detection": [rng.choice(DETECTION)],
+            "linked_to_kb": rng.random() < 0.5,
+        })
+    return out
+
+
+def canned_dfmea_response(prompt: str, entries: int = 3) -> str:
+    return json.dumps({"entries": canned_dfmea_entries(prompt, entries)}, ensure_ascii=False)
+
+
+class _Latency:
+    """Fixed base latency plus lognormal jitter (``jitter`` = sigma; 0 → constant)."""
+
+    def __init__(self, seconds: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        self.seconds = seconds
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self, scale: float = 1.0):
+        if self.seconds <= 0:
+            return
+        with self._lock:
+            factor = self._rng.lognormvariate(0.0, self.jitter) if self.jitter else 1.0
+        time.sleep(self.seconds * scale * factor)
+
+
+class FakeEmbeddingClient:
+    """``AzureOpenAI`` look-alike for embeddings (latency grows with batch size)."""
+
+    def __init__(self, dim: int = 1536, latency: float = 0.0, per_item_latency: float = 0.0,
+                 jitter: float = 0.0, seed: int = 0):
+        self.dim = dim
+        self.per_item_latency = per_item_latency
+        self._latency = _Latency(latency, jitter, seed)
+        self.calls = 0
+        self.embeddings = SimpleNamespace(create=self._create)
+
+    def _create(self, input, model: Optional[str] = None, **kwargs):
+        items = input if isinstance(input, list) else [input]
+        self.calls += 1
+        self._latency.sleep()
+        if self.per_item_latency:
+            time.sleep(self.per_item_latency * len(items))
+        return SimpleNamespace(
+            data=[SimpleNamespace(index=i, embedding=deterministic_embedding(t, self.dim)) for i, t in enumerate(items)],
+            usage=SimpleNamespace(prompt_tokens=sum(len(t.split()) for t in items)),
+        )
+
+
+class FakeChatClient:
+    """``AzureOpenAI`` look-alike for chat completions returning canned DFMEA JSON."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, entries_per_call: int = 3,
+                 stream_chunk_chars: int = 40, seed: int = 0):
+        self.entries_per_call = entries_per_call
+        self.stream_chunk_chars = stream_chunk_chars
+        self._latency = _Latency(latency, jitter, seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        with self._lock:
+            self.calls += 1
+        prompt = _prompt_text(messages)
+        content = canned_dfmea_response(prompt, self.entries_per_call)
+        self._latency.sleep()
+        if stream:
+            return self._stream(content)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+            usage=SimpleNamespace(prompt_tokens=len(prompt.split()), completion_tokens=len(content.split())),
+        )
+
+    def _stream(self, content: str):
+        for i in range(0, len(content), self.stream_chunk_chars):
+            delta = SimpleNamespace(content=content[i:i + self.stream_chunk_chars])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)])
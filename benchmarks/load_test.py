@@ -0,0 +1,330 @@
+# benchmarks/load_test.py
+"""Concurrent-user load test for the DFMEA FastAPI app.
+
+Fires multipart ``/dfmea/generate`` (or ``/dfmea/generate/stream`` / ``/dfmea/jobs``)
+requests from N simulated users at a time, for each concurrency level in a sweep, and
+reports p50/p95/p99 latency, throughput, error rate and server RSS (scraped from
+``/metrics``). The upload corpus comes from ``benchmarks.corpus`` (seeded).
+
+Offline setup: run the app against the mock Azure OpenAI server and embedded Qdrant,
+or let ``--start-servers`` launch both::
+
+    python -m benchmarks.load_test --start-servers --concurrency 5 20 50 --requests 40
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --concurrency 5 20 --baseline load/main.json
+
+The breakdown point is the first level whose error rate exceeds ``--max-error-rate``
+or whose p95 exceeds ``--max-p95-growth`` × the p95 of the lowest level.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from .corpus import SCALES, select_pairs, spec_for, generate_corpus, write_corpus
+
+ENDPOINTS = {"generate": "/dfmea/generate", "stream": "/dfmea/generate/stream", "jobs": "/dfmea/jobs"}
+RSS_METRIC = "process_resident_memory_bytes"
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    rank = max(0, min(len(ordered) - 1, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+async def scrape_rss(client: httpx.AsyncClient) -> Optional[float]:
+    try:
+        response = await client.get("/metrics", timeout=5)
+    except httpx.HTTPError:
+        return None
+    for line in response.text.splitlines():
+        if line.startswith(RSS_METRIC + " "):
+            return float(line.split()[1])
+    return None
+
+
+class LoadTest:
+    def __init__(self, args, upload_files: Dict[str, Path]):
+        self.args = args
+        self.upload_files = upload_files
+        products, subproducts = select_pairs(args.products, args.subproducts)
+        self.form = {
+            "products": products,
+            "subproducts": subproducts,
+            "export_format": args.export_format,
+        }
+        self._payloads = {field: path.read_bytes() for field, path in upload_files.items()}
+
+    def _files(self) -> List[tuple]:
+        return [(field, (path.name, self._payloads[field], "text/csv"))
+                for field, path in self.upload_files.items()]
+
+    async def _one_request(self, client: httpx.AsyncClient) -> Dict:
+        """One user action; returns latency, HTTP status and whether the app reported success."""
+        start = time.perf_counter()
+        endpoint = ENDPOINTS[self.args.endpoint]
+        try:
+            if self.args.endpoint == "stream":
+                ok = False
+                async with client.stream("POST", endpoint, data=self.form, files=self._files()) as response:
+                    first_byte = None
+                    async for line in response.aiter_lines():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - start
+                        if line.strip():
+                            ok = json.loads(line).get("status") == "success" or ok
+                return {"latency": time.perf_counter() - start, "status": response.status_code,
+                        "ok": response.status_code == 200 and ok, "first_byte": first_byte}
+
+            response = await client.post(endpoint, data=self.form, files=self._files())
+            body = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+            if self.args.endpoint == "jobs" and response.status_code == 200 and body.get("job_id"):
+                body = await self._wait_for_job(client, body["job_id"])
+                ok = body.get("status") == "succeeded"
+            else:
+                ok = response.status_code == 200 and body.get("status") == "success"
+            return {"latency": time.perf_counter() - start, "status": response.status_code, "ok": ok,
+                    "message": None if ok else str(body.get("message") or body.get("error"))[:200]}
+        except httpx.HTTPError as e:
+            return {"latency": time.perf_counter() - start, "status": None, "ok": False,
+                    "message": f"{type(e).__name__}: {e}"[:200]}
+
+    async def _wait_for_job(self, client: httpx.AsyncClient, job_id: str) -> Dict:
+        """Poll until the job finishes, fails, or ``--timeout`` seconds have passed."""
+        deadline = time.monotonic() + self.args.timeout
+        while True:
+            response = await client.get(f"/dfmea/jobs/{job_id}")
+            if response.status_code != 200:
+                return {"status": "error", "message": f"Job status poll returned HTTP {response.status_code}"}
+            state = response.json()
+            if state.get("status") in ("succeeded", "failed", "error"):
+                return state
+            if time.monotonic() >= deadline:
+                return {"status": "error", "message": f"Job {job_id} not finished after {self.args.timeout:.0f}s"}
+            await asyncio.sleep(self.args.poll_interval)
+
+    async def run_level(self, concurrency: int) -> Dict:
+        """``--requests`` requests spread over ``concurrency`` users (each sends back to back)."""
+        limits = httpx.Limits(max_connections=concurrency + 2, max_keepalive_connections=concurrency + 2)
+        timeout = httpx.Timeout(self.args.timeout, connect=10)
+        async with httpx.AsyncClient(base_url=self.args.url, timeout=timeout, limits=limits) as client:
+            rss_start = await scrape_rss(client)
+            rss_samples = [rss_start] if rss_start is not None else []
+            remaining = self.args.requests
+            results: List[Dict] = []
+
+            async def user():
+                nonlocal remaining
+                while remaining > 0:
+                    remaining -= 1
+                    results.append(await self._one_request(client))
+
+            async def sample_rss():
+                while True:
+                    await asyncio.sleep(self.args.rss_interval)
+                    rss = await scrape_rss(client)
+                    if rss is not None:
+                        rss_samples.append(rss)
+
+            sampler = asyncio.create_task(sample_rss())
+            start = time.perf_counter()
+            await asyncio.gather(*(user() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+            sampler.cancel()
+            rss_end = await scrape_rss(client)
+            if rss_end is not None:
+                rss_samples.append(rss_end)
+
+        latencies = [r["latency"] for r in results if r["ok"]]
+        errors = [r for r in results if not r["ok"]]
+        statuses: Dict[str, int] = {}
+        for r in results:
+            statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+        first_bytes = [r["first_byte"] for r in results if r.get("first_byte") is not None]
+        return {
+            "concurrency": concurrency,
+            "requests": len(results),
+            "succeeded": len(latencies),
+            "error_rate": round(len(errors) / max(len(results), 1), 4),
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 4) if elapsed else None,
+            "latency_s": {
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "mean": statistics.fmean(latencies) if latencies else None,
+                "max": max(latencies) if latencies else None,
+            },
+            "first_byte_p95_s": percentile(first_bytes, 0.95),
+            "status_counts": statuses,
+            "sample_errors": sorted({e.get("message") or str(e["status"]) for e in errors})[:5],
+            "rss_bytes": {
+                "start": rss_start,
+                "max": max(rss_samples) if rss_samples else None,
+                "end": rss_end,
+            },
+        }
+
+
+def find_breakdown(levels: List[Dict], max_error_rate: float, max_p95_growth: float) -> Optional[Dict]:
+    base_p95 = next((level["latency_s"]["p95"] for level in levels if level["latency_s"]["p95"]), None)
+    for level in levels:
+        p95 = level["latency_s"]["p95"]
+        if level["error_rate"] > max_error_rate:
+            return {"concurrency": level["concurrency"], "reason": f"error rate {level['error_rate']:.1%}"}
+        if base_p95 and p95 and p95 > max_p95_growth * base_p95:
+            return {"concurrency": level["concurrency"], "reason": f"p95 {p95:.2f}s > {max_p95_growth}x {base_p95:.2f}s"}
+    return None
+
+
+def compare(levels: List[Dict], baseline: List[Dict], threshold: float) -> List[Dict]:
+    """Per concurrency level: p95 and throughput vs. ``baseline``; flags slowdowns beyond ``threshold``."""
+    before = {level["concurrency"]: level for level in baseline}
+    rows = []
+    for level in levels:
+        old = before.get(level["concurrency"])
+        if old is None:
+            continue
+        p95, old_p95 = level["latency_s"]["p95"], old["latency_s"]["p95"]
+        rps, old_rps = level["throughput_rps"], old["throughput_rps"]
+        p95_ratio = p95 / old_p95 if p95 and old_p95 else None
+        rps_ratio = rps / old_rps if rps and old_rps else None
+        rows.append({
+            "concurrency": level["concurrency"],
+            "p95_ratio": round(p95_ratio, 3) if p95_ratio else None,
+            "throughput_ratio": round(rps_ratio, 3) if rps_ratio else None,
+            "error_rate": level["error_rate"],
+            "baseline_error_rate": old["error_rate"],
+            "regression": bool(
+                (p95_ratio and p95_ratio > 1 + threshold)
+                or (rps_ratio and rps_ratio < 1 - threshold)
+                or level["error_rate"] > old["error_rate"] + 0.01
+            ),
+        })
+    return rows
+
+
+# ----------------------------------------------------------------------
+def _wait_until_up(url: str, path: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url + path, timeout=2)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_servers(args) -> List[subprocess.Popen]:
+    """Mock Azure OpenAI + the app (embedded Qdrant), wired together through env vars."""
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    mock_cmd = [sys.executable, "-m", "benchmarks.mock_azure_openai", "--port", str(args.mock_port),
+                "--chat-latency", str(args.mock_chat_latency), "--chat-tpm", str(args.mock_chat_tpm)]
+    env = dict(
+        os.environ,
+        AZURE_OPENAI_ENDPOINT=mock_url,
+        AZURE_OPENAI_API_KEY="mock",
+        AZURE_OPENAI_API_VERSION=os.getenv("AZURE_OPENAI_API_VERSION", "2024-06-01"),
+        AZURE_OPENAI_EMBEDDING_API_VERSION=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION", "2024-06-01"),
+        AZURE_OPENAI_EMBEDDING_DEPLOYMENT=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small"),
+        QDRANT_LOCATION=os.getenv("QDRANT_LOCATION", ":memory:"),
+        LLM_CACHE_ENABLED="0",
+    )
+    app_port = args.url.rsplit(":", 1)[-1].strip("/")
+    app_cmd = [sys.executable, "-m", "uvicorn", "server.main:app", "--port", app_port, "--log-level", "warning"]
+    processes = [subprocess.Popen(mock_cmd, env=env)]
+    _wait_until_up(mock_url, "/mock/stats")
+    processes.append(subprocess.Popen(app_cmd, env=env))
+    _wait_until_up(args.url, "/metrics")
+    return processes
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test for the DFMEA FastAPI app")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=list(ENDPOINTS), default="generate")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--requests", type=int, default=50, help="Requests per concurrency level")
+    parser.add_argument("--scale", choices=list(SCALES), default="tiny", help="Synthetic corpus uploaded per request")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--products", type=int, default=1)
+    parser.add_argument("--subproducts", type=int, default=2)
+    parser.add_argument("--export-format", default="csv")
+    parser.add_argument("--timeout", type=float, default=900)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--rss-interval", type=float, default=1.0)
+    parser.add_argument("--max-error-rate", type=float, default=0.05)
+    parser.add_argument("--max-p95-growth", type=float, default=3.0)
+    parser.add_argument("--start-servers", action="store_true", help="Launch the mock Azure OpenAI server and the app")
+    parser.add_argument("--mock-port", type=int, default=8089)
+    parser.add_argument("--mock-chat-latency", type=float, default=1.0)
+    parser.add_argument("--mock-chat-tpm", type=int, default=0)
+    parser.add_argument("--out", default="load_test_results.json")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    spec = spec_for(args.scale, args.seed)
+    upload_dir = Path(tempfile.mkdtemp(prefix="dfmea_load_"))
+    upload_files = write_corpus(generate_corpus(spec), upload_dir, "csv")
+
+    processes = start_servers(args) if args.start_servers else []
+    try:
+        test = LoadTest(args, upload_files)
+        levels = []
+        for concurrency in args.concurrency:
+            print(f"[LoadTest] ▶️ {concurrency} concurrent users × {args.requests} requests → {args.endpoint}", flush=True)
+            level = asyncio.run(test.run_level(concurrency))
+            levels.append(level)
+            lat = level["latency_s"]
+            fmt = lambda v: f"{v:.2f}s" if v is not None else "n/a"
+            rss = level["rss_bytes"]["max"]
+            rss_text = f"{rss / 2**20:.0f} MiB" if rss else "n/a"
+            print(f"[LoadTest] ✅ c={concurrency}: p50 {fmt(lat['p50'])} p95 {fmt(lat['p95'])} p99 {fmt(lat['p99'])}, "
+                  f"{level['throughput_rps']} req/s, errors {level['error_rate']:.1%}, max RSS {rss_text}", flush=True)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "corpus": spec.__dict__, "args": vars(args)},
+        "levels": levels,
+        "breakdown": find_breakdown(levels, args.max_error_rate, args.max_p95_growth),
+    }
+    if report["breakdown"]:
+        print(f"[LoadTest] ⚠️ Breaks down at {report['breakdown']['concurrency']} users: {report['breakdown']['reason']}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            report["comparison"] = compare(levels, json.load(fh).get("levels", []), args.threshold)
+        regressions = [row["concurrency"] for row in report["comparison"] if row["regression"]]
+        for row in report["comparison"]:
+            print(f"[LoadTest] c={row['concurrency']}: p95 x{row['p95_ratio']}, throughput x{row['throughput_ratio']}"
+                  f"{' 🔺 REGRESSION' if row['regression'] else ''}")
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    print(f"[LoadTest] 💾 Results written to {out}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+# benchmarks/mock_azure_openai.py
+"""Local stand-in for the Azure OpenAI embeddings and chat-completions endpoints.
+
+Point the agents at it through the usual env vars and nothing else changes::
+
+    python -m benchmarks.mock_azure_openai --port 8089 --chat-latency 1.5 --chat-tpm 200000
+    export AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8089 AZURE_OPENAI_API_KEY=mock
+
+Serves the Azure routes (``/openai/deployments/{deployment}/embeddings`` and
+``/openai/deployments/{deployment}/chat/completions``, any ``api-version``) plus the
+plain ``/v1/...`` routes. Features:
+
+* latency per call: base seconds × lognormal jitter, plus per-item (embeddings) or
+  per-chunk (streamed chat) delays;
+* per-deployment-kind RPM/TPM quotas (token buckets refilled per minute); an exhausted
+  quota answers a real 429 with ``retry-after``/``retry-after-ms`` and
+  ``x-ratelimit-remaining-*`` headers, as Azure does;
+* optional random 500s (``--error-rate``);
+* deterministic embeddings (same text → same vector; ``encoding_format=base64`` too);
+* canned DFMEA JSON completions, streamed as SSE when ``stream=true`` (including the
+  empty-``choices`` prompt-filter chunk Azure sends first).
+
+``GET /mock/stats`` returns request/429/error counts; ``POST /mock/reset`` clears them
+and refills the quotas.
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import base64
+import struct
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass, asdict, fields
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .fakes import deterministic_embedding, canned_dfmea_response
+
+
+@dataclass
+class MockConfig:
+    # Latency: seconds per call × lognormal(0, jitter)
+    embed_latency: float = 0.05
+    embed_per_item: float = 0.0005
+    embed_jitter: float = 0.3
+    chat_latency: float = 1.0
+    chat_jitter: float = 0.4
+    stream_chunk_delay: float = 0.01
+    stream_chunk_chars: int = 40
+    # Quotas per minute (0 → unlimited)
+    embed_rpm: int = 0
+    embed_tpm: int = 0
+    chat_rpm: int = 0
+    chat_tpm: int = 0
+    # Faults and content
+    error_rate: float = 0.0
+    embedding_dim: int = 1536
+    entries_per_completion: int = 3
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls, **overrides) -> "MockConfig":
+        """``MOCK_AOAI_<FIELD>`` env vars (e.g. MOCK_AOAI_CHAT_TPM) override the defaults."""
+        values = {}
+        for f in fields(cls):
+            raw = os.getenv(f"MOCK_AOAI_{f.name.upper()}")
+            if raw is not None:
+                values[f.name] = type(f.default)(raw)
+        values.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**values)
+
+
+def estimate_tokens(text: str) -> int:
+    """~4 characters per token; close enough for quota accounting."""
+    return max(1, math.ceil(len(text) / 4))
+
+
+class _Quota:
+    """Token bucket refilled continuously at ``limit`` per minute (0 → unlimited)."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.available = float(limit)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.limit, self.available + (now - self.updated) * self.limit / 60.0)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until ``amount`` fits (0 → it fits now)."""
+        if not self.limit:
+            return 0.0
+        self._refill()
+        if amount <= self.available:
+            return 0.0
+        if amount > self.limit:
+            return 60.0
+        return (amount - self.available) * 60.0 / self.limit
+
+    def take(self, amount: float):
+        if self.limit:
+            self.available -= amount
+
+    def remaining(self) -> int:
+        if not self.limit:
+            return -1
+        self._refill()
+        return max(0, int(self.available))
+
+
+class MockAzureOpenAI:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.reset()
+
+    def reset(self):
+        c = self.config
+        self.quotas = {
+            "embeddings": {"requests": _Quota(c.embed_rpm), "tokens": _Quota(c.embed_tpm)},
+            "chat": {"requests": _Quota(c.chat_rpm), "tokens": _Quota(c.chat_tpm)},
+        }
+        self.stats = {kind: {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "tokens": 0}
+                      for kind in self.quotas}
+
+    # ------------------------------------------------------------------
+    def _latency(self, base: float, jitter: float) -> float:
+        if base <= 0:
+            return 0.0
+        return base * (self.rng.lognormvariate(0.0, jitter) if jitter else 1.0)
+
+    def admit(self, kind: str, tokens: int) -> Optional[JSONResponse]:
+        """Charge the quotas, or return the 429 / injected 500 response."""
+        stats = self.stats[kind]
+        stats["requests"] += 1
+        if self.config.error_rate and self.rng.random() < self.config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": {"code": "InternalServerError",
+                                                                    "message": "Injected failure (mock)."}})
+        quota = self.quotas[kind]
+        request_wait, token_wait = quota["requests"].wait_for(1), quota["tokens"].wait_for(tokens)
+        wait = max(request_wait, token_wait)
+        headers = self.rate_headers(kind)
+        if wait > 0:
+            stats["rate_limited"] += 1
+            headers.update({"retry-after": str(max(1, math.ceil(wait))), "retry-after-ms": str(int(wait * 1000))})
+            limit = "call rate limit" if request_wait >= token_wait else "token rate limit"
+            message = (f"Requests to the {kind} operation have exceeded the {limit} of your current "
+                       f"pricing tier. Please retry after {math.ceil(wait)} seconds.")
+            return JSONResponse(status_code=429, headers=headers, content={"error": {"code": "429", "message": message}})
+        quota["requests"].take(1)
+        quota["tokens"].take(tokens)
+        stats["tokens"] += tokens
+        return None
+
+    def rate_headers(self, kind: str) -> Dict[str, str]:
+        quota = self.quotas[kind]
+        return {
+            "x-ratelimit-remaining-requests": str(quota["requests"].remaining()),
+            "x-ratelimit-remaining-tokens": str(quota["tokens"].remaining()),
+        }
+
+    # ------------------------------------------------------------------
+    async def embeddings(self, deployment: str, body: Dict):
+        c = self.config
+        inputs = body.get("input")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        texts = [t if isinstance(t, str) else json.dumps(t) for t in inputs]
+        tokens = sum(estimate_tokens(t) for t in texts)
+        rejected = self.admit("embeddings", tokens)
+        if rejected is not None:
+            return rejected
+
+        await asyncio.sleep(self._latency(c.embed_latency, c.embed_jitter) + c.embed_per_item * len(texts))
+        dim = int(body.get("dimensions") or c.embedding_dim)
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(texts):
+            vector = deterministic_embedding(text, dim)
+            embedding = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode("ascii") if as_base64 else vector
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        self.stats["embeddings"]["ok"] += 1
+        return JSONResponse(
+            headers=self.rate_headers("embeddings"),
+            content={"object": "list", "data": data, "model": deployment,
+                     "usage": {"prompt_tokens": tokens, "total_tokens": tokens}},
+        )
+
+    async def chat(self, deployment: str, body: Dict):
+        c = self.config
+        messages = body.get("messages") or []
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        prompt_tokens = estimate_tokens(prompt)
+        # Azure charges the requested completion budget against TPM up front
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or 1000
+        rejected = self.admit("chat", prompt_tokens + int(max_tokens))
+        if rejected is not None:
+            return rejected
+
+        content = canned_dfmea_response(prompt, c.entries_per_completion)
+        completion_tokens = estimate_tokens(content)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        self.stats["chat"]["ok"] += 1
+
+        if not body.get("stream"):
+            await asyncio.sleep(self._latency(c.chat_latency, c.chat_jitter))
+            return JSONResponse(headers=self.rate_headers("chat"), content={
+                "id": completion_id, "object": "chat.completion", "created": created, "model": deployment,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+        first_byte = self._latency(c.chat_latency, c.chat_jitter)
+
+        async def events():
+            def event(choices: List[Dict], **extra) -> str:
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": deployment, "choices": choices, **extra}
+                return f"data: {json.dumps(chunk)}\n\n"
+
+            yield event([], prompt_filter_results=[{"prompt_index": 0, "content_filter_results": {}}])
+            await asyncio.sleep(first_byte)
+            yield event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for i in range(0, len(content), c.stream_chunk_chars):
+                if c.stream_chunk_delay:
+                    await asyncio.sleep(c.stream_chunk_delay)
+                yield event([{"index": 0, "delta": {"content": content[i:i + c.stream_chunk_chars]},
+                              "finish_reason": None}])
+            yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=self.rate_headers("chat"))
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    mock = MockAzureOpenAI(config or MockConfig.from_env())
+    app = FastAPI(title="Mock Azure OpenAI")
+    app.state.mock = mock
+
+    @app.post("/openai/deployments/{deployment}/embeddings")
+    async def azure_embeddings(deployment: str, request: Request):
+        return await mock.embeddings(deployment, await request.json())
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def azure_chat(deployment: str, request: Request):
+        return await mock.chat(deployment, await request.json())
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        return await mock.embeddings(body.get("model", "mock"), body)
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        return await mock.chat(body.get("model", "mock"), body)
+
+    @app.get("/mock/stats")
+    async def stats():
+        return {"config": asdict(mock.config), "stats": mock.stats}
+
+    @app.post("/mock/reset")
+    async def reset():
+        mock.reset()
+        return {"status": "ok"}
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Mock Azure OpenAI server (embeddings + chat completions)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    for f in fields(MockConfig):
+        parser.add_argument(f"--{f.name.replace('_', '-')}", type=type(f.default), default=None,
+                            help=f"default {f.default} (env MOCK_AOAI_{f.name.upper()})")
+    args = vars(parser.parse_args(argv))
+    host, port = args.pop("host"), args.pop("port")
+
+    import uvicorn
+
+    uvicorn.run(create_app(MockConfig.from_env(**args)), host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
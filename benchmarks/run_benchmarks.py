@@ -0,0 +1,365 @@
+# benchmarks/run_benchmarks.py
+"""Reproducible DFMEA pipeline benchmarks → machine-readable JSON.
+
+Runs against a seeded synthetic corpus (``benchmarks.corpus``), in-process fake
+Azure OpenAI clients (``benchmarks.fakes``) and an embedded Qdrant
+(``QDRANT_LOCATION``, default ``:memory:``), so results depend on the code and the
+machine only. Run from the repository root::
+
+    python -m benchmarks.run_benchmarks --scale small --out bench/HEAD.json
+    python -m benchmarks.run_benchmarks --scale small --baseline bench/main.json --fail-on-regression
+
+Each benchmark reports min/median/mean/stdev wall time over ``--repeats`` runs (after
+``--warmup`` runs) and throughput at the median. ``--baseline`` compares medians
+against an earlier results file.
+"""
+
+import os
+
+# Offline defaults; must be set before the agents are imported
+os.environ.setdefault("QDRANT_LOCATION", ":memory:")
+os.environ.setdefault("LLM_CACHE_ENABLED", "0")
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:9")
+os.environ.setdefault("AZURE_OPENAI_API_VERSION", "2024-06-01")
+os.environ.setdefault("AZURE_OPENAI_EMBEDDING_API_VERSION", "2024-06-01")
+os.environ.setdefault("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import io
+import sys
+import json
+import time
+import asyncio
+import logging
+import platform
+import argparse
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+from dataclasses import asdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from server.agents.chunking_agent import ChunkingAgent
+from server.agents.embedding_agent import EmbeddingAgent
+from server.agents.vectorstore_agent import VectorStoreAgent
+from server.agents.context_agent import ContextAgent
+from server.agents.llm_scheduler import LLMScheduler
+
+from .corpus import SCALES, PRODUCTS, select_pairs, spec_for, generate_corpus
+from .fakes import FakeEmbeddingClient, FakeChatClient
+
+QUERY = "Generate DFMEA entries for the selected products"
+
+
+def _quiet(fn: Callable):
+    """Run ``fn`` with agent prints and INFO logs swallowed (still formatted → still timed)."""
+    def wrapper(*args, **kwargs):
+        previous = logging.root.manager.disable
+        logging.disable(logging.INFO)
+        try:
+            with redirect_stdout(io.StringIO()):
+                return fn(*args, **kwargs)
+        finally:
+            logging.disable(previous)
+    return wrapper
+
+
+def measure(fn: Callable, repeats: int, warmup: int, setup: Optional[Callable] = None) -> List[float]:
+    """Wall time of ``fn(state)`` per run; ``setup()`` (untimed) builds each run's state."""
+    times = []
+    for i in range(warmup + repeats):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        fn(state)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    return times
+
+
+def summarize(times: List[float], items: int, unit: str, **extra) -> Dict:
+    median = statistics.median(times)
+    return {
+        "runs": [round(t, 6) for t in times],
+        "min_s": round(min(times), 6),
+        "median_s": round(median, 6),
+        "mean_s": round(statistics.fmean(times), 6),
+        "stdev_s": round(statistics.stdev(times), 6) if len(times) > 1 else 0.0,
+        "items": items,
+        "unit": unit,
+        "throughput_per_s": round(items / median, 3) if median > 0 else None,
+        **extra,
+    }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class BenchmarkSuite:
+    def __init__(self, args):
+        self.args = args
+        self.spec = spec_for(args.scale, args.seed)
+        self.corpus = generate_corpus(self.spec)
+        self.rows = self.corpus["prds"] + self.corpus["knowledge_base"] + self.corpus["field_issues"]
+        self._chunks = None
+        self._embedded = None
+        self._collection = None
+
+    # ------------------------------------------------------------------
+    # Shared fixtures (built once, outside the timed regions)
+    def chunks(self) -> List[Dict]:
+        if self._chunks is None:
+            self._chunks = _quiet(ChunkingAgent().run)(
+                self.corpus["prds"], self.corpus["knowledge_base"], self.corpus["field_issues"]
+            )
+        return self._chunks
+
+    def embedded(self) -> List[Dict]:
+        if self._embedded is None:
+            agent = self._embedding_agent(latency=0.0)
+            self._embedded = _quiet(asyncio.run)(agent.embed_chunks_async([dict(c) for c in self.chunks()]))
+        return self._embedded
+
+    def collection(self) -> str:
+        """A collection holding the embedded corpus, for search and generation."""
+        if self._collection is None:
+            self._collection = f"bench_{self.args.seed}_search"
+            store = VectorStoreAgent(collection_name=self._collection)
+            _quiet(store.create_collection)(self.args.dim)
+            _quiet(store.add_embeddings)(self.embedded())
+        return self._collection
+
+    def _embedding_agent(self, latency: float) -> EmbeddingAgent:
+        agent = EmbeddingAgent()
+        agent.client = FakeEmbeddingClient(dim=self.args.dim, latency=latency, seed=self.args.seed)
+        return agent
+
+    def _vectorstore(self, collection: str) -> VectorStoreAgent:
+        store = VectorStoreAgent(collection_name=collection)
+        store._embedding_client = FakeEmbeddingClient(dim=self.args.dim, seed=self.args.seed)
+        return store
+
+    # ------------------------------------------------------------------
+    # Benchmarks
+    def bench_chunking_format_rows(self) -> Dict:
+        agent = ChunkingAgent()
+        times = measure(lambda _: [agent._format_row_as_text(row) for row in self.rows],
+                        self.args.repeats, self.args.warmup)
+        return summarize(times, len(self.rows), "rows")
+
+    def bench_chunking_token_slice(self) -> Dict:
+        agent = ChunkingAgent()
+        merged = (agent._create_chunks(self.corpus["prds"], "prds")
+                  + agent._create_chunks(self.corpus["knowledge_base"], "knowledge_bank")
+                  + agent._create_chunks(self.corpus["field_issues"], "field_issues"))
+        times = measure(_quiet(lambda _: agent._token_slice_chunks(merged)), self.args.repeats, self.args.warmup)
+        return summarize(times, len(merged), "chunks", output_chunks=len(agent._token_slice_chunks(merged)))
+
+    def bench_chunking_run(self) -> Dict:
+        times = measure(
+            _quiet(lambda agent: agent.run(self.corpus["prds"], self.corpus["knowledge_base"], self.corpus["field_issues"])),
+            self.args.repeats, self.args.warmup, setup=ChunkingAgent,
+        )
+        return summarize(times, len(self.rows), "rows", chunks=len(self.chunks()))
+
+    def bench_embedding_embed_chunks(self) -> Dict:
+        chunks = self.chunks()
+
+        def setup():
+            return self._embedding_agent(self.args.embed_latency), [dict(c) for c in chunks]
+
+        times = measure(_quiet(lambda state: asyncio.run(state[0].embed_chunks_async(state[1]))),
+                        self.args.repeats, self.args.warmup, setup=setup)
+        agent = self._embedding_agent(0.0)
+        return summarize(times, len(chunks), "chunks", batch_size=agent.batch_size,
+                         concurrency=agent.concurrency, simulated_latency_s=self.args.embed_latency)
+
+    def bench_vectorstore_add_embeddings(self) -> Dict:
+        embedded = self.embedded()
+        runs = iter(range(1_000_000))
+
+        def setup():
+            store = VectorStoreAgent(collection_name=f"bench_{self.args.seed}_upsert_{next(runs)}")
+            _quiet(store.create_collection)(self.args.dim)
+            return store
+
+        def upsert(store):
+            _quiet(store.add_embeddings)(embedded)
+            store.client.delete_collection(store.collection_name)
+
+        times = measure(upsert, self.args.repeats, self.args.warmup, setup=setup)
+        return summarize(times, len(embedded), "vectors", dim=self.args.dim)
+
+    def bench_vectorstore_search(self) -> Dict:
+        store = self._vectorstore(self.collection())
+        queries = [f"{QUERY} | Product: {p} | Subproduct: {s}" for p, subs in PRODUCTS.items() for s in subs]
+        latencies: List[float] = []
+
+        def search_all(_):
+            for q in queries:
+                start = time.perf_counter()
+                store.search(q, top_k=self.args.top_k)
+                latencies.append(time.perf_counter() - start)
+
+        times = measure(_quiet(search_all), self.args.repeats, self.args.warmup)
+        latencies = latencies[self.args.warmup * len(queries):]
+        return summarize(times, len(queries), "queries", top_k=self.args.top_k,
+                         query_p50_s=round(_percentile(latencies, 0.5), 6),
+                         query_p95_s=round(_percentile(latencies, 0.95), 6))
+
+    def bench_vectorstore_search_many(self) -> Dict:
+        store = self._vectorstore(self.collection())
+        queries = [f"{QUERY} | Product: {p} | Subproduct: {s}" for p, subs in PRODUCTS.items() for s in subs]
+        times = measure(_quiet(lambda _: store.search_many(queries, top_k=self.args.top_k)),
+                        self.args.repeats, self.args.warmup)
+        return summarize(times, len(queries), "queries", top_k=self.args.top_k)
+
+    def bench_context_run(self) -> Dict:
+        collection = self.collection()
+        products, subproducts = select_pairs(self.args.products, self.args.subproducts)
+        last = {}
+
+        def setup():
+            llm = FakeChatClient(latency=self.args.llm_latency, jitter=self.args.llm_jitter, seed=self.args.seed)
+            agent = ContextAgent(
+                llm,
+                collection_name=collection,
+                scheduler=LLMScheduler(max_concurrency=self.args.llm_concurrency),
+                fusion=self.args.fusion,
+                early_stop=self.args.early_stop,
+            )
+            agent.vectorstore._embedding_client = FakeEmbeddingClient(dim=self.args.dim, seed=self.args.seed)
+            return agent, llm
+
+        def run(state):
+            agent, llm = state
+            entries = asyncio.run(agent.run(QUERY, products, subproducts, top_k=self.args.top_k,
+                                            chunk_cap=self.args.top_k))
+            last.update(entries=len(entries), llm_calls=llm.calls, stats=agent.stats)
+
+        times = measure(_quiet(run), self.args.repeats, self.args.warmup, setup=setup)
+        return summarize(times, last["llm_calls"], "llm_calls", pairs=len(products) * len(subproducts),
+                         entries=last["entries"], simulated_latency_s=self.args.llm_latency,
+                         generation_stats=last["stats"])
+
+    BENCHMARKS = {
+        "chunking.format_row_as_text": bench_chunking_format_rows,
+        "chunking.token_slice_chunks": bench_chunking_token_slice,
+        "chunking.run": bench_chunking_run,
+        "embedding.embed_chunks_async": bench_embedding_embed_chunks,
+        "vectorstore.add_embeddings": bench_vectorstore_add_embeddings,
+        "vectorstore.search": bench_vectorstore_search,
+        "vectorstore.search_many": bench_vectorstore_search_many,
+        "context.run": bench_context_run,
+    }
+
+    def run(self, only: Optional[List[str]] = None) -> Dict[str, Dict]:
+        results = {}
+        for name, bench in self.BENCHMARKS.items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            print(f"[Benchmarks] ▶️ {name} ...", flush=True)
+            results[name] = bench(self)
+            r = results[name]
+            print(f"[Benchmarks] ✅ {name}: median {r['median_s']:.4f}s "
+                  f"({r['throughput_per_s']} {r['unit']}/s)", flush=True)
+        return results
+
+
+# ----------------------------------------------------------------------
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def metadata(args, spec) -> Dict:
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": asdict(spec),
+        "args": vars(args),
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[Dict]:
+    """Median-time ratios vs. ``baseline``; ``regression`` when slower by more than ``threshold``."""
+    rows = []
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["median_s"], current["median_s"]
+        ratio = after / before if before else None
+        rows.append({
+            "name": name,
+            "baseline_median_s": before,
+            "median_s": after,
+            "ratio": round(ratio, 3) if ratio is not None else None,
+            "regression": ratio is not None and ratio > 1 + threshold,
+        })
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--only", nargs="*", help="Benchmark name prefixes, e.g. chunking vectorstore.search")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension of the fake clients")
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--products", type=int, default=2)
+    parser.add_argument("--subproducts", type=int, default=3)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Simulated seconds per embeddings call")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per chat completion")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Lognormal sigma applied to --llm-latency")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--fusion", action="store_true", help="Fuse pairs with overlapping evidence in context.run")
+    parser.add_argument("--early-stop", action="store_true", help="Stop pairs that stop yielding new failure modes")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare medians against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown before flagging (0.10 = 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    suite = BenchmarkSuite(args)
+    results = suite.run(args.only)
+    report = {"meta": metadata(args, suite.spec), "results": results}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        report["comparison"] = compare(results, baseline.get("results", {}), args.threshold)
+        report["comparison_baseline"] = {"path": args.baseline, "git_commit": baseline.get("meta", {}).get("git_commit")}
+        for row in report["comparison"]:
+            flag = "🔺 REGRESSION" if row["regression"] else ""
+            print(f"[Benchmarks] {row['name']}: {row['baseline_median_s']:.4f}s → {row['median_s']:.4f}s "
+                  f"(x{row['ratio']}) {flag}")
+        regressions = [row["name"] for row in report["comparison"] if row["regression"]]
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    print(f"[Benchmarks] 💾 Results written to {out}")
+
+    if regressions and args.fail_on_regression:
+        print(f"[Benchmarks] ❌ {len(regressions)} regressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,21 @@
 # server/agents/chunking_agent.py
 
+import time
 import uuid
 import tiktoken
 import warnings
+from pathlib import Path
 from tqdm import tqdm
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import tiktoken
 
+# Chunk source label per upload field (KB rows are tagged "knowledge_bank")
+SOURCE_LABELS = {"prds": "prds", "knowledge_base": "knowledge_bank", "field_issues": "field_issues"}
+
 class ChunkingAgent:
     def __init__(self, max_tokens=1000, overlap=50, model_name="text-embedding-3-small"):
         self.encoder = tiktoken.encoding_for_model(model_name)
+        self.model_name = model_name
         self.max_tokens = max_tokens
         self.overlap = overlap
         self.global_stats = {"total_chunks": 0, "total_tokens": 0, "sources": {}}
@@ -59,32 +65,18 @@ class ChunkingAgent:
         local_stats = {}
         for chunk in tqdm(chunks, desc="[ChunkingAgent] Token slicing"):
             source = chunk["metadata"].get("source", "unknown")
-            tokens = self.encoder.encode(chunk["text"])
+            pieces = self._slice_text(chunk["text"])
 
             if source not in local_stats:
                 local_stats[source] = {"tokens": 0, "chunks": 0}
-            local_stats[source]["tokens"] += len(tokens)
+            # Consecutive slices share exactly ``overlap`` tokens; count the text's own tokens once
+            local_stats[source]["tokens"] += sum(count for _, count in pieces) - self.overlap * (len(pieces) - 1)
+            local_stats[source]["chunks"] += len(pieces)
 
-            if len(tokens) <= self.max_tokens:
+            if len(pieces) == 1:
                 sliced_chunks.append(chunk)
-                local_stats[source]["chunks"] += 1
                 continue
-
-            start = 0
-            while start < len(tokens):
-                end = min(start + self.max_tokens, len(tokens))
-                token_slice = tokens[start:end]
-                text_slice = self.encoder.decode(token_slice)
-
-                sliced_chunks.append({
-                    "text": text_slice,
-                    "metadata": chunk["metadata"]
-                })
-                local_stats[source]["chunks"] += 1
-
-                if end == len(tokens):
-                    break
-                start += self.max_tokens - self.overlap
+            sliced_chunks.extend({"text": text_slice, "metadata": chunk["metadata"]} for text_slice, _ in pieces)
 
         # Update global stats
         for src, stats in local_stats.items():
@@ -98,6 +90,55 @@ class ChunkingAgent:
 
         return sliced_chunks
 
+    def _slice_text(self, text: str) -> List[Tuple[str, int]]:
+        """Token-slice one text into (text, token_count) pieces with overlap."""
+        tokens = self.encoder.encode(text)
+        if len(tokens) <= self.max_tokens:
+            return [(text, len(tokens))]
+        pieces = []
+        start = 0
+        while start < len(tokens):
+            end = min(start + self.max_tokens, len(tokens))
+            pieces.append((self.encoder.decode(tokens[start:end]), end - start))
+            if end == len(tokens):
+                break
+            start += self.max_tokens - self.overlap
+        return pieces
+
+    def slice_rows(self, rows: List[Dict]) -> Dict:
+        """Chunk parsed rows into compact parallel lists (cheap to pickle across processes)."""
+        texts, row_ids, tokens = [], [], []
+        for row_id, row in enumerate(rows):
+            text = self._format_row_as_text(row)
+            if not text.strip():
+                continue
+            for piece, count in self._slice_text(text):
+                texts.append(piece)
+                row_ids.append(row_id)
+                tokens.append(count)
+        return {"texts": texts, "row_ids": row_ids, "tokens": tokens}
+
+    def from_results(self, results: List[Dict]) -> List[Dict]:
+        """Assemble chunk dicts from ``parse_and_chunk_file`` results (same order as ``run``)."""
+        order = {label: i for i, label in enumerate(SOURCE_LABELS.values())}
+        all_chunks = []
+        for result in sorted(results, key=lambda r: order.get(r["source"], len(order))):
+            source = result["source"]
+            stats = self.global_stats["sources"].setdefault(source, {"tokens": 0, "chunks": 0})
+            metadata = {}
+            for text, row_id, count in zip(result["texts"], result["row_ids"], result["tokens"]):
+                # Slices of one row share its metadata, as in _token_slice_chunks
+                if row_id not in metadata:
+                    metadata[row_id] = {"uuid": str(uuid.uuid4()), "source": source}
+                all_chunks.append({"text": text, "metadata": metadata[row_id], "tokens": count})
+            # Count each row's own tokens once, as run() does: n slices share n - 1 overlaps
+            tokens = sum(result["tokens"]) - self.overlap * (len(result["row_ids"]) - len(metadata))
+            stats["chunks"] += len(result["texts"])
+            stats["tokens"] += tokens
+            self.global_stats["total_chunks"] += len(result["texts"])
+            self.global_stats["total_tokens"] += tokens
+        return all_chunks
+
     def print_summary(self):
         print("\n[ChunkingAgent] === Chunking Summary ===")
         print(f"Total Chunks: {self.global_stats['total_chunks']}")
@@ -106,3 +147,29 @@ class ChunkingAgent:
             print(f"  └── {src}: {stats['chunks']} chunks, {stats['tokens']} tokens")
 
 
+
+
+# One agent per worker process (the tiktoken encoder is loaded once, not per file)
+_WORKER_AGENTS: Dict[tuple, ChunkingAgent] = {}
+
+
+def parse_and_chunk_file(path: str, source: str, max_tokens: int = 1000, overlap: int = 50,
+                         model_name: str = "text-embedding-3-small") -> Dict:
+    """Process-pool task: parse one uploaded file and chunk its rows.
+
+    Returns compact parallel lists (texts, row ids, token counts) rather than chunk
+    dicts; ``ChunkingAgent.from_results`` rebuilds the chunks in the parent process.
+    """
+    from server.utils.file_parser import parse_file
+
+    key = (max_tokens, overlap, model_name)
+    agent = _WORKER_AGENTS.get(key)
+    if agent is None:
+        agent = _WORKER_AGENTS[key] = ChunkingAgent(max_tokens=max_tokens, overlap=overlap, model_name=model_name)
+
+    start = time.perf_counter()
+    rows = parse_file(Path(path))
+    parsed = time.perf_counter()
+    sliced = agent.slice_rows(rows)
+    timings = {"parse": parsed - start, "chunk": time.perf_counter() - parsed}
+    return {"path": path, "source": source, "rows": len(rows), **sliced, "timings": timings}
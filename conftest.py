@@ -0,0 +1,58 @@
+# Test setup: the agents are the ``server.agents`` package of the application (relative
+# imports plus ``server.utils.logger``). When pytest runs from this directory on its own,
+# register it under that package name so ``from server.agents.x import y`` resolves.
+
+import sys
+import types
+import logging
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent
+
+
+def _package(name: str, path=None) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__path__ = [str(path)] if path else []
+    sys.modules[name] = module
+    return module
+
+
+try:
+    import server.agents  # noqa: F401  (inside the full application tree)
+except ImportError:
+    server = sys.modules.get("server") or _package("server")
+    server.agents = _package("server.agents", ROOT)
+
+try:
+    import server.utils.logger  # noqa: F401
+except ImportError:
+    utils = sys.modules.get("server.utils") or _package("server.utils")
+    sys.modules["server"].utils = utils
+    utils.logger = types.ModuleType("server.utils.logger")
+    utils.logger.logger = logging.getLogger("dfmea_app")
+    sys.modules["server.utils.logger"] = utils.logger
+
+
+class WordEncoder:
+    """Whitespace tokenizer standing in for tiktoken, whose BPE files download on first use."""
+
+    name = "words"
+
+    def encode(self, text: str):
+        return text.split(" ")
+
+    def decode(self, tokens) -> str:
+        return " ".join(tokens)
+
+
+@pytest.fixture
+def word_encoder(monkeypatch):
+    """Make every tiktoken encoding lookup return a ``WordEncoder`` (offline, predictable)."""
+    import tiktoken
+
+    encoder = WordEncoder()
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: encoder)
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: encoder)
+    return encoder
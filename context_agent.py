@@ -1,133 +1,483 @@
-import re
-import json
+import time
 import asyncio
-from typing import List, Dict, Optional
+import threading
+from typing import List, Dict, Optional, Callable, AsyncIterator
 from .vectorstore_agent import VectorStoreAgent
+from .rerank_agent import RerankAgent
+from .prompt_builder import PromptBuilder, DFMEA_RESPONSE_SCHEMA
+from .llm_scheduler import LLMScheduler, Attempt, CallCancelled, get_scheduler
+from .entry_parser import IncrementalEntryParser, repair_entries
+from .llm_cache import LLMResponseCache, get_cache
+from .novelty_tracker import NoveltyTracker
+from .metrics import STAGE_SECONDS, BATCH_SIZE, RATE_LIMITED, RETRIES, TOKENS, CACHE, is_rate_limit
+from .tracing import span, current_span
+from . import profiling
+
+# Chunker tags KB rows "knowledge_bank"; older indexes used "knowledge_base"
+KB_SOURCES = ("knowledge_bank", "knowledge_base")
 
 
 class ContextAgent:
-    def __init__(self, llm_client, batch_size: int = 10, collection_name: str = "dfmea_collection"):
+    def __init__(
+        self,
+        llm_client,
+        batch_size: int = 10,
+        collection_name: str = "dfmea_collection",
+        rerank: bool = False,
+        rerank_top_n: int = 30,
+        mmr_lambda: float = 0.5,
+        model: str = "gpt-4o",
+        batching: str = "fixed",
+        batch_token_budget: int = 8000,
+        context_window: int = 128000,
+        max_output_tokens: int = 4096,
+        tpm_limit: Optional[int] = None,
+        scheduler: Optional[LLMScheduler] = None,
+        cache: Optional[LLMResponseCache] = None,
+        cache_bypass: bool = False,
+        structured_output: bool = False,
+        parse_retries: int = 1,
+        early_stop: bool = False,
+        early_stop_window: int = 2,
+        early_stop_min_new: float = 0.2,
+        fusion: bool = False,
+        fusion_threshold: float = 0.8,
+        fusion_max_pairs: int = 4,
+        request_budget: Optional[float] = None,
+        hedge: bool = False,
+    ):
         self.llm_client = llm_client
         self.batch_size = batch_size
         # 🔑 always bind to a specific collection name
         self.vectorstore = VectorStoreAgent(collection_name=collection_name)
-
-
-    def _build_prompt(
-    self,
-    products: List[str],
-    subproducts: List[str],
-    focus: Optional[str],
-    prd_chunks: List[str],
-    kb_chunks: List[str],
-    field_chunks: List[str],
-) -> str:
-        """Zebra-specific DFMEA prompt with strict product/subproduct mapping."""
-
-        return f"""
-    You are a senior DFMEA analyst at Zebra Technologies.
-
-    Task:
-    Generate hardware-focused DFMEA entries strictly in JSON format. 
-    Do not include explanations, commentary, or markdown formatting. 
-    The output must be valid JSON that can be parsed directly.
-
-    Context:
-    - Products: {", ".join(products)}
-    - Subproducts: {", ".join(subproducts)}
-    - PRD Evidence (sample):{ "\n".join(prd_chunks[:10]) }
-    - Knowledge Base Evidence (sample):{ "\n".join(kb_chunks[:10]) }
-    - Field Issue Evidence (sample):{ "\n".join(field_chunks[:10]) }
-    
-    
-
-    Instructions:
-    - Create **one DFMEA entry for every unique issue, failure mode, or risk** found in the chunks.
-    - Each entry **must be tied to exactly ONE product from the provided product list**.
-    - Each entry **must also be tied to exactly ONE subproduct from the provided subproduct list**.
-    - Do **NOT** use generic placeholders like "All". Always pick the most relevant product and subproduct.
-    - If multiple products or subproducts are relevant, duplicate the entry and assign one product/subproduct per entry.
-    - At least **one entry per batch must explicitly leverage field issue evidence**.
-
-    Required JSON Output:
-    {{
-    "entries": [
-        {{
-        "Product": "one specific product from [{', '.join(products)}]",
-        "Subproducts": "one specific subproduct from [{', '.join(subproducts)}]",
-        "Function": "Component purpose from PRD",
-        "Potential Failure Mode": "Hardware failure description",
-        "Potential Effects": ["Impact on device operation"],
-        "Potential Causes": ["Root causes (design, manufacturing, usage)"],
-        "Severity": 1-10,
-        "Occurrence": 1-10,
-        "Detection": 1-10,
-        "RPN": "Must equal Severity × Occurrence × Detection (integer only)",
-        "Controls Prevention": ["Prevention actions"],
-        "Controls Detection": ["Detection/QA methods"],
-        "linked_to_kb": true
-        }}
-    ]
-    }}
-
-    Zebra-Specific Rules:
-    1. Base entries on the provided evidence; where gaps exist, infer intelligently from field_issues.
-    2. Return **pure valid JSON** only (no markdown, no commentary).
-    3. Generate 1–3 DFMEA entries per batch.
-    4. Ensure numeric fields are integers, never leave arrays empty, focus exclusively on hardware issues, and avoid redundant or generic statements.
-    5. Apply Zebra severity scale:
-    - 9-10: Safety/Legal impact
-    - 7-8: Device inoperable
-    - 4-6: Reduced performance
-    - 1-3: Cosmetic
-    
-    """ + (f"\nZebra Engineering Focus: {focus}" if focus else "")
-
-
-
-    def _parse_llm_response(self, raw_response: str) -> List[Dict]:
-        """Cleans and parses LLM JSON output."""
-        cleaned = re.sub(r"^```(json)?", "", raw_response.strip(), flags=re.IGNORECASE | re.MULTILINE)
-        cleaned = re.sub(r"```$", "", cleaned.strip(), flags=re.MULTILINE)
-
+        # Optional MMR stage: keep a smaller, diverse subset of the retrieved chunks
+        self.reranker = RerankAgent(top_n=rerank_top_n, lambda_mult=mmr_lambda) if rerank else None
+        self.model = model
+        self.prompt_builder = PromptBuilder(model=model)
+        # "fixed" → batch_size chunks per call; "tokens" → pack chunks up to a token budget
+        if batching not in ("fixed", "tokens"):
+            raise ValueError("batching must be 'fixed' or 'tokens'.")
+        self.batching = batching
+        self.batch_token_budget = batch_token_budget
+        self.context_window = context_window
+        self.max_output_tokens = max_output_tokens
+        self.tpm_limit = tpm_limit
+        # Shared across all requests in the process unless one is injected
+        self.scheduler = scheduler or get_scheduler()
+        # Deterministic (temperature=0) responses are cached on disk; bypass skips reads only
+        self.cache = cache if cache is not None else get_cache()
+        self.cache_bypass = cache_bypass
+        # Ask for schema-constrained JSON; unparseable batches are retried on their own
+        self.structured_output = structured_output
+        self.parse_retries = parse_retries
+        # Stop a pair once its last `early_stop_window` batches add < `early_stop_min_new` new entries
+        self.early_stop = early_stop
+        self.early_stop_window = early_stop_window
+        self.early_stop_min_new = early_stop_min_new
+        # Pairs whose retrieved chunks overlap ≥ fusion_threshold (Jaccard) share one prompt
+        self.fusion = fusion
+        self.fusion_threshold = fusion_threshold
+        self.fusion_max_pairs = fusion_max_pairs
+        # Wall-clock budget (seconds) for a whole run; each LLM call gets what is left as its timeout
+        self.request_budget = request_budget
+        self._deadline: Optional[float] = None
+        # Duplicate calls that run past the scheduler's observed p95 latency (non-streamed only)
+        self.hedge = hedge
+        # Run statistics (updated from worker threads → guarded by a lock)
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "prompt_tokens": {"static": 0, "pair": 0, "batch": 0, "total": 0},
+            "cache": {"hits": 0, "misses": 0},
+            "parse": {"batches": 0, "ok": 0, "repaired": 0, "failed": 0, "retries": 0},
+            "early_stop": {"pairs_stopped": 0, "batches_skipped": 0, "batches_cancelled": 0, "prompt_tokens_saved": 0},
+            "fusion": {"groups": 0, "pairs_fused": 0, "unmatched_entries": 0},
+            "deadline": {"skipped_batches": 0, "timed_out_batches": 0},
+        }
+
+
+    def _llm_params(self) -> Dict:
+        """Completion parameters shared by every call path (and part of the cache key)."""
+        params = {"temperature": 0}
+        if self.structured_output:
+            params["response_format"] = {"type": "json_schema", "json_schema": DFMEA_RESPONSE_SCHEMA}
+        return params
+
+    def _cacheable(self, content: str) -> bool:
+        """Only clean, fully parseable responses are worth replaying from the cache."""
+        return bool(content) and repair_entries(content)[1] == "ok"
+
+    def _cache_key(self, messages: List[Dict]) -> Optional[str]:
+        """Cache key for a prompt; None when caching is off."""
+        if self.cache is None:
+            return None
+        return self.cache.make_key(self.model, self._llm_params(), messages)
+
+    def _cache_get(self, key: Optional[str], count_miss: bool = True) -> Optional[str]:
+        """Cached response for ``key``, honouring ``cache_bypass``; the lookup is counted.
+
+        ``count_miss=False`` for a second look at a prompt whose miss was already counted.
+        """
+        if key is None:
+            return None
+        cached = None if self.cache_bypass else self.cache.get(key)
+        if cached is None and not count_miss:
+            return None
+        with self._stats_lock:
+            self.stats["cache"]["hits" if cached is not None else "misses"] += 1
+        CACHE.inc(result="hit" if cached is not None else "miss")
+        return cached
+
+    def _replay_cached(
+        self,
+        batch_chunks: List[str],
+        pair_context: Dict,
+        emit: Optional[Callable[[Dict], None]] = None,
+    ) -> Optional[List[Dict]]:
+        """Entries of this batch's cached response, or None on a miss.
+
+        Runs before the batch is submitted to the scheduler, so a hit takes no
+        concurrency slot and no TPM/RPM budget; only misses are scheduled.
+        """
+        prompt = self.prompt_builder.build(pair_context, batch_chunks)
+        cached = self._cache_get(self._cache_key(prompt["messages"]))
+        if cached is None:
+            return None
+
+        # Only fully parseable responses are cached → no repair or retry needed
+        entries, status = repair_entries(cached)
+        if emit is not None:
+            for entry in entries:
+                emit(entry)
+        self._record_parse(status)
+        return entries
+
+    def _start_deadline(self):
+        self._deadline = time.monotonic() + self.request_budget if self.request_budget else None
+
+    def _time_left(self) -> Optional[float]:
+        return None if self._deadline is None else self._deadline - time.monotonic()
+
+    def _deadline_passed(self) -> bool:
+        left = self._time_left()
+        return left is not None and left <= 0
+
+    def _timeout_kwargs(self) -> Dict:
+        """Per-call ``timeout`` from the remaining request budget (not part of the cache key)."""
+        left = self._time_left()
+        if left is None:
+            return {}
+        if left <= 0:
+            raise TimeoutError("request budget exhausted")
+        return {"timeout": left}
+
+    def _call_azure_openai(
+        self,
+        prompt,
+        attempt: Optional[Attempt] = None,
+        usage: Optional[Dict] = None,
+        miss_counted: bool = False,
+    ) -> str:
+        """Synchronous wrapper to call Azure OpenAI (prompt = str or chat messages).
+
+        Deterministic responses are answered from the cache when possible
+        (``miss_counted``: the caller already counted this prompt's cache miss).
+        Completion tokens are added to ``usage`` rather than recorded, so the caller
+        can account only the attempt whose result it keeps.
+        """
+        messages = prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}]
+        key = self._cache_key(messages)
+        cached = self._cache_get(key, count_miss=not miss_counted)
+        if cached is not None:
+            if usage is not None:
+                usage["calls"] -= 1  # answered without a model call
+            current_span().set(cached=True)
+            return cached
+        if attempt is not None:
+            attempt.check()
+        start = time.perf_counter()
         try:
-            parsed = json.loads(cleaned)
-            return parsed.get("entries", []) if isinstance(parsed, dict) else []
-        except json.JSONDecodeError:
-            print("[ContextAgent] JSON decode failed after cleanup.")
-            return []
-
-    def _call_azure_openai(self, prompt: str) -> str:
-        """Synchronous wrapper to call Azure OpenAI."""
-        response = self.llm_client.chat.completions.create(
-            model="gpt-4o",  # update if needed
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        return response.choices[0].message.content
+            response = self.llm_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                **self._llm_params(),
+                **self._timeout_kwargs(),
+            )
+        except Exception as e:
+            if is_rate_limit(e):
+                RATE_LIMITED.inc(component="llm")
+            raise
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage="llm")
+        if attempt is not None:
+            attempt.record_latency(elapsed)
+        content = response.choices[0].message.content
+        completion_tokens = getattr(getattr(response, "usage", None), "completion_tokens", None)
+        if completion_tokens is None:
+            completion_tokens = self.prompt_builder.count_tokens(content or "")
+        if usage is not None:
+            usage["completion_tokens"] += completion_tokens
+        current_span().set(completion_tokens=completion_tokens)
+        if key is not None and self._cacheable(content):
+            self.cache.put(key, self.model, content)
+        return content
+
+    def _call_azure_openai_stream(
+        self,
+        messages: List[Dict],
+        on_entry: Callable[[Dict], None],
+        attempt: Optional[Attempt] = None,
+        usage: Optional[Dict] = None,
+        miss_counted: bool = False,
+    ):
+        """Streamed completion; entries are parsed incrementally and passed to ``on_entry``.
+
+        Returns the full response text and the parser (for its completion state).
+        An abandoned ``attempt`` closes the stream at the next chunk. A response cached
+        since the caller's own lookup (``miss_counted``) is replayed instead.
+        """
+        parser = IncrementalEntryParser()
+        key = self._cache_key(messages)
+        cached = self._cache_get(key, count_miss=not miss_counted)
+        if cached is not None:
+            if usage is not None:
+                usage["calls"] -= 1  # answered without a model call
+            current_span().set(cached=True)
+            for entry in parser.feed(cached):
+                on_entry(entry)
+            return cached, parser
+        parts = []
+        if attempt is not None:
+            attempt.check()
+        start = time.perf_counter()
+        try:
+            stream = self.llm_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                **self._llm_params(),
+                **self._timeout_kwargs(),
+            )
+        except Exception as e:
+            if is_rate_limit(e):
+                RATE_LIMITED.inc(component="llm")
+            raise
+        try:
+            for chunk in stream:
+                if attempt is not None:
+                    attempt.check()
+                if not chunk.choices:  # Azure sends content-filter chunks without choices
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                parts.append(delta)
+                for entry in parser.feed(delta):
+                    on_entry(entry)
+        finally:
+            # Frees the HTTP connection right away when the attempt is abandoned
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+        content = "".join(parts)
+        completion_tokens = self.prompt_builder.count_tokens(content)
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage="llm")
+        if attempt is not None:
+            attempt.record_latency(elapsed)
+        if usage is not None:
+            usage["completion_tokens"] += completion_tokens
+        current_span().set(completion_tokens=completion_tokens)
+        if key is not None and self._cacheable(content):
+            self.cache.put(key, self.model, content)
+        return content, parser
+
+    def _pair_query(self, query: str, product: str, subproduct: str) -> str:
+        """Pair-aware search text so retrieval can differ per product/subproduct."""
+        return f"{query} | Product: {product} | Subproduct: {subproduct}"
+
+    async def _retrieve(self, queries: List[str], top_k: int, memo: Dict[tuple, List[Dict]]):
+        """Run every not-yet-memoized query once; several queries go out as one batch."""
+        missing = [q for q in dict.fromkeys(queries) if (q, top_k) not in memo]
+        if not missing:
+            return
+
+        with_vectors = self.reranker is not None
+        with span("context.retrieve", queries=len(missing), top_k=top_k):
+            if len(missing) == 1:
+                found = [await profiling.to_thread(
+                    self.vectorstore.search, missing[0], top_k=top_k, with_vectors=with_vectors
+                )]
+            else:
+                found = await profiling.to_thread(
+                    self.vectorstore.search_many, missing, top_k=top_k, with_vectors=with_vectors
+                )
+
+        for q, matches in zip(missing, found):
+            if self.reranker:
+                matches = self.reranker.mmr(matches)
+            memo[(q, top_k)] = matches
+
+        print(f"[ContextAgent] 📚 Retrieval plan: {len(missing)} unique searches for top_k={top_k}")
 
     def _batch(self, chunks: List[str], size: int) -> List[List[str]]:
         """Split list into batches."""
         return [chunks[i : i + size] for i in range(0, len(chunks), size)]
 
+    def _batch_budget(self, pair_context: Dict) -> int:
+        """Tokens left for batch chunks in one call, given context window and TPM quota."""
+        fixed = self.prompt_builder.static_tokens + pair_context["tokens"] + self.max_output_tokens
+        budget = min(self.batch_token_budget, self.context_window - fixed)
+        if self.tpm_limit:
+            # A single request larger than the per-minute quota can never be admitted
+            budget = min(budget, self.tpm_limit - fixed)
+        return max(budget, 1)
+
+    def _batch_by_tokens(self, chunks: List[str], budget: int) -> List[List[str]]:
+        """Greedily pack chunks (in relevance order) into batches of at most ``budget`` tokens.
+
+        The budget covers the whole batch section as ``build`` renders it: the header and
+        the separator between consecutive chunks count too.
+        """
+        room = max(budget - self.prompt_builder.batch_header_tokens, 1)
+        separator = self.prompt_builder.separator_tokens
+        batches, current, used = [], [], 0
+        for chunk in chunks:
+            tokens = self.prompt_builder.count_tokens(chunk)
+            if tokens > room:
+                # Oversized chunk → trim it so the call can never overflow the context
+                encoder = self.prompt_builder.encoder
+                chunk = encoder.decode(encoder.encode(chunk)[:room])
+                tokens = room
+            if current and used + separator + tokens > room:
+                batches.append(current)
+                current, used = [], 0
+            used += tokens + (separator if current else 0)
+            current.append(chunk)
+        if current:
+            batches.append(current)
+        return batches
+
     def _process_batch(
         self,
         batch_chunks: List[str],
-        products: List[str],
-        subproducts: List[str],
-        focus: Optional[str],
-        prd_chunks: List[str],
-        kb_chunks: List[str],
-        field_chunks: List[str],
-    ) -> List[Dict]:
-        """Process one batch of chunks through LLM."""
-        user_msg = "Here are relevant data chunks:\n\n" + "\n\n".join(batch_chunks)
-        prompt = self._build_prompt(products, subproducts, focus, prd_chunks, kb_chunks, field_chunks) + "\n\n" + user_msg
-
-        raw_response = self._call_azure_openai(prompt)
-        parsed = self._parse_llm_response(raw_response)
-
-        return parsed
+        pair_context: Dict,
+        emit: Optional[Callable[[Dict], None]] = None,
+        attempt: Optional[Attempt] = None,
+    ) -> Dict:
+        """Process one batch of chunks through LLM (static prefix + pair context + batch).
+
+        With ``emit`` the completion is streamed and each entry is handed to ``emit``
+        the moment its closing brace arrives. ``attempt`` is set by the scheduler for
+        cancellable/hedged calls; only the attempt that claims the batch first emits.
+
+        Returns the entries plus what the batch cost (model calls, completion tokens,
+        parse outcome) without recording it: a hedged batch runs in several attempts,
+        and only the one the scheduler returns is accounted, by ``_record_batch``.
+        """
+        prompt = self.prompt_builder.build(pair_context, batch_chunks)
+        usage = {"calls": 0, "completion_tokens": 0}
+        entries: List[Dict] = []
+        status = None
+
+        def collect(entry: Dict):
+            if attempt is not None and not attempt.claim():
+                raise CallCancelled()
+            entries.append(entry)
+            emit(entry)
+
+        # Only this batch is retried when its response can't be parsed or repaired
+        try:
+            for retry in range(self.parse_retries + 1):
+                if retry:
+                    print(f"[ContextAgent] 🔁 Retrying batch after unparseable response ({retry}/{self.parse_retries})")
+                usage["calls"] += 1
+
+                with span("llm.call", retry=retry, stream=emit is not None, chunks=len(batch_chunks),
+                          prompt_tokens=prompt["tokens"]["total"]) as call_span:
+                    if emit is None:
+                        # The batch's cache miss was counted by _replay_cached before admission
+                        raw_response = self._call_azure_openai(prompt["messages"], attempt, usage, miss_counted=True)
+                        entries, status = repair_entries(raw_response)
+                    else:
+                        raw_response, parser = self._call_azure_openai_stream(
+                            prompt["messages"], collect, attempt, usage, miss_counted=True
+                        )
+                        if parser.emitted:
+                            status = "ok" if parser.complete else "repaired"
+                        else:
+                            # Unexpected shape for the incremental parser → full parse with repair
+                            recovered, status = repair_entries(raw_response)
+                            for entry in recovered:
+                                collect(entry)
+                    call_span.set(parse_status=status, entries=len(entries))
+
+                if status != "failed":
+                    break
+        except CallCancelled:
+            raise
+        except Exception as e:
+            if not self._deadline_passed():
+                raise
+            # Out of request budget → keep whatever this batch produced and move on
+            print(f"[ContextAgent] ⏱️ Batch timed out at the request deadline: {e}")
+            status = "timed_out"
+
+        return {"entries": entries, "chunks": len(batch_chunks), "prompt_tokens": prompt["tokens"],
+                "parse": status, **usage}
+
+    def _record_batch(self, result: Dict, batch_sources: Dict[str, int]):
+        """Account one batch's LLM work (the winning attempt's result only)."""
+        BATCH_SIZE.observe(result["chunks"], kind="llm")
+        self._record_prompt_tokens(result["prompt_tokens"], batch_sources, result["calls"])
+        if result["completion_tokens"]:
+            TOKENS.inc(result["completion_tokens"], stage="llm", direction="out", source="completion")
+        if result["calls"] > 1:
+            self._record_parse("retries", result["calls"] - 1)
+        if result["parse"] == "timed_out":
+            with self._stats_lock:
+                self.stats["deadline"]["timed_out_batches"] += 1
+        else:
+            self._record_parse(result["parse"])
+
+    def _record_parse(self, outcome: str, count: int = 1):
+        if outcome == "retries":
+            RETRIES.inc(count, component="llm_parse")
+        with self._stats_lock:
+            self.stats["parse"][outcome] += count
+            if outcome != "retries":
+                self.stats["parse"]["batches"] += count
+
+    def _report_stats(self):
+        parse = self.stats["parse"]
+        parse["failure_rate"] = round(parse["failed"] / parse["batches"], 4) if parse["batches"] else 0.0
+        print(f"[ContextAgent] 🧮 Prompt tokens by section: {dict(self.stats['prompt_tokens'])}")
+        print(f"[ContextAgent] 💾 LLM cache: {dict(self.stats['cache'])}")
+        print(f"[ContextAgent] 🧩 Parse outcomes: {dict(parse)}")
+        print(f"[ContextAgent] ⏹️ Early stop: {dict(self.stats['early_stop'])}")
+        print(f"[ContextAgent] 🔗 Fusion: {dict(self.stats['fusion'])}")
+        print(f"[ContextAgent] ⏱️ Deadline: {dict(self.stats['deadline'])}\n")
+
+    def _record_prompt_tokens(self, tokens: Dict[str, int], batch_sources: Dict[str, int], calls: int = 1):
+        """Stats keep the per-section breakdown; the metric labels batch tokens by data source."""
+        with self._stats_lock:
+            for section, count in tokens.items():
+                self.stats["prompt_tokens"][section] += count * calls
+        if not calls:
+            return
+        TOKENS.inc(tokens["static"] * calls, stage="llm", direction="in", source="instructions")
+        TOKENS.inc(tokens["pair"] * calls, stage="llm", direction="in", source="pair_context")
+        for source, count in batch_sources.items():
+            TOKENS.inc(count * calls, stage="llm", direction="in", source=source)
+
+    def _batch_sources(self, plan: Dict, batch: List[str]) -> Dict[str, int]:
+        """Batch tokens by the data source of each chunk (prds / knowledge_bank / field_issues)."""
+        by_source: Dict[str, int] = {}
+        for chunk in batch:
+            # Oversized chunks trimmed by token batching no longer match → "unknown"
+            source = plan["chunk_sources"].get(chunk, "unknown")
+            by_source[source] = by_source.get(source, 0) + self.prompt_builder.count_tokens(chunk)
+        return by_source
 
     # def run(
     #     self,
@@ -158,6 +508,329 @@ class ContextAgent:
 
     #     print(f"\n[ContextAgent] Parsed {len(results)} DFMEA entries.\n")
     #     return results
+    def _plan_pair(
+        self,
+        idx: int,
+        product: str,
+        subproduct: str,
+        matches: List[Dict],
+        focus: Optional[str],
+        chunk_cap: int,
+    ) -> Dict:
+        """Turn one pair's retrieved matches into its pair context and list of batches."""
+        chunks = [m["text"] for m in matches]
+
+        # Cap chunks
+        if len(chunks) > chunk_cap:
+            chunks = chunks[:chunk_cap]
+
+        print(f"[ContextAgent] Retrieved {len(chunks)} capped chunks for {product} - {subproduct}.")
+
+        # ✅ Split by reliable Qdrant metadata
+        prd_chunks   = [m["text"] for m in matches if m.get("metadata", {}).get("source") == "prds"]
+        kb_chunks    = [m["text"] for m in matches if m.get("metadata", {}).get("source") in KB_SOURCES]
+        field_chunks = [m["text"] for m in matches if m.get("metadata", {}).get("source") == "field_issues"]
+
+        # ⚠️ Empty sources are reported, not back-filled: the batch chunks already
+        # carry that text, and repeating it per source only burns prompt tokens
+        if not prd_chunks:
+            print(f"[ContextAgent] ⚠️ No PRD chunks found for {product} - {subproduct}")
+        if not kb_chunks:
+            print(f"[ContextAgent] ⚠️ No KB chunks found for {product} - {subproduct}")
+        if not field_chunks:
+            print(f"[ContextAgent] ⚠️ No FIELD chunks found for {product} - {subproduct}")
+
+        # Rendered once per pair, reused by every batch prompt of the pair
+        pair_context = self.prompt_builder.pair_context(
+            [product], [subproduct], focus, prd_chunks, kb_chunks, field_chunks
+        )
+
+        batches = self._make_batches(chunks, pair_context)
+        print(f"[ContextAgent] 📦 {len(batches)} batches ({self.batching}) for {product} - {subproduct}")
+
+        return {
+            "idx": idx,
+            "product": product,
+            "subproduct": subproduct,
+            "pairs": [(product, subproduct)],
+            "matches": matches,
+            "chunk_sources": self._chunk_sources(matches),
+            "chunks": chunks,
+            "pair_context": pair_context,
+            "batches": batches,
+        }
+
+    def _chunk_sources(self, matches: List[Dict]) -> Dict[str, str]:
+        return {m["text"]: m.get("metadata", {}).get("source", "unknown") for m in matches}
+
+    def _make_batches(self, chunks: List[str], pair_context: Dict) -> List[List[str]]:
+        if self.batching == "tokens":
+            return self._batch_by_tokens(chunks, self._batch_budget(pair_context))
+        return self._batch(chunks, self.batch_size)
+
+    def _group_pairs(self, plans: List[Dict]) -> List[List[Dict]]:
+        """Greedy grouping: each ungrouped pair seeds a group and pulls in the pairs whose
+        chunk sets overlap it by at least ``fusion_threshold`` (Jaccard)."""
+        chunk_sets = {plan["idx"]: set(plan["chunks"]) for plan in plans}
+
+        def jaccard(a: set, b: set) -> float:
+            return len(a & b) / len(a | b) if a or b else 1.0
+
+        groups, grouped = [], set()
+        for seed in plans:
+            if seed["idx"] in grouped:
+                continue
+            group = [seed]
+            grouped.add(seed["idx"])
+            for other in plans:
+                if len(group) >= self.fusion_max_pairs:
+                    break
+                if other["idx"] in grouped:
+                    continue
+                if jaccard(chunk_sets[seed["idx"]], chunk_sets[other["idx"]]) >= self.fusion_threshold:
+                    group.append(other)
+                    grouped.add(other["idx"])
+            groups.append(group)
+        return groups
+
+    def _fuse_group(self, group: List[Dict], focus: Optional[str]) -> Dict:
+        """One plan for several pairs: union of their chunks, shared evidence rendered once."""
+        pairs = [pair for plan in group for pair in plan["pairs"]]
+        products = list(dict.fromkeys(p for p, _ in pairs))
+        subproducts = list(dict.fromkeys(s for _, s in pairs))
+        chunks = list(dict.fromkeys(c for plan in group for c in plan["chunks"]))
+
+        matches, seen = [], set()
+        for plan in group:
+            for m in plan["matches"]:
+                if m["text"] not in seen:
+                    seen.add(m["text"])
+                    matches.append(m)
+        by_source = lambda sources: [m["text"] for m in matches if m.get("metadata", {}).get("source") in sources]
+
+        pair_context = self.prompt_builder.pair_context(
+            products, subproducts, focus,
+            by_source(("prds",)), by_source(KB_SOURCES), by_source(("field_issues",)),
+            pairs=pairs,
+        )
+        batches = self._make_batches(chunks, pair_context)
+        label = "; ".join(f"{p} - {s}" for p, s in pairs)
+        print(f"[ContextAgent] 🔗 Fused {len(pairs)} pairs ({label}): {len(chunks)} chunks, "
+              f"{len(batches)} batches instead of {sum(len(plan['batches']) for plan in group)}")
+
+        return {
+            "idx": group[0]["idx"],
+            "product": ", ".join(products),
+            "subproduct": ", ".join(subproducts),
+            "pairs": pairs,
+            "matches": matches,
+            "chunk_sources": self._chunk_sources(matches),
+            "chunks": chunks,
+            "pair_context": pair_context,
+            "batches": batches,
+        }
+
+    def _fuse(self, plans: List[Dict], focus: Optional[str]) -> List[Dict]:
+        fused = []
+        for group in self._group_pairs(plans):
+            if len(group) == 1:
+                fused.append(group[0])
+                continue
+            fused.append(self._fuse_group(group, focus))
+            self.stats["fusion"]["groups"] += 1
+            self.stats["fusion"]["pairs_fused"] += len(group)
+        return fused
+
+    def _assign_pair(self, plan: Dict, entry: Dict) -> Optional[tuple]:
+        """Map an entry back to the pair it was generated for; fused plans only accept
+        entries tagged with one of their allowed product/subproduct pairs."""
+        if len(plan["pairs"]) == 1:
+            return plan["pairs"][0]
+        key = (str(entry.get("Product", "")).strip().casefold(),
+               str(entry.get("Subproducts", "")).strip().casefold())
+        for product, subproduct in plan["pairs"]:
+            if (product.strip().casefold(), subproduct.strip().casefold()) == key:
+                entry["Product"], entry["Subproducts"] = product, subproduct
+                return product, subproduct
+        with self._stats_lock:
+            self.stats["fusion"]["unmatched_entries"] += 1
+        return None
+
+    def _interleave_units(self, plans: List[Dict]) -> List[tuple]:
+        """Flatten (pair, batch) units round-robin, pairs with the most batches first.
+
+        Large pairs start early and progress alongside small ones instead of becoming
+        the tail of the run.
+        """
+        ordered = sorted(plans, key=lambda plan: len(plan["batches"]), reverse=True)
+        rounds = max((len(plan["batches"]) for plan in ordered), default=0)
+        return [
+            (plan, b)
+            for b in range(rounds)
+            for plan in ordered
+            if b < len(plan["batches"])
+        ]
+
+    def _estimate_tokens(self, pair_context: Dict, batch: List[str]) -> int:
+        """Prompt tokens plus the reserved completion, for TPM admission."""
+        batch_tokens = self.prompt_builder.batch_tokens(batch)
+        return self.prompt_builder.static_tokens + pair_context["tokens"] + batch_tokens + self.max_output_tokens
+
+    async def _plan(
+        self,
+        query: str,
+        products: List[str],
+        subproducts: List[str],
+        focus: Optional[str],
+        top_k: int,
+        chunk_cap: int,
+        pair_queries: bool,
+    ) -> List[Dict]:
+        """Retrieve once for all pairs and turn each pair into a plan of batches."""
+        pairs = [(p, s) for p in products for s in subproducts]
+        total_pairs = len(pairs)
+
+        # 🔹 Plan retrieval up front: pairs sharing the same query text share one search
+        pair_query = {
+            pair: (self._pair_query(query, *pair) if pair_queries else query) for pair in pairs
+        }
+        search_memo: Dict[tuple, List[Dict]] = {}
+        await self._retrieve(list(dict.fromkeys(pair_query.values())), top_k, search_memo)
+
+        plans = []
+        for idx, (product, subproduct) in enumerate(pairs, start=1):
+            print(f"\n[ContextAgent] 🔎 Planning {idx}/{total_pairs} → Product: {product}, Subproduct: {subproduct}")
+            matches = search_memo.get((pair_query[(product, subproduct)], top_k), [])
+            with span("context.plan_pair", pair=f"{product} / {subproduct}", matches=len(matches)):
+                plans.append(self._plan_pair(idx, product, subproduct, matches, focus, chunk_cap))
+
+        if self.fusion and len(plans) > 1:
+            plans = self._fuse(plans, focus)
+        return plans
+
+    async def _execute(
+        self,
+        plans: List[Dict],
+        max_concurrent: Optional[int] = None,
+        on_entry: Optional[Callable[[Dict, Dict], None]] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Dict[int, List[List[Dict]]]:
+        """Run every (pair, batch) unit through the global scheduler.
+
+        Returns per-pair, per-batch results in plan order (None for batches skipped by
+        early stopping). With ``on_entry`` the LLM responses are streamed and
+        ``on_entry(plan, entry)`` is called from the worker thread for each entry as soon
+        as it has been parsed. ``progress(done, total)`` is called after every unit.
+
+        When early stopping stops a pair, its outstanding submits are cancelled: units
+        still waiting for admission, and streamed calls in flight (their stream closes
+        at the next chunk). Non-streamed calls already sent are left to finish, since
+        their tokens are spent either way.
+        """
+        # 🔹 One flat work queue of (pair, batch) units, admitted by the process-wide scheduler
+        units = self._interleave_units(plans)
+        pair_outputs = {plan["idx"]: [None] * len(plan["batches"]) for plan in plans}
+        remaining = {plan["idx"]: len(plan["batches"]) for plan in plans}
+        finished = 0
+        run_limit = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+        trackers = {
+            plan["idx"]: NoveltyTracker(self.early_stop_window, self.early_stop_min_new)
+            for plan in plans
+        } if self.early_stop else {}
+        # Per pair: submit task → {"admitted": bool}, and the tasks cancelled by an early stop
+        outstanding = {plan["idx"]: {} for plan in plans}
+        stopped_units = set()
+
+        def stop_pair(plan: Dict):
+            for unit, state in list(outstanding[plan["idx"]].items()):
+                if not state["admitted"] or on_entry is not None:
+                    stopped_units.add(unit)
+                    unit.cancel()
+
+        async def run_unit(plan: Dict, b: int):
+            batch = plan["batches"][b]
+            est_tokens = self._estimate_tokens(plan["pair_context"], batch)
+            emit = (lambda entry: on_entry(plan, entry)) if on_entry else None
+            tracker = trackers.get(plan["idx"])
+            state = {"admitted": False}
+
+            def skip_now() -> bool:
+                return (tracker is not None and tracker.stopped) or self._deadline_passed()
+
+            def skip_if() -> bool:
+                # Checked at admission: the pair may have stopped, or the budget run out, while queued
+                state["admitted"] = True
+                return skip_now()
+
+            async def submit():
+                # No hedging for streamed batches: once the owner has emitted entries, a
+                # sibling can't take over without duplicating them, so a late failure of
+                # the owner would lose the batch
+                hedge = self.hedge and emit is None
+                submit_kwargs = {"est_tokens": est_tokens, "skip_if": skip_if, "cancellable": True, "hedge": hedge}
+                if run_limit:
+                    async with run_limit:
+                        return await self.scheduler.submit(self._process_batch, batch, plan["pair_context"], emit, **submit_kwargs)
+                return await self.scheduler.submit(self._process_batch, batch, plan["pair_context"], emit, **submit_kwargs)
+
+            pair = "; ".join(f"{p} / {s}" for p, s in plan["pairs"])
+            with span("llm.batch", pair=pair, batch=b, chunks=len(batch), est_tokens=est_tokens) as unit_span:
+                out = None
+                sent = False
+                if not skip_now():
+                    # Cache hits are answered here, without waiting for scheduler admission
+                    if self.cache is not None:
+                        out = await profiling.to_thread(self._replay_cached, batch, plan["pair_context"], emit)
+                        unit_span.set(cached=out is not None)
+                    if out is None:
+                        unit = asyncio.ensure_future(submit())
+                        outstanding[plan["idx"]][unit] = state
+                        try:
+                            result = await unit
+                        except asyncio.CancelledError:
+                            if unit not in stopped_units:
+                                raise
+                            result = None
+                            sent = state["admitted"]
+                        finally:
+                            outstanding[plan["idx"]].pop(unit, None)
+                        if result is not None:
+                            self._record_batch(result, self._batch_sources(plan, batch))
+                            out = result["entries"]
+                unit_span.set(skipped=out is None, entries=len(out or []))
+
+            if out is None and tracker is not None and tracker.stopped:
+                stats = self.stats["early_stop"]
+                if sent:
+                    stats["batches_cancelled"] += 1
+                else:
+                    stats["batches_skipped"] += 1
+                    stats["prompt_tokens_saved"] += est_tokens - self.max_output_tokens
+            elif out is None:
+                self.stats["deadline"]["skipped_batches"] += 1
+            elif tracker and not tracker.stopped and tracker.observe(out):
+                self.stats["early_stop"]["pairs_stopped"] += 1
+                print(f"[ContextAgent] ⏹️ Early stop for {plan['product']} - {plan['subproduct']} "
+                      f"after {tracker.batches}/{len(plan['batches'])} batches ({len(tracker.seen)} signatures)")
+                stop_pair(plan)
+
+            nonlocal finished
+            finished += 1
+            if progress:
+                progress(finished, len(units))
+
+            pair_outputs[plan["idx"]][b] = out
+            remaining[plan["idx"]] -= 1
+            if remaining[plan["idx"]] == 0:
+                count = sum(len(r) for r in pair_outputs[plan["idx"]] if r)
+                print(f"[ContextAgent] ✅ Completed {plan['product']} - {plan['subproduct']}, results: {count}")
+
+        print(f"[ContextAgent] 🚦 Scheduling {len(units)} LLM calls across {sum(len(plan['pairs']) for plan in plans)} pairs "
+              f"(concurrency limit now {self.scheduler.concurrency_limit()})")
+        with span("context.execute", units=len(units), pairs=sum(len(plan["pairs"]) for plan in plans)):
+            await asyncio.gather(*(run_unit(plan, b) for plan, b in units))
+        return pair_outputs
+
     async def run(
     self,
     query: str,
@@ -166,76 +839,78 @@ class ContextAgent:
     focus: Optional[str] = None,
     top_k: int = 200,
     chunk_cap: int = 200,   # 👈 max chunks per product+subproduct
-    max_concurrent: int = 5 # 👈 tune this to control parallelism
+    max_concurrent: Optional[int] = None, # 👈 optional per-run cap on top of the global scheduler
+    pair_queries: bool = False, # 👈 make each pair's search text product/subproduct aware
+    progress: Optional[Callable[[int, int], None]] = None, # 👈 called with (batches done, total)
 ) -> List[Dict]:
-        """Parallel (semaphore-limited) search Qdrant for each product+subproduct pair → DFMEA JSON."""
-
-        results = []
-        total_pairs = len(products) * len(subproducts)
-        semaphore = asyncio.Semaphore(max_concurrent)
-
-        async def process_pair(idx: int, product: str, subproduct: str):
-            async with semaphore:
-                print(f"\n[ContextAgent] 🔎 Processing {idx}/{total_pairs} → Product: {product}, Subproduct: {subproduct}")
-
-                # 🔹 Run search (blocking → thread executor)
-                matches = await asyncio.to_thread(self.vectorstore.search, query, top_k=top_k)
-                chunks = [m["text"] for m in matches]
-
-                # Cap chunks
-                if len(chunks) > chunk_cap:
-                    chunks = chunks[:chunk_cap]
-
-                print(f"[ContextAgent] Retrieved {len(chunks)} capped chunks for {product} - {subproduct}.")
-
-                # ✅ Split by reliable Qdrant metadata
-                prd_chunks   = [m["text"] for m in matches if m.get("payload", {}).get("source") == "prds"]
-                kb_chunks    = [m["text"] for m in matches if m.get("payload", {}).get("source") == "knowledge_base"]
-                field_chunks = [m["text"] for m in matches if m.get("payload", {}).get("source") == "field_issues"]
-
-                # ✅ Fallback: if any set is empty, use general chunks
-                if not prd_chunks:
-                    print(f"[ContextAgent] ⚠️ No PRD chunks found → falling back to general chunks")
-                    prd_chunks = chunks
-                if not kb_chunks:
-                    print(f"[ContextAgent] ⚠️ No KB chunks found → falling back to general chunks")
-                    kb_chunks = chunks
-                if not field_chunks:
-                    print(f"[ContextAgent] ⚠️ No FIELD chunks found → falling back to general chunks")
-                    field_chunks = chunks
-
-                pair_results = []
-                for batch in self._batch(chunks, self.batch_size):
-                    batch_results = await asyncio.to_thread(
-                        self._process_batch,
-                        batch,
-                        [product],
-                        [subproduct],
-                        focus,
-                        prd_chunks,
-                        kb_chunks,
-                        field_chunks,
-                    )
-                    pair_results.extend(batch_results)
-
-                print(f"[ContextAgent] ✅ Completed {product} - {subproduct}, results: {len(pair_results)}")
-                return pair_results
-
-        # 🔹 Launch all pairs concurrently (with semaphore limit)
-        tasks = [
-            process_pair(idx, product, subproduct)
-            for idx, (product, subproduct) in enumerate(
-                [(p, s) for p in products for s in subproducts], start=1
-            )
-        ]
-
-        all_results = await asyncio.gather(*tasks)
-        for r in all_results:
-            results.extend(r)
-
-        print(f"\n[ContextAgent] 🎯 Finished. Parsed {len(results)} DFMEA entries across {total_pairs} pairs.\n")
+        """Plan retrieval and batches for all pairs, then run every (pair, batch) via the global scheduler."""
+        self._start_deadline()
+
+        with span("context.plan", products=len(products), subproducts=len(subproducts), top_k=top_k):
+            plans = await self._plan(query, products, subproducts, focus, top_k, chunk_cap, pair_queries)
+        pair_outputs = await self._execute(plans, max_concurrent, progress=progress)
+
+        # Split (possibly fused) outputs back to their pairs, reported in product × subproduct order
+        per_pair: Dict[tuple, List[Dict]] = {(p, s): [] for p in products for s in subproducts}
+        for plan in plans:
+            for batch_results in pair_outputs[plan["idx"]]:
+                for entry in batch_results or []:
+                    pair = self._assign_pair(plan, entry)
+                    if pair is not None:
+                        per_pair[pair].append(entry)
+        results = [entry for entries in per_pair.values() for entry in entries]
+
+        print(f"\n[ContextAgent] 🎯 Finished. Parsed {len(results)} DFMEA entries across {len(per_pair)} pairs.")
+        self._report_stats()
         return results
 
+    async def stream(
+        self,
+        query: str,
+        products: List[str],
+        subproducts: List[str],
+        focus: Optional[str] = None,
+        top_k: int = 200,
+        chunk_cap: int = 200,
+        max_concurrent: Optional[int] = None,
+        pair_queries: bool = False,
+    ) -> AsyncIterator[Dict]:
+        """Like ``run``, but yields ``{"product", "subproduct", "entry"}`` items as soon as
+        each entry is parsed out of a streamed LLM completion (completion order)."""
+        self._start_deadline()
+        with span("context.plan", products=len(products), subproducts=len(subproducts), top_k=top_k):
+            plans = await self._plan(query, products, subproducts, focus, top_k, chunk_cap, pair_queries)
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def on_entry(plan: Dict, entry: Dict):
+            pair = self._assign_pair(plan, entry)
+            if pair is None:
+                return
+            item = {"product": pair[0], "subproduct": pair[1], "entry": entry}
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        async def execute():
+            try:
+                await self._execute(plans, max_concurrent, on_entry=on_entry)
+            finally:
+                queue.put_nowait(done)
+
+        task = asyncio.create_task(execute())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+            await task  # surface errors from the workers
+            self._report_stats()
+        finally:
+            if not task.done():
+                task.cancel()
+
 
 #     async def run(
 #     self,
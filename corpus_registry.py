@@ -0,0 +1,85 @@
+# server/agents/corpus_registry.py
+
+import json
+import time
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from .job_manager import write_json_atomic
+
+
+class CorpusRegistry:
+    """Indexed corpora that generation can reuse without re-ingesting.
+
+    One JSON record per corpus in ``corpus_dir`` with the file hashes, per-source chunk
+    counts, embedding model and the Qdrant collection version holding its vectors.
+    Registered versions must survive version GC (see ``versions``).
+    """
+
+    def __init__(self, corpus_dir: str):
+        self.corpus_dir = Path(corpus_dir)
+        self.corpus_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(files: List[Dict], embedding_model: Optional[str]) -> str:
+        """Content identity of a corpus: what was uploaded (per source) and how it was embedded."""
+        key = sorted((f["source"], f["sha256"]) for f in files)
+        payload = json.dumps({"files": key, "embedding_model": embedding_model})
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, corpus_id: str) -> Path:
+        return self.corpus_dir / f"{corpus_id}.json"
+
+    def get(self, corpus_id: str) -> Optional[Dict]:
+        if not corpus_id or not corpus_id.replace("-", "").replace("_", "").isalnum():
+            return None
+        path = self._path(corpus_id)
+        if not path.exists():
+            return None
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+
+    def all(self) -> List[Dict]:
+        records = []
+        for path in self.corpus_dir.glob("*.json"):
+            try:
+                with open(path, encoding="utf-8") as fh:
+                    records.append(json.load(fh))
+            except (OSError, ValueError):
+                continue
+        return records
+
+    def find(self, fingerprint: str) -> Optional[Dict]:
+        return next((r for r in self.all() if r.get("fingerprint") == fingerprint), None)
+
+    def versions(self) -> Set[str]:
+        """Collection versions referenced by any corpus (to be kept by version GC)."""
+        return {r["collection_version"] for r in self.all() if r.get("collection_version")}
+
+    def register(
+        self,
+        files: List[Dict],
+        embedding_model: Optional[str],
+        collection_version: str,
+        embedding_summary: Dict,
+        corpus_id: Optional[str] = None,
+    ) -> Dict:
+        """Create a corpus, or point an existing one at a newly built collection version."""
+        with self._lock:
+            now = time.time()
+            corpus_id = corpus_id or uuid.uuid4().hex
+            record = self.get(corpus_id) or {"corpus_id": corpus_id, "created_at": now}
+            record.update(
+                fingerprint=self.fingerprint(files, embedding_model),
+                embedding_model=embedding_model,
+                collection_version=collection_version,
+                files=files,
+                embedding_summary=embedding_summary,
+                updated_at=now,
+            )
+            write_json_atomic(self._path(corpus_id), record)
+            return record
@@ -9,6 +9,9 @@ from openai import AzureOpenAI, RateLimitError, APIConnectionError, InternalServ
 from dotenv import load_dotenv
 from tiktoken import get_encoding
 from server.utils.logger import logger
+from .metrics import STAGE_SECONDS, BATCH_SIZE, RATE_LIMITED, RETRIES, TOKENS, is_rate_limit
+from .tracing import span, current_span
+from . import profiling
 import random
 
 load_dotenv()
@@ -224,16 +227,21 @@ class EmbeddingAgent:
     async def _embed_batch_with_retry(self, texts: List[str]) -> List[Dict]:
         """Embed one batch with retry + exponential backoff."""
         delay = self.cooldown
+        BATCH_SIZE.observe(len(texts), kind="embed")
         for attempt in range(self.max_retries):
             try:
-                response = await asyncio.to_thread(
-                    self.client.embeddings.create,
-                    input=texts,
-                    model=self.deployment
-                )
+                with STAGE_SECONDS.time(stage="embed"), span("embedding.create", attempt=attempt, texts=len(texts)):
+                    response = await profiling.to_thread(
+                        self.client.embeddings.create,
+                        input=texts,
+                        model=self.deployment
+                    )
                 return response
             except Exception as e:
-                if "429" in str(e) or "RateLimitError" in str(type(e)):
+                if is_rate_limit(e):
+                    RATE_LIMITED.inc(component="embedding")
+                    RETRIES.inc(component="embedding")
+                    current_span().set(retries=attempt + 1)
                     logger.warning(f"[EmbeddingAgent] ⚠️ 429: attempt {attempt+1}/{self.max_retries}, retrying in {delay:.2f}s...")
                     await asyncio.sleep(delay + random.uniform(0, 1))
                     delay = min(delay * 2, 30)  # exponential backoff, max 30s
@@ -251,28 +259,33 @@ class EmbeddingAgent:
 
         async def process_batch(batch, idx):
             async with semaphore:
-                texts = [c["text"] for c in batch]
-                response = await self._embed_batch_with_retry(texts)
-                if not response:
-                    return []
-                results = []
-                for i, item in enumerate(response.data):
-                    # ✅ Ensure metadata always has a source
-                    meta = batch[i].get("metadata", {})
-                    if "source" not in meta:
-                        meta["source"] = "unknown"
-
-                    results.append({
-                        "text": batch[i]["text"],
-                        "embedding": item.embedding,
-                        "metadata": meta,
-                        "tokens": self._count_tokens(batch[i]["text"])
-                    })
-                logger.info(f"[EmbeddingAgent] ✅ Batch {idx+1}/{len(batches)} done ({len(batch)} chunks)")
-                return results
-
-        tasks = [process_batch(batch, idx) for idx, batch in enumerate(batches)]
-        results = await asyncio.gather(*tasks)
+                with span("embedding.batch", batch=idx, chunks=len(batch)) as batch_span:
+                    texts = [c["text"] for c in batch]
+                    response = await self._embed_batch_with_retry(texts)
+                    if not response:
+                        batch_span.set(failed=True)
+                        return []
+                    results = []
+                    for i, item in enumerate(response.data):
+                        # ✅ Ensure metadata always has a source
+                        meta = batch[i].get("metadata", {})
+                        if "source" not in meta:
+                            meta["source"] = "unknown"
+
+                        results.append({
+                            "text": batch[i]["text"],
+                            "embedding": item.embedding,
+                            "metadata": meta,
+                            "tokens": self._count_tokens(batch[i]["text"])
+                        })
+                        TOKENS.inc(results[-1]["tokens"], stage="embed", direction="in", source=meta["source"])
+                    batch_span.set(tokens=sum(r["tokens"] for r in results))
+                    logger.info(f"[EmbeddingAgent] ✅ Batch {idx+1}/{len(batches)} done ({len(batch)} chunks)")
+                    return results
+
+        with span("embedding.embed_chunks", chunks=len(chunks), batches=len(batches), concurrency=self.concurrency):
+            tasks = [process_batch(batch, idx) for idx, batch in enumerate(batches)]
+            results = await asyncio.gather(*tasks)
 
         # Flatten
         for r in results:
@@ -0,0 +1,147 @@
+# server/agents/entry_parser.py
+
+import re
+import json
+from typing import List, Dict, Tuple, Optional
+
+_ENTRIES_START = re.compile(r'"entries"\s*:\s*\[')
+
+
+class IncrementalEntryParser:
+    """Yield DFMEA entries from a JSON response while it is still arriving.
+
+    Expects the ``{"entries": [ {...}, {...} ]}`` shape the prompt asks for (a bare
+    top-level list of entries is accepted too). Each ``feed`` returns the entries whose
+    closing brace has arrived since the previous call; text before the entries array
+    and already-emitted objects are discarded, so memory stays bounded by one entry.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0            # next character of _buffer to scan
+        self._in_entries = False
+        self._done = False       # entries array closed
+        self._depth = 0          # brace/bracket depth inside the current entry
+        self._obj_start = None   # _buffer index where the current entry began
+        self._in_string = False
+        self._escape = False
+        self.emitted = 0
+
+    @property
+    def complete(self) -> bool:
+        """True once the closing ``]`` of the entries array has been seen."""
+        return self._done
+
+    @property
+    def pending(self) -> bool:
+        """True if an entry was started but its closing brace never arrived."""
+        return self._obj_start is not None
+
+    def feed(self, text: str) -> List[Dict]:
+        if self._done or not text:
+            return []
+        self._buffer += text
+
+        if not self._in_entries:
+            match = _ENTRIES_START.search(self._buffer)
+            if match:
+                start = match.end()
+            else:
+                stripped = self._buffer.lstrip().lstrip("`").lstrip()
+                if stripped.lower().startswith("json"):
+                    stripped = stripped[4:].lstrip()
+                if not stripped.startswith("["):
+                    # Keep only a tail long enough to match the key split across feeds
+                    self._buffer = self._buffer[-64:]
+                    return []
+                start = self._buffer.index("[") + 1
+            self._in_entries = True
+            self._buffer = self._buffer[start:]
+            self._pos = 0
+
+        entries = []
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._obj_start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0 and ch == "]":
+                    self._done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start is not None:
+                    try:
+                        entry = json.loads(buf[self._obj_start : i + 1])
+                        if isinstance(entry, dict):
+                            entries.append(entry)
+                    except json.JSONDecodeError:
+                        pass
+                    self._obj_start = None
+            i += 1
+
+        # Drop everything already consumed except an unfinished entry
+        keep_from = self._obj_start if self._obj_start is not None else i
+        self._buffer = buf[keep_from:]
+        if self._obj_start is not None:
+            self._obj_start = 0
+        self._pos = i - keep_from
+        self.emitted += len(entries)
+        return entries
+
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def repair_entries(raw_response: str) -> Tuple[List[Dict], str]:
+    """Best-effort local recovery of DFMEA entries from an LLM response.
+
+    Returns ``(entries, status)`` where status is ``"ok"`` (valid JSON), ``"repaired"``
+    (fixed up or salvaged from truncated output) or ``"failed"`` (nothing usable).
+    """
+    cleaned = _FENCE.sub("", (raw_response or "").strip())
+    if not cleaned:
+        return [], "failed"
+
+    def entries_of(parsed) -> Optional[List[Dict]]:
+        if isinstance(parsed, dict):
+            entries = parsed.get("entries", [])
+            return [e for e in entries if isinstance(e, dict)] if isinstance(entries, list) else None
+        if isinstance(parsed, list):
+            return [e for e in parsed if isinstance(e, dict)]
+        return None
+
+    try:
+        entries = entries_of(json.loads(cleaned))
+        if entries is not None:
+            return entries, "ok"
+    except json.JSONDecodeError:
+        pass
+
+    # Common near-misses: trailing commas before a closing brace/bracket
+    try:
+        entries = entries_of(json.loads(_TRAILING_COMMA.sub(r"\1", cleaned)))
+        if entries is not None:
+            return entries, "repaired"
+    except json.JSONDecodeError:
+        pass
+
+    # Truncated or otherwise broken tail → keep every entry that closed cleanly
+    parser = IncrementalEntryParser()
+    entries = parser.feed(_TRAILING_COMMA.sub(r"\1", cleaned))
+    if entries:
+        return entries, "repaired"
+    return [], "failed"
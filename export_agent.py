@@ -0,0 +1,152 @@
+# server/agents/export_agent.py
+
+import os
+import re
+import csv
+import json
+import time
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from server.utils.logger import logger
+from .tracing import span
+
+# Column order of the exported DFMEA sheet (matches the prompt's entry schema)
+DFMEA_COLUMNS = [
+    "Product", "Subproducts", "Function", "Potential Failure Mode", "Potential Effects",
+    "Potential Causes", "Severity", "Occurrence", "Detection", "RPN",
+    "Controls Prevention", "Controls Detection", "linked_to_kb",
+]
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+PARTIAL_SUFFIX = ".part"
+# "<uuid4 hex>.<fmt>[.part]": the only files sweep() may delete (export_dir can be /tmp)
+_EXPORT_NAME = re.compile(rf"^[0-9a-f]{{32}}\.({'|'.join(EXPORT_FORMATS)})({re.escape(PARTIAL_SUFFIX)})?$")
+
+
+def _flatten(value):
+    """One cell per field: lists joined with '; ', nested objects as JSON."""
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return "; ".join(_flatten(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class ExportAgent:
+    """Writes DFMEA entries to XLSX / CSV / Parquet one row at a time.
+
+    Files are written to ``<export_dir>/<file_id>.<fmt>.part`` and renamed when
+    complete, so a download can tell "still being written" from "missing". Memory use
+    is independent of the number of entries (openpyxl write-only mode, csv writer,
+    Parquet row groups).
+    """
+
+    def __init__(self, export_dir: Optional[str] = None, parquet_row_group: int = 10000):
+        self.export_dir = Path(export_dir or tempfile.gettempdir())
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        self.parquet_row_group = parquet_row_group
+
+    def path(self, file_id: str, fmt: str) -> Path:
+        return self.export_dir / f"{file_id}.{fmt}"
+
+    def partial_path(self, file_id: str, fmt: str) -> Path:
+        return self.export_dir / f"{file_id}.{fmt}{PARTIAL_SUFFIX}"
+
+    def reserve(self, file_id: str, fmt: str):
+        """Mark an export as pending before the background task starts writing it."""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format '{fmt}' (expected one of {', '.join(EXPORT_FORMATS)})")
+        self.partial_path(file_id, fmt).touch()
+
+    def sweep(self, max_age_seconds: float) -> int:
+        """Delete exports (finished or abandoned partials) older than ``max_age_seconds``."""
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for entry in os.scandir(self.export_dir):
+            if not _EXPORT_NAME.match(entry.name):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # downloaded (and removed) meanwhile
+        if removed:
+            logger.info(f"[ExportAgent] 🧹 Removed {removed} exports older than {max_age_seconds / 60:.0f} min")
+        return removed
+
+    def rows(self, entries: Iterable[Dict]) -> Iterator[List]:
+        for entry in entries:
+            yield [_flatten(entry.get(col)) for col in DFMEA_COLUMNS]
+
+    def export(self, entries: List[Dict], file_id: str, fmt: str = "xlsx") -> Path:
+        """Write ``entries`` in ``fmt``; returns the final path."""
+        partial = self.partial_path(file_id, fmt)
+        writer = {"xlsx": self._write_xlsx, "csv": self._write_csv, "parquet": self._write_parquet}[fmt]
+        try:
+            with span("export.write", format=fmt, entries=len(entries)):
+                writer(entries, partial)
+            final = self.path(file_id, fmt)
+            os.replace(partial, final)
+        except Exception as e:
+            logger.error(f"[ExportAgent] ❌ {fmt} export {file_id} failed: {type(e).__name__}: {e}")
+            partial.unlink(missing_ok=True)
+            raise
+        logger.info(f"[ExportAgent] ✅ Exported {len(entries)} entries → {final.name}")
+        return final
+
+    # ------------------------------------------------------------------
+    def _write_xlsx(self, entries: List[Dict], path: Path):
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("DFMEA")
+        ws.append(DFMEA_COLUMNS)
+        for row in self.rows(entries):
+            ws.append(row)
+        with open(path, "wb") as fh:
+            wb.save(fh)
+
+    def _write_csv(self, entries: List[Dict], path: Path):
+        with open(path, "w", newline="", encoding="utf-8-sig") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(DFMEA_COLUMNS)
+            writer.writerows(self.rows(entries))
+
+    def _write_parquet(self, entries: List[Dict], path: Path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)") from e
+
+        # Every column as string: scores may come back as text from a repaired response
+        schema = pa.schema([(col, pa.string()) for col in DFMEA_COLUMNS])
+        with pq.ParquetWriter(path, schema) as writer:
+            batch: List[List] = []
+            for row in self.rows(entries):
+                batch.append(row)
+                if len(batch) >= self.parquet_row_group:
+                    writer.write_table(self._parquet_table(batch, schema))
+                    batch = []
+            if batch or not entries:
+                writer.write_table(self._parquet_table(batch, schema))
+
+    @staticmethod
+    def _parquet_table(batch: List[List], schema):
+        import pyarrow as pa
+
+        columns = list(zip(*batch)) if batch else [[] for _ in DFMEA_COLUMNS]
+        return pa.Table.from_arrays(
+            [pa.array([None if v == "" else str(v) for v in col], type=pa.string()) for col in columns],
+            schema=schema,
+        )
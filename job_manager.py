@@ -0,0 +1,272 @@
+# server/agents/job_manager.py
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import asyncio
+import tempfile
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from server.utils.logger import logger
+
+# Lifecycle of a job; "queued"/"running" jobs are picked up again after a restart
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+# Workers sharing a job dir claim a job with an O_EXCL lock file before running it and
+# refresh its mtime while they do; a claim is stale once its owner process is gone
+# (same host) or its heartbeat is older than CLAIM_TTL (any host)
+CLAIM_FILE = "claim.lock"
+HEARTBEAT_SECONDS = float(os.getenv("DFMEA_JOB_HEARTBEAT_SECONDS", "15"))
+CLAIM_TTL = float(os.getenv("DFMEA_JOB_CLAIM_TTL_SECONDS", str(4 * HEARTBEAT_SECONDS)))
+
+JobRunner = Callable[[Dict, Callable[[str, float], None]], Awaitable[Dict]]
+
+
+def write_json_atomic(path: Path, data: Dict):
+    """Atomic replace, so a crash never leaves a half-written state file behind."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class JobManager:
+    """Background DFMEA jobs on a bounded asyncio worker pool, with on-disk state.
+
+    Each job lives in ``<job_dir>/<job_id>/``: ``job.json`` (status, stage, percent,
+    request parameters and saved upload paths), ``uploads/`` and, once finished,
+    ``result.json``. A job only runs while its worker holds ``claim.lock``, so several
+    web processes can share one job dir without running a job twice. Unfinished jobs
+    found on ``start`` whose claim is missing or stale are queued again, so accepted
+    work survives a restart of the web process.
+    """
+
+    def __init__(self, job_dir: str, runner: JobRunner, workers: int = 2):
+        self.job_dir = Path(job_dir)
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        self.runner = runner
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._claimed: Dict[str, Path] = {}
+        self._host = socket.gethostname()
+
+    # ------------------------------------------------------------------
+    def _path(self, job_id: str) -> Path:
+        return self.job_dir / job_id
+
+    def upload_dir(self, job_id: str, field: str) -> Path:
+        path = self._path(job_id) / "uploads" / field
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def new_job_id(self) -> str:
+        job_id = uuid.uuid4().hex
+        self._path(job_id).mkdir(parents=True)
+        return job_id
+
+    def discard(self, job_id: str):
+        """Remove a job that was never queued (e.g. its uploads were rejected)."""
+        shutil.rmtree(self._path(job_id), ignore_errors=True)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        path = self._path(job_id) / "job.json"
+        if not job_id.isalnum() or not path.exists():
+            return None
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+
+    def result(self, job_id: str) -> Optional[Dict]:
+        path = self._path(job_id) / "result.json"
+        if not job_id.isalnum() or not path.exists():
+            return None
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+
+    def _save(self, job: Dict):
+        job["updated_at"] = time.time()
+        write_json_atomic(self._path(job["id"]) / "job.json", job)
+
+    # ------------------------------------------------------------------
+    def _claim_is_stale(self, path: Path) -> bool:
+        try:
+            age = time.time() - path.stat().st_mtime
+            with open(path, encoding="utf-8") as fh:
+                owner = json.load(fh)
+        except FileNotFoundError:
+            return True
+        except (OSError, ValueError):
+            # Half-written by a claimer that is still writing it, unless it is old
+            return age > CLAIM_TTL
+        if owner.get("host") == self._host and owner.get("pid") != os.getpid():
+            try:
+                os.kill(int(owner["pid"]), 0)
+            except ProcessLookupError:
+                return True
+            except (PermissionError, KeyError, TypeError, ValueError):
+                pass
+        return age > CLAIM_TTL
+
+    def _claim(self, job_id: str) -> bool:
+        """Atomically take ownership of a job; False when a live worker already owns it."""
+        path = self._path(job_id) / CLAIM_FILE
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._claim_is_stale(path):
+                    return False
+                # Move the stale claim aside first: only one contender's rename succeeds
+                aside = path.with_name(f".{CLAIM_FILE}.{uuid.uuid4().hex}")
+                try:
+                    os.replace(path, aside)
+                except FileNotFoundError:
+                    continue
+                if not self._claim_is_stale(aside):
+                    # Lost the race: that was a fresh claim by another contender, put it back
+                    try:
+                        os.link(aside, path)
+                    except FileExistsError:
+                        pass
+                    os.remove(aside)
+                    return False
+                os.remove(aside)
+                logger.warning(f"[JobManager] ⚠️ Taking over job {job_id} from a dead worker")
+                continue
+            except FileNotFoundError:
+                return False  # job dir removed
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump({"pid": os.getpid(), "host": self._host, "claimed_at": time.time()}, fh)
+            self._claimed[job_id] = path
+            return True
+        return False
+
+    def _release(self, job_id: str):
+        path = self._claimed.pop(job_id, None)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _is_claimed(self, job_id: str) -> bool:
+        path = self._path(job_id) / CLAIM_FILE
+        return path.exists() and not self._claim_is_stale(path)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            for job_id, path in list(self._claimed.items()):
+                try:
+                    os.utime(path)
+                except OSError as e:
+                    logger.warning(f"[JobManager] ⚠️ Could not refresh claim of job {job_id}: {e}")
+
+    # ------------------------------------------------------------------
+    async def submit(self, job_id: str, params: Dict, files: Dict[str, List[str]]) -> Dict:
+        """Persist a new job (uploads already saved under ``upload_dir``) and queue it."""
+        now = time.time()
+        job = {
+            "id": job_id,
+            "status": QUEUED,
+            "stage": QUEUED,
+            "percent": 0,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "params": params,
+            "files": files,
+        }
+        self._save(job)
+        await self._queue.put(job_id)
+        logger.info(f"[JobManager] 📥 Queued job {job_id} (queue depth {self._queue.qsize()})")
+        return job
+
+    def start(self):
+        """Start the worker pool (call from the running event loop) and resume unfinished jobs.
+
+        Jobs another live worker has claimed are left alone; ``_run`` claims before
+        running, so a job queued by several processes still runs once.
+        """
+        self._queue = asyncio.Queue()
+        resumed = []
+        for state in sorted(self.job_dir.glob("*/job.json"), key=lambda p: p.stat().st_mtime):
+            try:
+                with open(state, encoding="utf-8") as fh:
+                    job = json.load(fh)
+            except (OSError, ValueError) as e:
+                logger.warning(f"[JobManager] ⚠️ Skipping unreadable job state {state}: {e}")
+                continue
+            if job.get("status") in (QUEUED, RUNNING) and not self._is_claimed(job["id"]):
+                self._queue.put_nowait(job["id"])
+                resumed.append(job["id"])
+        if resumed:
+            logger.info(f"[JobManager] 🔁 Re-queued {len(resumed)} unfinished jobs")
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, n: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        if not job_id.isalnum() or not self._claim(job_id):
+            return
+        try:
+            await self._run_claimed(job_id)
+        finally:
+            self._release(job_id)
+
+    async def _run_claimed(self, job_id: str):
+        # Re-read under the claim: another worker may have finished it meanwhile
+        job = self.status(job_id)
+        if job is None or job["status"] not in (QUEUED, RUNNING):
+            return
+        job.update(status=RUNNING, stage="starting", percent=0, started_at=time.time())
+        self._save(job)
+        logger.info(f"[JobManager] 🚀 Running job {job_id}")
+
+        def progress(stage: str, percent: float):
+            percent = int(max(0, min(100, percent)))
+            # Only persist real changes; generation reports progress per batch
+            if stage != job["stage"] or percent != job["percent"]:
+                job.update(stage=stage, percent=percent)
+                self._save(job)
+
+        try:
+            result = await self.runner(job, progress)
+            write_json_atomic(self._path(job_id) / "result.json", result)
+            job.update(status=SUCCEEDED, stage="done", percent=100)
+            logger.info(f"[JobManager] ✅ Job {job_id} finished")
+        except asyncio.CancelledError:
+            # Shutdown: leave the job "running"; the released claim lets the next start re-queue it
+            raise
+        except Exception as e:
+            logger.error(f"[JobManager] ❌ Job {job_id} failed: {e}")
+            job.update(status=FAILED, error=str(e))
+        job["finished_at"] = time.time()
+        self._save(job)
+        # Uploads are only needed to re-run an unfinished job
+        shutil.rmtree(self._path(job_id) / "uploads", ignore_errors=True)
@@ -0,0 +1,363 @@
+# server/agents/llm_scheduler.py
+
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Optional, Callable, Any, List
+
+from . import profiling
+
+
+class CallCancelled(Exception):
+    """Raised inside a worker whose attempt was abandoned (lost a hedge or the caller left)."""
+
+
+class Attempt:
+    """One execution of a submitted call, handed to ``fn`` as ``attempt=``.
+
+    Workers call ``check()`` between steps (e.g. per streamed chunk) so abandoned
+    attempts stop early, and ``claim()`` before their first side effect so only one
+    attempt of a hedged call ever emits anything. ``record_latency()`` reports each
+    real backend call; only those samples set the hedge delay.
+    """
+
+    def __init__(self, group: "_AttemptGroup"):
+        self._group = group
+        self.cancelled = threading.Event()
+        self.latencies: List[float] = []
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise CallCancelled()
+
+    def claim(self) -> bool:
+        """Become the only attempt allowed to produce side effects; False if another won."""
+        return self._group.claim(self)
+
+    def record_latency(self, seconds: float):
+        """Report one backend call (not cache hits or local work) for the hedge delay."""
+        self.latencies.append(seconds)
+
+
+class _AttemptGroup:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = []
+        self.owner = None
+
+    def new(self) -> Attempt:
+        attempt = Attempt(self)
+        with self._lock:
+            self.attempts.append(attempt)
+            if self.owner is not None:
+                attempt.cancelled.set()
+        return attempt
+
+    def claim(self, attempt: Attempt) -> bool:
+        with self._lock:
+            if self.owner is None:
+                self.owner = attempt
+                for other in self.attempts:
+                    if other is not attempt:
+                        other.cancelled.set()
+            return self.owner is attempt
+
+    def cancel_all(self):
+        with self._lock:
+            for attempt in self.attempts:
+                attempt.cancelled.set()
+
+
+class LLMScheduler:
+    """Process-wide admission control for LLM calls.
+
+    Every (pair, batch) unit of every running request goes through ``submit``. Units are
+    admitted strictly in FIFO order, subject to:
+
+    - the deployment's tokens-per-minute and requests-per-minute budgets (token buckets),
+    - a concurrency limit derived from those budgets via Little's law
+      (in-flight = allowed throughput × observed call latency).
+
+    Cancellable calls may also be hedged: if a call is still running after the observed
+    p95 latency and there is spare capacity, a duplicate is started and whichever
+    finishes first wins. Hedges are capped at ``max_hedge_rate`` of submitted calls.
+    The latency window only holds backend-call latencies reported by winning attempts
+    (``Attempt.record_latency``), so fast local work cannot drag the hedge delay down.
+
+    One scheduler instance is meant to be shared by the whole process and used from a
+    single event loop (uvicorn's); see ``get_scheduler``.
+    """
+
+    def __init__(
+        self,
+        tpm_limit: Optional[int] = None,
+        rpm_limit: Optional[int] = None,
+        max_concurrency: int = 32,
+        min_concurrency: int = 1,
+        initial_latency: float = 10.0,
+        hedge_quantile: float = 0.95,
+        max_hedge_rate: float = 0.05,
+        hedge_min_samples: int = 20,
+    ):
+        self.tpm_limit = tpm_limit
+        self.rpm_limit = rpm_limit
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.hedge_quantile = hedge_quantile
+        self.max_hedge_rate = max_hedge_rate
+        self.hedge_min_samples = hedge_min_samples
+
+        self._waiters = deque()  # (future, est_tokens)
+        self._in_flight = 0
+        self._wake_handle = None
+
+        # Token buckets start full; capacity = one minute of quota
+        now = time.monotonic()
+        self._tokens = float(tpm_limit or 0)
+        self._requests = float(rpm_limit or 0)
+        self._refilled_at = now
+
+        # EWMAs used to size concurrency dynamically
+        self._latency = initial_latency
+        self._tokens_per_call = 2000.0
+        # Recent backend-call latencies reported by attempts, for the hedge delay
+        self._latencies = deque(maxlen=500)
+        # Running attempts (incl. abandoned ones), kept referenced until their thread returns
+        self._attempt_tasks = set()
+
+        self.stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "skipped": 0, "max_in_flight": 0,
+            "hedged": 0, "hedge_wins": 0, "cancelled": 0,
+        }
+
+    # ------------------------------------------------------------------
+    def concurrency_limit(self) -> int:
+        """Current cap on in-flight calls, from the budgets and observed latency."""
+        limit = self.max_concurrency
+        if self.rpm_limit:
+            limit = min(limit, math.ceil(self.rpm_limit / 60.0 * self._latency))
+        if self.tpm_limit:
+            limit = min(limit, math.ceil(self.tpm_limit / 60.0 * self._latency / max(self._tokens_per_call, 1.0)))
+        return max(self.min_concurrency, limit)
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+    def hedge_delay(self) -> Optional[float]:
+        """How long a call may run before it is hedged (None until enough samples)."""
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        return self.latency_quantile(self.hedge_quantile)
+
+    async def submit(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        est_tokens: int = 0,
+        skip_if: Optional[Callable[[], bool]] = None,
+        cancellable: bool = False,
+        hedge: bool = False,
+        **kwargs,
+    ) -> Any:
+        """Wait for admission, then run the blocking ``fn`` in a worker thread.
+
+        ``skip_if`` is checked once the call is admitted; if it returns True, ``fn`` is
+        not run, the slot and the reserved budget are handed back and None is returned.
+
+        With ``cancellable`` (implied by ``hedge``) ``fn`` receives an ``attempt=``
+        argument; if the caller is cancelled, or another attempt wins, the attempt is
+        flagged so the worker can stop, and its slot is held until the thread returns.
+        """
+        self.stats["submitted"] += 1
+        await self._acquire(est_tokens)
+        if skip_if is not None and skip_if():
+            self._refund(est_tokens)
+            return None
+
+        if cancellable or hedge:
+            return await self._run_attempts(fn, args, kwargs, est_tokens, hedge)
+
+        start = time.monotonic()
+        ok = False
+        try:
+            result = await profiling.to_thread(fn, *args, **kwargs)
+            ok = True
+            return result
+        finally:
+            latency = time.monotonic() - start
+            self.stats["completed" if ok else "failed"] += 1
+            self._release(latency, est_tokens, ok)
+
+    # ------------------------------------------------------------------
+    async def _run_attempts(self, fn, args, kwargs, est_tokens: int, hedge: bool) -> Any:
+        group = _AttemptGroup()
+        start = time.monotonic()
+        first, attempt = self._start_attempt(fn, args, kwargs, group, est_tokens)
+        attempts = {first: attempt}
+        pending = {first}
+        hedged = False
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                timeout = None
+                if hedge and not hedged:
+                    delay = self.hedge_delay()
+                    if delay is not None:
+                        timeout = max(0.0, start + delay - time.monotonic())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True  # at most one duplicate per call
+                    if self._admit_hedge(est_tokens):
+                        task, attempts[task] = self._start_attempt(fn, args, kwargs, group, est_tokens)
+                        pending.add(task)
+                    continue
+                for task in done:
+                    exc = task.exception()
+                    if exc is None:
+                        group.cancel_all()
+                        self._latencies.extend(attempts[task].latencies)
+                        self.stats["completed"] += 1
+                        if task is not first:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    if error is None or isinstance(error, CallCancelled):
+                        error = exc
+            self.stats["failed"] += 1
+            raise error
+        except asyncio.CancelledError:
+            group.cancel_all()
+            self.stats["cancelled"] += 1
+            raise
+
+    def _start_attempt(self, fn, args, kwargs, group: _AttemptGroup, est_tokens: int):
+        """Run one attempt in a worker thread; returns ``(task, attempt)``."""
+        attempt = group.new()
+        started = time.monotonic()
+        task = asyncio.ensure_future(profiling.to_thread(fn, *args, attempt=attempt, **kwargs))
+        self._attempt_tasks.add(task)
+
+        def finished(t: asyncio.Future):
+            # The slot is released when the worker thread really returns, not when abandoned
+            self._attempt_tasks.discard(t)
+            ok = not t.cancelled() and t.exception() is None
+            self._release(time.monotonic() - started, est_tokens, ok)
+
+        task.add_done_callback(finished)
+        return task, attempt
+
+    def _admit_hedge(self, est_tokens: int) -> bool:
+        """Start a duplicate only with spare capacity and within the hedge-rate cap."""
+        if self.stats["hedged"] + 1 > self.max_hedge_rate * self.stats["submitted"]:
+            return False
+        self._refill()
+        if self._waiters or self._in_flight >= self.concurrency_limit():
+            return False
+        need_tokens = min(float(est_tokens), float(self.tpm_limit)) if self.tpm_limit else 0.0
+        if self.tpm_limit and self._tokens < need_tokens:
+            return False
+        if self.rpm_limit and self._requests < 1.0:
+            return False
+        if self.tpm_limit:
+            self._tokens -= need_tokens
+        if self.rpm_limit:
+            self._requests -= 1.0
+        self._in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+        self.stats["hedged"] += 1
+        return True
+
+    # ------------------------------------------------------------------
+    async def _acquire(self, est_tokens: int):
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((fut, est_tokens))
+        self._wake()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Admitted but abandoned before running → hand the slot back
+                self._in_flight -= 1
+                self._wake()
+            raise
+
+    def _release(self, latency: float, est_tokens: int, ok: bool):
+        self._in_flight -= 1
+        if ok:
+            self._latency = 0.8 * self._latency + 0.2 * latency
+            if est_tokens:
+                self._tokens_per_call = 0.8 * self._tokens_per_call + 0.2 * est_tokens
+        self._wake()
+
+    def _refund(self, est_tokens: int):
+        """Give back an admitted call's slot and budget without running it."""
+        self._in_flight -= 1
+        self.stats["skipped"] += 1
+        if self.tpm_limit:
+            self._tokens = min(float(self.tpm_limit), self._tokens + min(float(est_tokens), float(self.tpm_limit)))
+        if self.rpm_limit:
+            self._requests = min(float(self.rpm_limit), self._requests + 1.0)
+        self._wake()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.tpm_limit:
+            self._tokens = min(float(self.tpm_limit), self._tokens + elapsed * self.tpm_limit / 60.0)
+        if self.rpm_limit:
+            self._requests = min(float(self.rpm_limit), self._requests + elapsed * self.rpm_limit / 60.0)
+
+    def _wake(self):
+        """Admit waiters from the head of the queue while budgets allow."""
+        if self._wake_handle is not None:
+            self._wake_handle.cancel()
+            self._wake_handle = None
+
+        self._refill()
+        while self._waiters and self._in_flight < self.concurrency_limit():
+            fut, est_tokens = self._waiters[0]
+            if fut.done():  # cancelled while waiting
+                self._waiters.popleft()
+                continue
+
+            # A request can never need more than a full bucket
+            need_tokens = min(float(est_tokens), float(self.tpm_limit)) if self.tpm_limit else 0.0
+            wait = 0.0
+            if self.tpm_limit and self._tokens < need_tokens:
+                wait = max(wait, (need_tokens - self._tokens) * 60.0 / self.tpm_limit)
+            if self.rpm_limit and self._requests < 1.0:
+                wait = max(wait, (1.0 - self._requests) * 60.0 / self.rpm_limit)
+            if wait > 0:
+                self._wake_handle = asyncio.get_running_loop().call_later(wait, self._wake)
+                return
+
+            self._waiters.popleft()
+            if self.tpm_limit:
+                self._tokens -= need_tokens
+            if self.rpm_limit:
+                self._requests -= 1.0
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+            fut.set_result(None)
+
+
+_SCHEDULER: Optional[LLMScheduler] = None
+
+
+def get_scheduler() -> LLMScheduler:
+    """Return the process-wide scheduler, configured from the deployment quota env vars."""
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        _SCHEDULER = LLMScheduler(
+            tpm_limit=int(os.getenv("AZURE_OPENAI_TPM", "0")) or None,
+            rpm_limit=int(os.getenv("AZURE_OPENAI_RPM", "0")) or None,
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+            max_hedge_rate=float(os.getenv("LLM_MAX_HEDGE_RATE", "0.05")),
+        )
+    return _SCHEDULER
@@ -2,20 +2,35 @@
 from fastapi import FastAPI, UploadFile, File
 from typing import List,Optional
 from pathlib import Path
-from .agents.chunking_agent import ChunkingAgent
+from .agents.chunking_agent import ChunkingAgent, SOURCE_LABELS, parse_and_chunk_file
 from .agents.embedding_agent import EmbeddingAgent
 from .agents.vectorstore_agent import VectorStoreAgent
-from .agents.context_agent import ContextAgent
+from .agents.context_agent import ContextAgent, KB_SOURCES
+from .agents.job_manager import JobManager
+from .agents.corpus_registry import CorpusRegistry
+from .agents.export_agent import ExportAgent, EXPORT_FORMATS
+from .agents.metrics import STAGE_SECONDS, HTTP_SECONDS, render as render_metrics
+from .agents import tracing
+from .agents.tracing import span
+from .agents import profiling
+from .agents.memory import MemoryTracker, MemoryBudgetExceeded, plan_window, precheck_uploads
 from .utils.azure_openai_client import client
-from .utils.file_parser import parse_file
 from .agents.embedding_agent import EmbeddingAgent
 from .utils.logger import logger
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 import pandas as pd
 import tempfile
-from fastapi.responses import FileResponse
+import shutil
+import hashlib
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, PlainTextResponse
 import logging
+import asyncio
+import json
 import time 
 import sys 
 import os 
@@ -33,8 +48,418 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Qdrant alias that always points at the most recently ingested collection version
+COLLECTION_ALIAS = os.getenv("QDRANT_COLLECTION", "dfmea_collection")
+
 chunker = ChunkingAgent()
 embedder = EmbeddingAgent()
+# CPU-bound parse + chunk runs here, one file per task, so the event loop stays responsive
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        # "spawn": forking a process that already runs threads can deadlock the child
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("DFMEA_PARSE_WORKERS", "0")) or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _parse_pool
+
+# DFMEA exports served by /download/{file_id}; ones never downloaded are swept after a TTL
+exporter = ExportAgent(os.getenv("DFMEA_EXPORT_DIR") or tempfile.gettempdir())
+_export_tasks = set()
+EXPORT_TTL_SECONDS = float(os.getenv("DFMEA_EXPORT_TTL_MINUTES", "60")) * 60
+_export_sweeper: Optional[asyncio.Task] = None
+
+# Ingested corpora that /dfmea/generate can reuse via corpus_id
+corpus_registry = CorpusRegistry(os.getenv("DFMEA_CORPUS_DIR", os.path.join(tempfile.gettempdir(), "dfmea_corpora")))
+
+
+def _no_progress(stage: str, percent: float):
+    pass
+
+
+# Upload limits; request bodies are cut off as soon as they grow past MAX_REQUEST_BYTES
+UPLOAD_BLOCK_SIZE = 1 << 20
+MAX_FILE_BYTES = int(float(os.getenv("DFMEA_MAX_FILE_MB", "250")) * (1 << 20))
+MAX_REQUEST_BYTES = int(float(os.getenv("DFMEA_MAX_REQUEST_MB", "1024")) * (1 << 20))
+UPLOAD_FIELDS = ("prds", "knowledge_base", "field_issues")
+
+
+class UploadTooLarge(Exception):
+    """An upload exceeded the per-file or per-request size limit (→ HTTP 413)."""
+
+
+@app.exception_handler(UploadTooLarge)
+async def upload_too_large(request, exc: UploadTooLarge):
+    return JSONResponse(status_code=413, content={"status": "error", "message": str(exc)})
+
+
+@app.exception_handler(MemoryBudgetExceeded)
+async def memory_budget_exceeded(request, exc: MemoryBudgetExceeded):
+    # Within the upload limits, but this process cannot ingest it under DFMEA_MEMORY_BUDGET_MB
+    return JSONResponse(status_code=507, content={
+        "status": "error",
+        "message": f"Not enough memory budget to ingest these uploads: {exc}",
+    })
+
+
+class LimitRequestBody:
+    """ASGI middleware capping POST bodies at ``max_bytes`` while they are received.
+
+    Bodies announcing a larger Content-Length are rejected before anything is read;
+    otherwise bytes are counted as they arrive and the request is aborted with 413 the
+    moment the cap is crossed, before Starlette has spooled the rest of the multipart
+    body to disk. (Per-file limits are checked by ``_save_uploads``.)
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+
+        message = f"Request body exceeds {self.max_bytes} bytes"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(message, scope, receive, send)
+
+        received = 0
+        exceeded = started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            msg = await receive()
+            if msg["type"] == "http.request":
+                received += len(msg.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    # FastAPI re-raises HTTPExceptions from body parsing (anything else → 400)
+                    raise HTTPException(status_code=413, detail=message)
+            return msg
+
+        async def guarded_send(msg):
+            nonlocal started
+            if exceeded and not started:
+                return  # the app's error response is replaced by ours below
+            started = True
+            await send(msg)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except HTTPException:
+            if not exceeded:
+                raise
+        if exceeded and not started:
+            await self._reject(message, scope, receive, send)
+
+    @staticmethod
+    async def _reject(message: str, scope, receive, send):
+        response = JSONResponse(status_code=413, content={"status": "error", "message": message})
+        await response(scope, receive, send)
+
+
+app.add_middleware(LimitRequestBody, max_bytes=MAX_REQUEST_BYTES)
+
+
+@app.middleware("http")
+async def record_request_latency(request, call_next):
+    # Streaming routes are timed to their first byte; the body is covered by stage metrics
+    start = time.perf_counter()
+    status = 500
+    with span("http.request", method=request.method, path=request.url.path) as request_span:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            if request_span.trace_id:
+                response.headers["X-Trace-Id"] = request_span.trace_id
+            return response
+        finally:
+            # Route template rather than raw path, so ids don't explode the label set
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            request_span.set(route=route, status=status)
+            HTTP_SECONDS.observe(time.perf_counter() - start, route=route, status=status)
+
+
+PROFILED_PATHS = {"/dfmea/generate", "/dfmea/generate/stream"}
+
+
+@app.middleware("http")
+async def profile_generate_requests(request, call_next):
+    # Off by default: one set lookup + one header lookup, nothing else
+    if request.url.path not in PROFILED_PATHS or not profiling.requested(request.headers):
+        return await call_next(request)
+
+    request_id = uuid.uuid4().hex
+    profiler = profiling.try_start(request_id)
+    if profiler is None:
+        return await call_next(request)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        await asyncio.to_thread(profiler.finish)
+        raise
+
+    # Keep sampling until the body is fully sent (the stream route generates while streaming)
+    body = response.body_iterator
+
+    async def profiled_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            await asyncio.to_thread(profiler.finish)
+
+    response.body_iterator = profiled_body()
+    response.headers["X-Profile-Id"] = request_id
+    return response
+
+
+async def _save_uploads(uploads: dict, dest_for) -> dict:
+    """Stream each upload to ``dest_for(field)/<basename>`` in fixed-size blocks.
+
+    Hashes (sha256) while writing, so memory stays at one block per file whatever the
+    upload size. The files are already spooled by Starlette at this point: only
+    ``LimitRequestBody`` stops an oversized body early; the per-file and per-request
+    limits here keep oversized files out of the job / corpus directories.
+    Returns ``{field: [{"path", "name", "size", "sha256"}]}``.
+    """
+    saved = {field: [] for field in UPLOAD_FIELDS}
+    request_bytes = 0
+    for field in UPLOAD_FIELDS:
+        for f in uploads.get(field) or []:
+            name = Path(f.filename).name
+            size = getattr(f, "size", None)
+            if size is not None and size > MAX_FILE_BYTES:
+                raise UploadTooLarge(f"{name} exceeds the {MAX_FILE_BYTES} byte per-file limit")
+
+            dest = Path(dest_for(field))
+            dest.mkdir(parents=True, exist_ok=True)
+            path = dest / name
+            digest = hashlib.sha256()
+            written = 0
+            with open(path, "wb") as buffer:
+                while True:
+                    block = await f.read(UPLOAD_BLOCK_SIZE)
+                    if not block:
+                        break
+                    written += len(block)
+                    request_bytes += len(block)
+                    if written > MAX_FILE_BYTES:
+                        raise UploadTooLarge(f"{name} exceeds the {MAX_FILE_BYTES} byte per-file limit")
+                    if request_bytes > MAX_REQUEST_BYTES:
+                        raise UploadTooLarge(f"Uploads exceed the {MAX_REQUEST_BYTES} byte per-request limit")
+                    digest.update(block)
+                    await asyncio.to_thread(buffer.write, block)
+            saved[field].append({"path": str(path), "name": name, "size": written, "sha256": digest.hexdigest()})
+    return saved
+
+
+def _paths(saved: dict, field: str) -> List[str]:
+    return [record["path"] for record in saved[field]]
+
+
+async def _ingest(prd_paths: List[str], kb_paths: List[str], fi_paths: List[str], progress=_no_progress) -> dict:
+    """Parse → chunk → embed → index saved uploads into a fresh, pinned collection version.
+
+    Returns the embedding summary plus the vectorstore/version the caller must release
+    with ``_release_version`` once generation is done. ``progress(stage, percent)``
+    reports ingestion as the first half of a job.
+    """
+    memory = MemoryTracker()
+    memory.mark("start")
+    min_window = embedder.batch_size * embedder.concurrency
+    try:
+        precheck_uploads([*(prd_paths or []), *(kb_paths or []), *(fi_paths or [])], min_window=min_window)
+    except MemoryBudgetExceeded as e:
+        logger.error(f"[Memory] ❌ Rejecting ingestion before parsing: {e}")
+        raise
+
+    # Steps 1-4: Parse + chunk every file in the process pool (one file per task)
+    progress("parsing", 0)
+    loop = asyncio.get_running_loop()
+    pool = _get_parse_pool()
+    uploads = [
+        (path, SOURCE_LABELS[field])
+        for field, paths in (("prds", prd_paths), ("knowledge_base", kb_paths), ("field_issues", fi_paths))
+        for path in paths or []
+    ]
+    parsed = 0
+
+    async def parse_and_chunk(path: str, source: str) -> dict:
+        nonlocal parsed
+        with span("ingest.parse_chunk", file=Path(path).name, source=source) as file_span:
+            args = (path, source, chunker.max_tokens, chunker.overlap, chunker.model_name)
+            if profiling.active():
+                # Profiled requests chunk in-process so the sampler sees ChunkingAgent
+                result = await profiling.to_thread(parse_and_chunk_file, *args)
+            else:
+                result = await loop.run_in_executor(pool, parse_and_chunk_file, *args)
+            file_span.set(rows=result["rows"], chunks=len(result["texts"]), tokens=sum(result["tokens"]),
+                          parse_seconds=result["timings"]["parse"], chunk_seconds=result["timings"]["chunk"])
+        parsed += 1
+        STAGE_SECONDS.observe(result["timings"]["parse"], stage="parse")
+        STAGE_SECONDS.observe(result["timings"]["chunk"], stage="chunk")
+        logger.info(f"[Parser] Parsed {Path(path).name} ({result['rows']} rows → {len(result['texts'])} chunks)")
+        progress("parsing", 15 * parsed / len(uploads))
+        return result
+
+    results = await asyncio.gather(*(parse_and_chunk(path, source) for path, source in uploads))
+    memory.mark("parsed")
+    all_chunks = chunker.from_results(results)
+    del results
+    memory.mark("chunked")
+    logger.info(f"[Chunker] ✅ Created {len(all_chunks)} total chunks from {len(uploads)} files")
+
+    # Step 5: Count source-wise chunks
+    summary = {
+        "total_vectors": len(all_chunks),
+        "prd_vectors": sum(1 for c in all_chunks if c["metadata"]["source"] == "prds"),
+        "kb_vectors": sum(1 for c in all_chunks if c["metadata"]["source"] in KB_SOURCES),
+        "fi_vectors": sum(1 for c in all_chunks if c["metadata"]["source"] == "field_issues"),
+    }
+
+    # Over the memory budget → embed + index in windows so one window of vectors is alive at a time
+    try:
+        window = plan_window(len(all_chunks), min_window=min_window)
+    except MemoryBudgetExceeded as e:
+        logger.error(f"[Memory] ❌ Rejecting ingestion: {e}")
+        raise
+    if window < len(all_chunks):
+        summary["ingest_windows"] = -(-len(all_chunks) // window)
+        logger.info(f"[Memory] 🪟 Over budget in one pass; embedding + indexing {window} chunks at a time")
+
+    # Steps 6-7: Embed, insert into a job-private collection version, then make it live
+    progress("embedding", 15)
+    vectorstore = VectorStoreAgent(collection_name=COLLECTION_ALIAS)
+    collection_version = None
+    indexed = 0
+    try:
+        for start in range(0, len(all_chunks), window or 1):
+            part = all_chunks[start:start + window]
+            logger.info(f"[EmbeddingAgent] 🚀 Starting embeddings for {len(part)} chunks")
+            with span("ingest.embed", chunks=len(part), offset=start):
+                embedded_chunks = await embedder.embed_chunks_async(part)
+            memory.mark("embedded")
+            progress("indexing", 15 + 25 * (start + len(part)) / len(all_chunks))
+            if not embedded_chunks:
+                continue
+
+            if collection_version is None:
+                collection_version = await profiling.to_thread(
+                    vectorstore.create_versioned_collection, len(embedded_chunks[0]["embedding"])
+                )
+            with span("ingest.index", collection=collection_version, vectors=len(embedded_chunks), offset=start):
+                await profiling.to_thread(vectorstore.add_embeddings, embedded_chunks, id_offset=start)
+            indexed += len(embedded_chunks)
+            del embedded_chunks
+            memory.mark("indexed")
+        if collection_version is not None:
+            await profiling.to_thread(vectorstore.promote_version, collection_version)
+    except Exception:
+        if collection_version is not None:
+            await _release_version(vectorstore, collection_version)
+        raise
+
+    if collection_version is not None:
+        logger.info(f"[VectorStore] ✅ Inserted {indexed} vectors into {collection_version}")
+    else:
+        # Nothing new to index → read from whatever version is live right now
+        collection_version = await profiling.to_thread(vectorstore.resolve_alias) or COLLECTION_ALIAS
+        vectorstore.pin_version(collection_version)
+
+    if memory.enabled:
+        summary["memory"] = memory.report()
+    progress("indexing", 50)
+    return {"summary": summary, "vectorstore": vectorstore, "collection_version": collection_version}
+
+
+async def _ingest_uploads(prds, knowledge_base, field_issues) -> dict:
+    """``_ingest`` for request uploads, staged in a per-request temp dir."""
+    upload_dir = Path(tempfile.mkdtemp(prefix="dfmea_upload_"))
+    try:
+        saved = await _save_uploads(
+            {"prds": prds, "knowledge_base": knowledge_base, "field_issues": field_issues},
+            lambda field: upload_dir / field,
+        )
+        return await _ingest(_paths(saved, "prds"), _paths(saved, "knowledge_base"), _paths(saved, "field_issues"))
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+async def _open_corpus(corpus_id: str) -> dict:
+    """Pin an already indexed corpus instead of ingesting (same shape as ``_ingest``)."""
+    record = corpus_registry.get(corpus_id)
+    if record is None:
+        raise ValueError(f"Unknown corpus_id: {corpus_id}")
+    if record.get("embedding_model") != embedder.deployment:
+        raise ValueError(f"Corpus {corpus_id} was embedded with {record.get('embedding_model')}; re-ingest it")
+
+    vectorstore = VectorStoreAgent(collection_name=COLLECTION_ALIAS)
+    collection_version = record["collection_version"]
+    vectorstore.pin_version(collection_version)
+    if not await profiling.to_thread(vectorstore.client.collection_exists, collection_version):
+        vectorstore.unpin_version(collection_version)
+        raise ValueError(f"Index for corpus {corpus_id} no longer exists; re-ingest it")
+    logger.info(f"[Corpus] ♻️ Reusing corpus {corpus_id} ({collection_version})")
+    return {"summary": record["embedding_summary"], "vectorstore": vectorstore, "collection_version": collection_version}
+
+
+async def _prepare(corpus_id: Optional[str], prds, knowledge_base, field_issues) -> dict:
+    """Generation input: a registered corpus if given, otherwise the request uploads."""
+    if corpus_id:
+        return await _open_corpus(corpus_id)
+    return await _ingest_uploads(prds, knowledge_base, field_issues)
+
+
+async def _release_version(vectorstore: VectorStoreAgent, collection_version: str):
+    """Unpin a job's collection version and GC versions nobody references anymore."""
+    vectorstore.unpin_version(collection_version)
+    try:
+        # Versions backing a registered corpus stay until the corpus is re-ingested
+        await asyncio.to_thread(vectorstore.garbage_collect_versions, corpus_registry.versions())
+    except Exception as ge:
+        logger.warning(f"[VectorStore] ⚠️ Version GC skipped: {ge}")
+
+
+def _context_agent(collection_version: str, cache_bypass: bool = False) -> ContextAgent:
+    """ContextAgent pinned to one collection version, tuned from env."""
+    return ContextAgent(
+        llm_client=client,
+        batch_size=10,
+        collection_name=collection_version,
+        rerank=os.getenv("DFMEA_MMR_RERANK", "0") == "1",
+        rerank_top_n=int(os.getenv("DFMEA_MMR_TOP_N", "30")),
+        mmr_lambda=float(os.getenv("DFMEA_MMR_LAMBDA", "0.5")),
+        batching=os.getenv("DFMEA_BATCHING", "fixed"),
+        batch_token_budget=int(os.getenv("DFMEA_BATCH_TOKEN_BUDGET", "8000")),
+        tpm_limit=int(os.getenv("AZURE_OPENAI_TPM", "0")) or None,
+        cache_bypass=cache_bypass,
+        structured_output=os.getenv("DFMEA_STRUCTURED_OUTPUT", "0") == "1",
+        early_stop=os.getenv("DFMEA_EARLY_STOP", "0") == "1",
+        early_stop_window=int(os.getenv("DFMEA_EARLY_STOP_WINDOW", "2")),
+        early_stop_min_new=float(os.getenv("DFMEA_EARLY_STOP_MIN_NEW", "0.2")),
+        fusion=os.getenv("DFMEA_FUSION", "0") == "1",
+        fusion_threshold=float(os.getenv("DFMEA_FUSION_THRESHOLD", "0.8")),
+        fusion_max_pairs=int(os.getenv("DFMEA_FUSION_MAX_PAIRS", "4")),
+        request_budget=float(os.getenv("DFMEA_REQUEST_BUDGET", "0")) or None,
+        hedge=os.getenv("DFMEA_HEDGE", "0") == "1",
+    )
+
+
+def _run_kwargs(products: List[str], subproducts: List[str], focus: Optional[str]) -> dict:
+    return {
+        "query": "DFMEA for Zebra hardware",
+        "products": products,
+        "subproducts": subproducts,
+        "focus": focus,
+        "top_k": 50,
+        "pair_queries": os.getenv("DFMEA_PAIR_QUERIES", "0") == "1",
+    }
 
 
 @app.post("/dfmea/generate")
@@ -44,174 +469,340 @@ async def generate_dfmea(
     focus: Optional[str] = Form(None),
     prds: List[UploadFile] = File(None),
     knowledge_base: List[UploadFile] = File(None),
-    field_issues: List[UploadFile] = File(None)
+    field_issues: List[UploadFile] = File(None),
+    cache_bypass: bool = Form(False),
+    corpus_id: Optional[str] = Form(None),
+    export_format: str = Form("xlsx")
 ):
     try:
+        if export_format not in EXPORT_FORMATS:
+            return {"status": "error", "message": f"Unsupported export_format '{export_format}'"}
+
         # 🔹 Log frontend inputs
         logger.info("📥 [Frontend Input] Products: %s", products)
         logger.info("📥 [Frontend Input] Subproducts: %s", subproducts)
         logger.info("📥 [Frontend Input] Focus: %s", focus if focus else "None")
 
-        # Step 1: Buckets for parsed data
-        prd_data, kb_data, fi_data = [], [], []
-
-        # Step 2: File processor
-        async def process_files(files, bucket: list, label: str):
-            if not files:
-                return
-            for f in files:
-                tmp_path = Path(f.filename)
-                with open(tmp_path, "wb") as buffer:
-                    buffer.write(await f.read())
-
-                parsed_data = parse_file(tmp_path)
-                logger.info(f"[Parser] Parsed {f.filename} ({len(parsed_data)} chars)")
-                bucket.extend(parsed_data)
-
-        # Step 3: Parse all files into buckets
-        await process_files(prds, prd_data, "prds")
-        await process_files(knowledge_base, kb_data, "knowledge_base")
-        await process_files(field_issues, fi_data, "field_issues")
-
-        # Step 4: Chunk data
-        all_chunks = chunker.run(prd_data, kb_data, fi_data)
-        logger.info(f"[Chunker] ✅ Created {len(all_chunks)} total chunks via run()")
-
-        # Step 5: Count source-wise chunks
-        prd_chunks = sum(1 for c in all_chunks if c["metadata"]["source"] == "prds")
-        kb_chunks = sum(1 for c in all_chunks if c["metadata"]["source"] == "knowledge_base")
-        fi_chunks = sum(1 for c in all_chunks if c["metadata"]["source"] == "field_issues")
-        total_chunks = len(all_chunks)
-
-        # # Step 6: Embedding
-        # embedded_chunks = []
-        # if all_chunks:
-        #     batch_size = 50
-        #     total_batches = (len(all_chunks) + batch_size - 1) // batch_size
-
-        #     logger.info(f"[EmbeddingAgent] 🚀 Starting embeddings for {len(all_chunks)} chunks")
-        #     for i in range(total_batches):
-        #         start = i * batch_size
-        #         end = min((i + 1) * batch_size, len(all_chunks))
-        #         batch = all_chunks[start:end]
-
-        #         batch_embedded = await embedder.embed_chunks_async(batch)
-        #         embedded_chunks.extend(batch_embedded)
-
-        #         # pct = int(((i + 1) / total_batches) * 100)
-        #         # sys.stdout.write(f"\r[Embedding Progress] {pct}%\n")
-        #         # sys.stdout.flush()
-        #         # time.sleep(0.05)
-
-        #     sys.stdout.write("\n")
-        #     logger.info(f"[EmbeddingAgent] ✅ Completed embeddings: {len(all_chunks)} total")
-        # Step 6: Embedding
-        embedded_chunks = []
-        if all_chunks:
-            batch_size = 50
-            total_batches = (len(all_chunks) + batch_size - 1) // batch_size
-
-            logger.info(f"[EmbeddingAgent] 🚀 Starting embeddings for {len(all_chunks)} chunks "
-                        f"(batch_size={batch_size}, total_batches={total_batches})")
-
-            # for i in range(total_batches):
-            #     start = i * batch_size
-            #     end = min((i + 1) * batch_size, len(all_chunks))
-            #     batch = all_chunks[start:end]
-
-            #     batch_embedded = await embedder.embed_chunks_async(batch)
-            #     embedded_chunks.extend(batch_embedded)
-
-            #     # Log progress every 5% or every 10 batches
-            #     if (i + 1) % max(1, total_batches // 20) == 0 or (i + 1) == total_batches:
-            #         pct = int(((i + 1) / total_batches) * 100)
-            #         logger.info(f"[EmbeddingAgent] 📊 Progress: {pct}% "
-            #                     f"({i+1}/{total_batches} batches done)")
-            # Do embedding once (no batching here)
-            embedded_chunks = await embedder.embed_chunks_async(all_chunks)
-
-            # Now run a dummy loop just for progress logs
-            total_batches = (len(all_chunks) + batch_size - 1) // batch_size
-            for i in range(total_batches):
-                pct = int(((i + 1) / total_batches) * 100)
-                logger.info(f"[EmbeddingAgent] 📊 Progress: {pct}% "
-                            f"({i+1}/{total_batches} batches done)")
-
-            # logger.info(f"[EmbeddingAgent] ✅ Completed embeddings: {len(embedded_chunks)} total")
-
-
-        # Step 7: Insert into Qdrant (fixed collection name)
-        collection_name = "dfmea_collection"
-        if embedded_chunks:
-            vectorstore = VectorStoreAgent(collection_name=collection_name)
-            vectorstore.create_collection(vector_dim=len(embedded_chunks[0]["embedding"]))
-            vectorstore.add_embeddings(embedded_chunks)
-            logger.info(f"[VectorStore] ✅ Inserted {len(embedded_chunks)} vectors into Qdrant")
-
-        # 🔹 Step 8: ContextAgent execution
+        ingest = await _prepare(corpus_id, prds, knowledge_base, field_issues)
+
+        # 🔹 Step 8: ContextAgent execution (pinned to this job's version)
         dfmea_entries = []   # ensure it always exists
+        context_agent = None
         try:
-            context_agent = ContextAgent(
-                llm_client=client,
-                batch_size=10,
-                collection_name=collection_name
-            )
-            dfmea_entries = await context_agent.run(
-                query="DFMEA for Zebra hardware",
-                products=products,
-                subproducts=subproducts,
-                focus=focus,
-                top_k=50
-            )
+            context_agent = _context_agent(ingest["collection_version"], cache_bypass)
+            dfmea_entries = await context_agent.run(**_run_kwargs(products, subproducts, focus))
         except Exception as ce:
             logger.error(f"[ContextAgent] ❌ Error while running DFMEA: {ce}")
+        finally:
+            await _release_version(ingest["vectorstore"], ingest["collection_version"])
 
-        # ✅ Step 9: Final JSON Response
+        # ✅ Step 9: Final JSON Response (export is written in the background)
         return {
             "status": "success",
-            "embedding_summary": {
-                "total_vectors": total_chunks,
-                "prd_vectors": prd_chunks,
-                "kb_vectors": kb_chunks,
-                "fi_vectors": fi_chunks
-            },
+            "embedding_summary": ingest["summary"],
+            "generation_stats": context_agent.stats if context_agent else {},
+            "file_id": _start_export(dfmea_entries, export_format),
+            "export_format": export_format,
             "dfmea_entries": dfmea_entries
         }
 
+    except (UploadTooLarge, MemoryBudgetExceeded):
+        raise
     except Exception as e:
         logger.error(f"[DFMEA] ❌ Error: {e}")
         return {"status": "error", "message": str(e)}
 
 
-@app.get("/download/{file_id}")
-async def download_file(file_id: str):
+@app.post("/dfmea/generate/stream")
+async def generate_dfmea_stream(
+    products: List[str] = Form(...),
+    subproducts: List[str] = Form(...),
+    focus: Optional[str] = Form(None),
+    prds: List[UploadFile] = File(None),
+    knowledge_base: List[UploadFile] = File(None),
+    field_issues: List[UploadFile] = File(None),
+    cache_bypass: bool = Form(False),
+    corpus_id: Optional[str] = Form(None),
+    export_format: str = Form("xlsx")
+):
+    """Same pipeline as /dfmea/generate, but streams NDJSON: one line per DFMEA entry
+    as soon as its batch produces it, then a final ``done`` line (with the export file_id)."""
+    if export_format not in EXPORT_FORMATS:
+        return {"status": "error", "message": f"Unsupported export_format '{export_format}'"}
+    logger.info("📥 [Frontend Input] (stream) Products: %s | Subproducts: %s", products, subproducts)
     try:
-        file_path = Path(tempfile.gettempdir()) / f"{file_id}.xlsx"
+        # Ingestion finishes before streaming starts (uploads are closed after this handler)
+        ingest = await _prepare(corpus_id, prds, knowledge_base, field_issues)
+    except (UploadTooLarge, MemoryBudgetExceeded):
+        raise
+    except Exception as e:
+        logger.error(f"[DFMEA] ❌ Error: {e}")
+        return {"status": "error", "message": str(e)}
 
-        if not file_path.exists():
-            return {"status": "error", "message": "File not found"}
+    async def ndjson():
+        count = 0
+        entries = []
+        try:
+            yield json.dumps({"type": "ingested", "embedding_summary": ingest["summary"]}) + "\n"
+            context_agent = _context_agent(ingest["collection_version"], cache_bypass)
+            async for item in context_agent.stream(**_run_kwargs(products, subproducts, focus)):
+                count += 1
+                entries.append(item["entry"])
+                yield json.dumps({"type": "entry", **item}) + "\n"
+            file_id = _start_export(entries, export_format)
+            yield json.dumps({"type": "done", "status": "success", "count": count,
+                              "file_id": file_id, "export_format": export_format,
+                              "generation_stats": context_agent.stats}) + "\n"
+        except Exception as ce:
+            logger.error(f"[ContextAgent] ❌ Error while streaming DFMEA: {ce}")
+            yield json.dumps({"type": "done", "status": "error", "count": count, "message": str(ce)}) + "\n"
+        finally:
+            await _release_version(ingest["vectorstore"], ingest["collection_version"])
 
-        # 🔹 Serve file
-        response = FileResponse(
-            path=file_path,
-            filename=f"DFMEA_{file_id}.xlsx",
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@app.post("/dfmea/ingest")
+async def ingest_corpus(
+    prds: List[UploadFile] = File(None),
+    knowledge_base: List[UploadFile] = File(None),
+    field_issues: List[UploadFile] = File(None),
+    corpus_id: Optional[str] = Form(None)
+):
+    """Index uploads once and return a corpus_id for /dfmea/generate.
+
+    Identical uploads (same file hashes and embedding model) reuse the existing index.
+    Passing an existing ``corpus_id`` replaces that corpus's content with these uploads.
+    """
+    upload_dir = Path(tempfile.mkdtemp(prefix="dfmea_ingest_"))
+    try:
+        if corpus_id and not corpus_id.replace("-", "").replace("_", "").isalnum():
+            return {"status": "error", "message": "corpus_id may only contain letters, digits, '-' and '_'"}
+
+        saved = await _save_uploads(
+            {"prds": prds, "knowledge_base": knowledge_base, "field_issues": field_issues},
+            lambda field: upload_dir / field,
         )
+        # Hashes were computed while streaming the uploads to disk
+        files = [
+            {"source": field, "name": r["name"], "size": r["size"], "sha256": r["sha256"]}
+            for field in UPLOAD_FIELDS for r in saved[field]
+        ]
+        fingerprint = CorpusRegistry.fingerprint(files, embedder.deployment)
+
+        existing = corpus_registry.get(corpus_id) if corpus_id else corpus_registry.find(fingerprint)
+        if existing and existing["fingerprint"] == fingerprint:
+            vectorstore = VectorStoreAgent(collection_name=COLLECTION_ALIAS)
+            if await asyncio.to_thread(vectorstore.client.collection_exists, existing["collection_version"]):
+                logger.info(f"[Corpus] ♻️ Uploads unchanged, reusing corpus {existing['corpus_id']}")
+                return {"status": "success", "corpus_id": existing["corpus_id"], "reused": True,
+                        "embedding_summary": existing["embedding_summary"]}
+
+        ingest = await _ingest(_paths(saved, "prds"), _paths(saved, "knowledge_base"), _paths(saved, "field_issues"))
+        if not ingest["summary"]["total_vectors"]:
+            # _ingest fell back to the live version; that is not this corpus's content
+            await _release_version(ingest["vectorstore"], ingest["collection_version"])
+            return {"status": "error", "message": "No content to index"}
+        record = corpus_registry.register(
+            files, embedder.deployment, ingest["collection_version"], ingest["summary"], corpus_id
+        )
+        # Registered → kept by GC; the corpus's previous version (if any) is released here
+        await _release_version(ingest["vectorstore"], ingest["collection_version"])
+        logger.info(f"[Corpus] ✅ Corpus {record['corpus_id']} → {record['collection_version']}")
+        return {"status": "success", "corpus_id": record["corpus_id"], "reused": False,
+                "embedding_summary": record["embedding_summary"]}
+    except (UploadTooLarge, MemoryBudgetExceeded):
+        raise
+    except Exception as e:
+        logger.error(f"[Corpus] ❌ Ingest failed: {e}")
+        return {"status": "error", "message": str(e)}
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+@app.get("/dfmea/corpora/{corpus_id}")
+async def get_corpus(corpus_id: str):
+    record = corpus_registry.get(corpus_id)
+    if record is None:
+        return {"status": "error", "message": "Corpus not found"}
+    return record
+
+
+def _start_export(dfmea_entries: List[dict], export_format: str) -> str:
+    """Kick off a background export; /download reports "pending" until it is written."""
+    file_id = uuid.uuid4().hex
+    exporter.reserve(file_id, export_format)
+    task = asyncio.create_task(asyncio.to_thread(exporter.export, dfmea_entries, file_id, export_format))
+    _export_tasks.add(task)
+    task.add_done_callback(_export_done)
+    return file_id
+
+
+def _export_done(task: asyncio.Task):
+    _export_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"[ExportAgent] ⚠️ Background export failed: {task.exception()}")
+
+
+async def _sweep_exports():
+    """Remove expired exports now and then every min(TTL, 10 min)."""
+    while True:
+        try:
+            await asyncio.to_thread(exporter.sweep, EXPORT_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"[ExportAgent] ⚠️ Export sweep failed: {type(e).__name__}: {e}")
+        await asyncio.sleep(min(EXPORT_TTL_SECONDS, 600))
+
+
+async def _run_job(job: dict, progress) -> dict:
+    """Job runner: the /dfmea/generate pipeline on a job's saved uploads."""
+    # Jobs run on the worker pool, outside any request → each job is its own trace
+    with span("job.run", job_id=job["id"]):
+        params, files = job["params"], job["files"]
+        if params.get("corpus_id"):
+            ingest = await _open_corpus(params["corpus_id"])
+        else:
+            ingest = await _ingest(files["prds"], files["knowledge_base"], files["field_issues"], progress)
+
+        context_agent = None
+        try:
+            progress("generating", 50)
+            context_agent = _context_agent(ingest["collection_version"], params.get("cache_bypass", False))
+            dfmea_entries = await context_agent.run(
+                **_run_kwargs(params["products"], params["subproducts"], params.get("focus")),
+                progress=lambda done, total: progress("generating", 50 + 50 * done / max(total, 1)),
+            )
+        finally:
+            await _release_version(ingest["vectorstore"], ingest["collection_version"])
+
+        # Already in the background → export inline so the file exists when the job is done
+        export_format = params.get("export_format", "xlsx")
+        file_id = uuid.uuid4().hex
+        exporter.reserve(file_id, export_format)
+        await asyncio.to_thread(exporter.export, dfmea_entries, file_id, export_format)
+
+        return {
+            "status": "success",
+            "embedding_summary": ingest["summary"],
+            "generation_stats": context_agent.stats,
+            "file_id": file_id,
+            "export_format": export_format,
+            "dfmea_entries": dfmea_entries,
+        }
 
-        # 🔹 Delete file after serving
-        @response.call_on_close
-        def cleanup():
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass
 
-        return response
+job_manager = JobManager(
+    job_dir=os.getenv("DFMEA_JOB_DIR", os.path.join(tempfile.gettempdir(), "dfmea_jobs")),
+    runner=_run_job,
+    workers=int(os.getenv("DFMEA_JOB_WORKERS", "2")),
+)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    global _export_sweeper
+    job_manager.start()
+    _export_sweeper = asyncio.create_task(_sweep_exports())
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_manager.stop()
+    if _export_sweeper is not None:
+        _export_sweeper.cancel()
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+    tracing.shutdown()
+
+
+@app.post("/dfmea/jobs")
+async def submit_dfmea_job(
+    products: List[str] = Form(...),
+    subproducts: List[str] = Form(...),
+    focus: Optional[str] = Form(None),
+    prds: List[UploadFile] = File(None),
+    knowledge_base: List[UploadFile] = File(None),
+    field_issues: List[UploadFile] = File(None),
+    cache_bypass: bool = Form(False),
+    corpus_id: Optional[str] = Form(None),
+    export_format: str = Form("xlsx")
+):
+    """Queue a DFMEA generation job; returns immediately with its id."""
+    if export_format not in EXPORT_FORMATS:
+        return {"status": "error", "message": f"Unsupported export_format '{export_format}'"}
+    job_id = job_manager.new_job_id()
+    try:
+        saved = await _save_uploads(
+            {"prds": prds, "knowledge_base": knowledge_base, "field_issues": field_issues},
+            lambda field: job_manager.upload_dir(job_id, field),
+        )
+        files = {field: _paths(saved, field) for field in UPLOAD_FIELDS}
+        params = {"products": products, "subproducts": subproducts, "focus": focus,
+                  "cache_bypass": cache_bypass, "corpus_id": corpus_id, "export_format": export_format}
+        await job_manager.submit(job_id, params, files)
+        return {"status": "queued", "job_id": job_id}
+    except UploadTooLarge:
+        job_manager.discard(job_id)
+        raise
     except Exception as e:
+        job_manager.discard(job_id)
+        logger.error(f"[DFMEA] ❌ Job submission failed: {e}")
         return {"status": "error", "message": str(e)}
 
 
+@app.get("/dfmea/jobs/{job_id}")
+async def get_dfmea_job(job_id: str):
+    job = job_manager.status(job_id)
+    if job is None:
+        return {"status": "error", "message": "Job not found"}
+    return {key: job[key] for key in
+            ("id", "status", "stage", "percent", "created_at", "started_at", "finished_at", "error")}
 
 
+@app.get("/dfmea/jobs/{job_id}/result")
+async def get_dfmea_job_result(job_id: str):
+    job = job_manager.status(job_id)
+    if job is None:
+        return {"status": "error", "message": "Job not found"}
+    if job["status"] == "failed":
+        return {"status": "error", "message": job["error"]}
+    result = job_manager.result(job_id)
+    if result is None:
+        return {"status": job["status"], "stage": job["stage"], "percent": job["percent"]}
+    return result
+
+
+def _remove_quietly(path: Path):
+    try:
+        os.remove(path)
+    except Exception:
+        pass
+
+
+@app.get("/download/{file_id}")
+async def download_file(file_id: str, format: str = "xlsx"):
+    try:
+        if format not in EXPORT_FORMATS or not file_id.isalnum():
+            return {"status": "error", "message": "Invalid file_id or format"}
+        file_path = exporter.path(file_id, format)
+
+        if not file_path.exists():
+            if exporter.partial_path(file_id, format).exists():
+                return {"status": "pending", "message": "Export is still being written"}
+            return {"status": "error", "message": "File not found"}
+
+        # 🔹 Serve file, then delete it
+        return FileResponse(
+            path=file_path,
+            filename=f"DFMEA_{file_id}.{format}",
+            media_type=EXPORT_FORMATS[format],
+            background=BackgroundTask(_remove_quietly, file_path),
+        )
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: per-stage latency, batch sizes, 429s/retries, tokens, cache."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
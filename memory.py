@@ -0,0 +1,189 @@
+# server/agents/memory.py
+
+import os
+import tracemalloc
+from typing import Dict, Iterable, Optional
+
+from server.utils.logger import logger
+from .metrics import rss_bytes
+
+# off | rss | tracemalloc (tracemalloc slows allocation-heavy code noticeably → opt-in)
+MEMORY_SAMPLING = os.getenv("DFMEA_MEMORY_SAMPLING", "off").lower()
+# Per-process ceiling for ingestion (0 → no budget)
+MEMORY_BUDGET = int(float(os.getenv("DFMEA_MEMORY_BUDGET_MB", "0")) * (1 << 20))
+EMBEDDING_DIM = int(os.getenv("DFMEA_EMBEDDING_DIM", "1536"))
+
+# CPython (64-bit) sizes: a float object plus its list slot, a list header, and the
+# embedded-chunk dict/payload around each vector (text is shared with the chunk dict)
+_FLOAT_BYTES = 24 + 8
+_LIST_BYTES = 56
+_CHUNK_BYTES = 1024
+# Points per upsert (VectorStoreAgent.add_embeddings' default batch_limit)
+UPSERT_BATCH = 100
+
+_MB = 1 << 20
+# Floor on chunk-text bytes per uploaded byte. Plain text ends up in chunk text whole;
+# xlsx is deflated XML, so its cell text is several times the file (shared strings
+# aside); docx/pptx/pdf text can be far smaller than the file (images, layout)
+_EXPANSION = {
+    ".csv": 1.0, ".txt": 1.0, ".json": 1.0, ".md": 1.0,
+    ".xlsx": 4.0, ".xls": 1.0, ".docx": 0.5, ".pptx": 0.25, ".pdf": 0.1,
+}
+# Chunk-text bytes per cell of a sheet's used range (value plus separator; empty
+# cells inside the range keep this low)
+_CELL_BYTES = 8
+
+
+class MemoryBudgetExceeded(Exception):
+    """Not even the windowed ingestion path fits the configured memory budget (→ HTTP 507)."""
+
+
+def _vector_bytes(dim: int) -> int:
+    return dim * _FLOAT_BYTES + _LIST_BYTES
+
+
+def projected_bytes(chunks: int, dim: int = EMBEDDING_DIM) -> int:
+    """Memory embedding + indexing ``chunks`` chunks adds on top of the chunk dicts.
+
+    Every vector is alive as the Python list returned by the embeddings API; the
+    ``PointStruct`` copies only exist for the upsert batch in flight.
+    """
+    vector = _vector_bytes(dim)
+    return chunks * (vector + _CHUNK_BYTES) + min(chunks, UPSERT_BATCH) * vector
+
+
+def plan_window(chunks: int, min_window: int = 1, dim: int = EMBEDDING_DIM,
+                budget: int = MEMORY_BUDGET, used: Optional[float] = None) -> int:
+    """Chunks to embed + index per pass so the projected peak stays within ``budget``.
+
+    Returns ``chunks`` (one pass, as without a budget) when everything fits. Otherwise
+    a multiple of ``min_window`` sized to the headroom left above the current RSS, so
+    only one window of vectors is alive at a time. Raises ``MemoryBudgetExceeded`` when
+    not even ``min_window`` chunks fit.
+    """
+    if not budget or not chunks:
+        return chunks
+    used = rss_bytes() if used is None else used
+    headroom = budget - (used or 0)
+    if projected_bytes(chunks, dim) <= headroom:
+        return chunks
+    vector = _vector_bytes(dim)
+    window = int((headroom - UPSERT_BATCH * vector) // (vector + _CHUNK_BYTES)) // min_window * min_window
+    if window < min_window:
+        raise MemoryBudgetExceeded(
+            f"Ingesting {chunks} chunks needs ~{projected_bytes(min_window, dim) / _MB:.0f} MB beyond the "
+            f"{(used or 0) / _MB:.0f} MB in use, over the {budget / _MB:.0f} MB memory budget"
+        )
+    return window
+
+
+def _xlsx_cells(path: str) -> Optional[int]:
+    """Cells in the used range of every sheet, from the ``<dimension>`` tags alone.
+
+    Opens the workbook read-only, so no cell is parsed. ``None`` when openpyxl is
+    missing, the file does not open, or a sheet carries no dimension.
+    """
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        return None
+    try:
+        workbook = load_workbook(path, read_only=True)
+    except Exception:
+        return None
+    try:
+        cells = 0
+        for sheet in workbook.worksheets:
+            if not (sheet.max_row and sheet.max_column):
+                return None
+            cells += sheet.max_row * sheet.max_column
+        return cells
+    finally:
+        workbook.close()
+
+
+def projected_text_bytes(path: str) -> int:
+    """Chunk-text bytes an upload is projected to produce, before it is parsed.
+
+    xlsx uploads are probed for their sheet dimensions; other types (and xlsx files
+    without dimensions) scale the file size by a per-type expansion factor.
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".xlsx":
+        cells = _xlsx_cells(path)
+        if cells is not None:
+            return cells * _CELL_BYTES
+    return int(os.path.getsize(path) * _EXPANSION.get(suffix, 1.0))
+
+
+def precheck_uploads(paths: Iterable[str], min_window: int = 1, dim: int = EMBEDDING_DIM,
+                     budget: int = MEMORY_BUDGET, used: Optional[float] = None):
+    """Reject uploads that cannot fit before any parsing starts.
+
+    Every upload's chunk text is projected from the file alone (``projected_text_bytes``)
+    and one window of vectors comes on top, so an upload too big for even the windowed
+    path is turned away before the parse pool does the work.
+    """
+    if not budget:
+        return
+    text_bytes = sum(projected_text_bytes(p) for p in paths)
+    if not text_bytes:
+        return
+    used = rss_bytes() if used is None else used
+    needed = text_bytes + projected_bytes(min_window, dim)
+    if needed > budget - (used or 0):
+        raise MemoryBudgetExceeded(
+            f"Uploads need at least ~{needed / _MB:.0f} MB beyond the {(used or 0) / _MB:.0f} MB in use, "
+            f"over the {budget / _MB:.0f} MB memory budget"
+        )
+
+
+class MemoryTracker:
+    """Samples process memory at ingestion stage boundaries.
+
+    ``rss`` records the resident set size after each stage; ``tracemalloc`` also
+    records Python allocations and the peak reached *during* the stage (the peak is
+    reset at every mark), which is what tells the parsed results, chunk dicts,
+    embedding lists and ``PointStruct`` batches apart. Both are process-wide, so
+    concurrent requests show up in each other's numbers. Parsing runs in the pool
+    workers; the "parsed" stage covers the results shipped back to this process.
+    Repeated marks of a stage (windowed ingestion) keep the maximum.
+    """
+
+    def __init__(self, mode: str = MEMORY_SAMPLING):
+        self.mode = mode if mode in ("rss", "tracemalloc") else "off"
+        self.stages: Dict[str, Dict[str, float]] = {}
+        if self.mode == "tracemalloc":
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def mark(self, stage: str):
+        if not self.enabled:
+            return
+        rss = rss_bytes()
+        sample = {"rss_mb": round(rss / _MB, 1) if rss is not None else None}
+        if self.mode == "tracemalloc" and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            sample.update(traced_mb=round(current / _MB, 1), traced_peak_mb=round(peak / _MB, 1))
+
+        for k, v in (self.stages.get(stage) or {}).items():
+            if v is not None and (sample.get(k) is None or v > sample[k]):
+                sample[k] = v
+        self.stages[stage] = sample
+        logger.info(f"[Memory] 📏 {stage}: " + ", ".join(f"{k}={v}" for k, v in sample.items()))
+
+    def report(self) -> Dict:
+        """``{"mode", "stages": {stage: sample}, "peak_stage"}`` for the response summary."""
+        key = "traced_peak_mb" if self.mode == "tracemalloc" else "rss_mb"
+        measured = {stage: s[key] for stage, s in self.stages.items() if s.get(key) is not None}
+        return {
+            "mode": self.mode,
+            "stages": self.stages,
+            "peak_stage": max(measured, key=measured.get) if measured else None,
+        }
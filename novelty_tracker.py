@@ -0,0 +1,65 @@
+# server/agents/novelty_tracker.py
+
+import re
+from collections import deque
+from typing import List, Dict, Iterable
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset({"a", "an", "the", "of", "to", "in", "on", "and", "or", "due", "by", "for", "with", "from"})
+
+
+def _normalize(text) -> str:
+    """Order- and punctuation-insensitive form of a short phrase."""
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(t) for t in text)
+    words = {w for w in _WORD.findall(str(text or "").lower()) if w not in _STOPWORDS}
+    return " ".join(sorted(words))
+
+
+def entry_signatures(entry: Dict) -> List[tuple]:
+    """(failure mode, cause) signatures of one DFMEA entry, one per listed cause."""
+    mode = _normalize(entry.get("Potential Failure Mode"))
+    causes = entry.get("Potential Causes") or [""]
+    if not isinstance(causes, list):
+        causes = [causes]
+    return [(mode, _normalize(cause)) for cause in causes]
+
+
+class NoveltyTracker:
+    """Per-pair stopping rule: has this pair stopped producing new failure modes?
+
+    Keeps the set of failure-mode/cause signatures seen so far for one pair. After each
+    completed batch, ``observe`` records how many of its entries were new; once the last
+    ``window`` batches together contribute less than ``min_new_fraction`` new entries,
+    the tracker reports ``stopped`` and the pair's remaining batches can be skipped.
+    """
+
+    def __init__(self, window: int = 2, min_new_fraction: float = 0.2):
+        self.window = max(1, window)
+        self.min_new_fraction = min_new_fraction
+        self.seen = set()
+        self.recent = deque(maxlen=self.window)  # (new, total) per completed batch
+        self.batches = 0
+        self.stopped = False
+
+    def observe(self, entries: Iterable[Dict]) -> bool:
+        """Record one batch's entries; returns True if the pair should stop now."""
+        new = total = 0
+        for entry in entries or []:
+            if not isinstance(entry, dict):
+                continue
+            total += 1
+            signatures = [sig for sig in entry_signatures(entry) if sig not in self.seen]
+            if signatures:
+                new += 1
+                self.seen.update(signatures)
+
+        self.batches += 1
+        self.recent.append((new, total))
+        # The first batch is all-new by definition → only judge once a full window follows it
+        if not self.stopped and self.batches > self.window:
+            recent_new = sum(n for n, _ in self.recent)
+            recent_total = sum(t for _, t in self.recent)
+            if recent_new < self.min_new_fraction * max(recent_total, 1):
+                self.stopped = True
+        return self.stopped
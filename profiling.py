@@ -0,0 +1,211 @@
+# server/agents/profiling.py
+
+import os
+import sys
+import hmac
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import contextvars
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from server.utils.logger import logger
+
+# Opt-in only: DFMEA_PROFILE=1 profiles every generate request; otherwise a request must
+# carry "X-DFMEA-Profile: <DFMEA_PROFILE_TOKEN>" (ignored when no token is configured)
+PROFILE_ALL = os.getenv("DFMEA_PROFILE", "0") == "1"
+PROFILE_TOKEN = os.getenv("DFMEA_PROFILE_TOKEN")
+PROFILE_HEADER = "x-dfmea-profile"
+PROFILE_DIR = Path(os.getenv("DFMEA_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "dfmea_profiles")))
+PROFILE_INTERVAL = float(os.getenv("DFMEA_PROFILE_INTERVAL_MS", "5")) / 1000.0
+MAX_STACK_DEPTH = 256
+
+# Leaf frames of threads that are parked, not working (event-loop select, idle pool workers)
+_IDLE = {
+    ("selectors.py", "select"), ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"), ("thread.py", "_worker"), ("socket.py", "accept"), ("socket.py", "readinto"),
+}
+
+_ACTIVE: contextvars.ContextVar[Optional["SamplingProfiler"]] = contextvars.ContextVar("dfmea_profiler", default=None)
+# One profile at a time: overlapping profiles would sample each other's threads
+_PROFILE_LOCK = threading.Lock()
+
+
+def requested(headers) -> bool:
+    """Should this request be profiled? (one env lookup + one header lookup when off)."""
+    if PROFILE_ALL:
+        return True
+    value = headers.get(PROFILE_HEADER)
+    return bool(value and PROFILE_TOKEN and hmac.compare_digest(value, PROFILE_TOKEN))
+
+
+def active() -> bool:
+    """True inside a profiled request (CPU work should then stay in-process to be sampled)."""
+    return _ACTIVE.get() is not None
+
+
+def to_thread(func, /, *args, **kwargs):
+    """``asyncio.to_thread`` whose worker thread is sampled while inside a profiled request."""
+    profiler = _ACTIVE.get()
+    if profiler is None:
+        return asyncio.to_thread(func, *args, **kwargs)
+    return asyncio.to_thread(profiler.traced, func, *args, **kwargs)
+
+
+def try_start(request_id: str) -> Optional["SamplingProfiler"]:
+    """Start profiling this request, or None while another profile is running."""
+    if not _PROFILE_LOCK.acquire(blocking=False):
+        logger.info(f"[Profiler] ⏭️ Request {request_id} not profiled: another profile is running")
+        return None
+    try:
+        profiler = SamplingProfiler(request_id)
+        profiler._holds_lock = True
+        return profiler.start()
+    except BaseException:
+        _PROFILE_LOCK.release()
+        raise
+
+
+class SamplingProfiler:
+    """Stdlib wall-clock sampler: a daemon thread snapshots the request's threads.
+
+    Every ``interval`` seconds ``sys._current_frames()`` is walked for the event-loop
+    thread that started the profile and the worker threads currently running
+    ``to_thread`` calls made from the profiled context; each non-idle stack is
+    recorded with the time since the previous tick as its weight. The event loop is
+    shared, so coroutines of concurrent requests can appear in its samples. Samples
+    are written as a speedscope file (one profile per thread), which
+    https://www.speedscope.app renders as a flamegraph / time-order chart.
+    Nothing is installed into the interpreter (no settrace/setprofile), so requests
+    that are not profiled pay nothing.
+    """
+
+    def __init__(self, request_id: str, interval: float = PROFILE_INTERVAL):
+        self.request_id = request_id
+        self.interval = interval
+        self._frames: Dict[Tuple[str, str, int], int] = {}
+        self._stacks: Dict[Tuple[int, ...], int] = {}
+        self._samples: Dict[int, List[Tuple[int, float]]] = {}  # thread id → [(stack id, weight)]
+        self._thread_names: Dict[int, str] = {}
+        self._threads: Dict[int, int] = {}  # sampled thread id → active to_thread calls (loop: 1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"dfmea-profiler-{request_id[:8]}", daemon=True)
+        self._token = None
+        self._holds_lock = False
+        self.started = None
+        self.duration = 0.0
+
+    # ------------------------------------------------------------------
+    def start(self) -> "SamplingProfiler":
+        self.started = time.perf_counter()
+        self._threads[threading.get_ident()] = 1
+        self._token = _ACTIVE.set(self)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+        if self._holds_lock:
+            self._holds_lock = False
+            _PROFILE_LOCK.release()
+        if self._token is not None:
+            try:
+                _ACTIVE.reset(self._token)
+            except ValueError:
+                # Stopped from a different context (e.g. after a streamed body)
+                pass
+            self._token = None
+
+    def traced(self, func, *args, **kwargs):
+        """Run ``func`` with the calling (worker) thread included in the samples."""
+        ident = threading.get_ident()
+        self._threads[ident] = self._threads.get(ident, 0) + 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._threads[ident] -= 1
+            if not self._threads[ident]:
+                del self._threads[ident]
+
+    def _frame_id(self, code) -> int:
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        frame_id = self._frames.get(key)
+        if frame_id is None:
+            frame_id = self._frames[key] = len(self._frames)
+        return frame_id
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            frames = sys._current_frames()
+            for thread_id in list(self._threads):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                leaf = frame.f_code
+                if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(self._frame_id(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()  # speedscope wants root → leaf
+                stack_id = self._stacks.setdefault(tuple(stack), len(self._stacks))
+                self._samples.setdefault(thread_id, []).append((stack_id, weight))
+            if len(self._thread_names) < len(self._samples):
+                self._thread_names.update({t.ident: t.name for t in threading.enumerate()})
+
+    # ------------------------------------------------------------------
+    def speedscope(self) -> Dict:
+        stacks = {stack_id: list(stack) for stack, stack_id in self._stacks.items()}
+        frames = [None] * len(self._frames)
+        for (name, filename, line), frame_id in self._frames.items():
+            frames[frame_id] = {"name": name, "file": filename, "line": line}
+
+        profiles = []
+        for thread_id, samples in sorted(self._samples.items(), key=lambda item: -len(item[1])):
+            total = sum(weight for _, weight in samples)
+            profiles.append({
+                "type": "sampled",
+                "name": f"{self._thread_names.get(thread_id, 'thread')} ({thread_id})",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": [stacks[stack_id] for stack_id, _ in samples],
+                "weights": [weight for _, weight in samples],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"dfmea request {self.request_id} (event loop + its worker threads)",
+            "exporter": "server.agents.profiling",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def write(self, directory: Path = PROFILE_DIR) -> Path:
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{self.request_id}.speedscope.json"
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(self.speedscope(), fh)
+        samples = sum(len(s) for s in self._samples.values())
+        logger.info(f"[Profiler] 🔥 Request {self.request_id}: {samples} samples over {self.duration:.1f}s → {path}")
+        return path
+
+    def finish(self) -> Optional[Path]:
+        """Stop sampling and write the profile (never raises into the request)."""
+        try:
+            self.stop()
+            return self.write()
+        except Exception as e:
+            logger.warning(f"[Profiler] ⚠️ Could not write profile {self.request_id}: {type(e).__name__}: {e}")
+            return None
@@ -0,0 +1,202 @@
+# server/agents/prompt_builder.py
+
+from functools import lru_cache
+from typing import List, Dict, Optional
+import tiktoken
+
+
+# Static, byte-for-byte stable instructions. Always sent first (system message) so
+# Azure OpenAI prompt caching can reuse the prefix across pairs, batches and requests.
+# Anything that varies per request/pair/batch MUST go into the sections after it.
+STATIC_INSTRUCTIONS = """You are a senior DFMEA analyst at Zebra Technologies.
+
+Task:
+Generate hardware-focused DFMEA entries strictly in JSON format.
+Do not include explanations, commentary, or markdown formatting.
+The output must be valid JSON that can be parsed directly.
+
+Instructions:
+- Create **one DFMEA entry for every unique issue, failure mode, or risk** found in the chunks.
+- Each entry **must be tied to exactly ONE product from the provided product list**.
+- Each entry **must also be tied to exactly ONE subproduct from the provided subproduct list**.
+- Do **NOT** use generic placeholders like "All". Always pick the most relevant product and subproduct.
+- If multiple products or subproducts are relevant, duplicate the entry and assign one product/subproduct per entry.
+- At least **one entry per batch must explicitly leverage field issue evidence**.
+
+Required JSON Output:
+{
+"entries": [
+    {
+    "Product": "one specific product from the Products list",
+    "Subproducts": "one specific subproduct from the Subproducts list",
+    "Function": "Component purpose from PRD",
+    "Potential Failure Mode": "Hardware failure description",
+    "Potential Effects": ["Impact on device operation"],
+    "Potential Causes": ["Root causes (design, manufacturing, usage)"],
+    "Severity": 1-10,
+    "Occurrence": 1-10,
+    "Detection": 1-10,
+    "RPN": "Must equal Severity × Occurrence × Detection (integer only)",
+    "Controls Prevention": ["Prevention actions"],
+    "Controls Detection": ["Detection/QA methods"],
+    "linked_to_kb": true
+    }
+]
+}
+
+Zebra-Specific Rules:
+1. Base entries on the provided evidence; where gaps exist, infer intelligently from field_issues.
+2. Return **pure valid JSON** only (no markdown, no commentary).
+3. Generate 1–3 DFMEA entries per batch.
+4. Ensure numeric fields are integers, never leave arrays empty, focus exclusively on hardware issues, and avoid redundant or generic statements.
+5. Apply Zebra severity scale:
+- 9-10: Safety/Legal impact
+- 7-8: Device inoperable
+- 4-6: Reduced performance
+- 1-3: Cosmetic
+
+The user message contains, in order: the engineering focus (if any), the pair context
+(allowed products/subproducts and evidence samples), and the data chunks for this batch."""
+
+# Framing of the batch section in the user message (counted when packing batches)
+BATCH_HEADER = "Here are relevant data chunks:\n\n"
+CHUNK_SEPARATOR = "\n\n"
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+# JSON schema for Azure OpenAI structured outputs (strict mode: every property
+# required, no extras). Mirrors the "Required JSON Output" block above.
+DFMEA_RESPONSE_SCHEMA = {
+    "name": "dfmea_entries",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "entries": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "Product": {"type": "string"},
+                        "Subproducts": {"type": "string"},
+                        "Function": {"type": "string"},
+                        "Potential Failure Mode": {"type": "string"},
+                        "Potential Effects": _STRING_LIST,
+                        "Potential Causes": _STRING_LIST,
+                        "Severity": {"type": "integer"},
+                        "Occurrence": {"type": "integer"},
+                        "Detection": {"type": "integer"},
+                        "RPN": {"type": "integer"},
+                        "Controls Prevention": _STRING_LIST,
+                        "Controls Detection": _STRING_LIST,
+                        "linked_to_kb": {"type": "boolean"},
+                    },
+                    "required": [
+                        "Product", "Subproducts", "Function", "Potential Failure Mode",
+                        "Potential Effects", "Potential Causes", "Severity", "Occurrence",
+                        "Detection", "RPN", "Controls Prevention", "Controls Detection",
+                        "linked_to_kb",
+                    ],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["entries"],
+        "additionalProperties": False,
+    },
+}
+
+
+class PromptBuilder:
+    """Builds cache-friendly DFMEA prompts: static prefix → pair context → batch chunks.
+
+    ``pair_context`` is rendered once per product/subproduct pair and reused for every
+    batch of that pair; ``build`` only appends the batch chunks. Every section's token
+    count is reported so callers can see where prompt tokens go.
+    """
+
+    def __init__(self, model: str = "gpt-4o", evidence_samples: int = 10):
+        try:
+            self.encoder = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoder = tiktoken.get_encoding("cl100k_base")
+        self.evidence_samples = evidence_samples
+        self.count_tokens = lru_cache(maxsize=8192)(self._count_tokens)
+        self.static_tokens = self.count_tokens(STATIC_INSTRUCTIONS)
+        # The batch section is joined to the pair context with a separator, then the header
+        self.batch_header_tokens = self.count_tokens(CHUNK_SEPARATOR + BATCH_HEADER)
+        self.separator_tokens = self.count_tokens(CHUNK_SEPARATOR)
+
+    def _count_tokens(self, text: str) -> int:
+        return len(self.encoder.encode(text))
+
+    def pair_context(
+        self,
+        products: List[str],
+        subproducts: List[str],
+        focus: Optional[str],
+        prd_chunks: List[str],
+        kb_chunks: List[str],
+        field_chunks: List[str],
+        pairs: Optional[List[tuple]] = None,
+    ) -> Dict:
+        """Render the per-pair section once; evidence is deduplicated across sources.
+
+        ``pairs`` restricts a fused prompt (several pairs sharing evidence) to the listed
+        product/subproduct combinations.
+        """
+        seen = set()
+
+        def sample(chunks: List[str]) -> str:
+            picked = []
+            for chunk in chunks:
+                if chunk in seen:
+                    continue
+                seen.add(chunk)
+                picked.append(chunk)
+                if len(picked) >= self.evidence_samples:
+                    break
+            return "\n".join(picked) if picked else "(none retrieved)"
+
+        parts = []
+        if focus:
+            parts.append(f"Zebra Engineering Focus: {focus}")
+        allowed = ""
+        if pairs:
+            allowed = (
+                "- Allowed Product/Subproduct pairs (tag every entry with exactly one of these): "
+                + "; ".join(f"{p} / {s}" for p, s in pairs) + "\n"
+            )
+        parts.append(
+            "Context:\n"
+            f"- Products: {', '.join(products)}\n"
+            f"- Subproducts: {', '.join(subproducts)}\n"
+            f"{allowed}"
+            f"- PRD Evidence (sample):\n{sample(prd_chunks)}\n"
+            f"- Knowledge Base Evidence (sample):\n{sample(kb_chunks)}\n"
+            f"- Field Issue Evidence (sample):\n{sample(field_chunks)}"
+        )
+        text = "\n\n".join(parts)
+        return {"text": text, "tokens": self.count_tokens(text)}
+
+    def batch_tokens(self, batch_chunks: List[str]) -> int:
+        """Tokens of the batch section: header, chunks and the separators between them."""
+        separators = self.separator_tokens * max(len(batch_chunks) - 1, 0)
+        return self.batch_header_tokens + separators + sum(self.count_tokens(c) for c in batch_chunks)
+
+    def build(self, pair_context: Dict, batch_chunks: List[str]) -> Dict:
+        """Assemble chat messages for one batch plus a per-section token breakdown."""
+        batch_text = BATCH_HEADER + CHUNK_SEPARATOR.join(batch_chunks)
+        tokens = {
+            "static": self.static_tokens,
+            "pair": pair_context["tokens"],
+            "batch": self.batch_tokens(batch_chunks),
+        }
+        tokens["total"] = sum(tokens.values())
+        return {
+            "messages": [
+                {"role": "system", "content": STATIC_INSTRUCTIONS},
+                {"role": "user", "content": pair_context["text"] + CHUNK_SEPARATOR + batch_text},
+            ],
+            "tokens": tokens,
+        }
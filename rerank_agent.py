@@ -0,0 +1,54 @@
+# server/agents/rerank_agent.py
+
+from typing import List, Dict
+import numpy as np
+
+from server.utils.logger import logger
+
+
+class RerankAgent:
+    """Diversity reranking of Qdrant hits via Maximal Marginal Relevance (MMR).
+
+    Relevance is the cosine score Qdrant already returned for each hit, so only the
+    hit vectors are needed (``VectorStoreAgent.search(..., with_vectors=True)``).
+    """
+
+    def __init__(self, top_n: int = 30, lambda_mult: float = 0.5):
+        if not 0.0 <= lambda_mult <= 1.0:
+            raise ValueError("lambda_mult must be between 0 and 1.")
+        self.top_n = top_n
+        self.lambda_mult = lambda_mult
+
+    def mmr(self, matches: List[Dict]) -> List[Dict]:
+        """Return up to ``top_n`` matches, trading relevance (λ) against redundancy (1-λ)."""
+        usable = [m for m in matches if m.get("vector") is not None]
+        dropped = len(matches) - len(usable)
+        if dropped and usable:
+            logger.info(f"[RerankAgent] ⚠️ Dropped {dropped}/{len(matches)} hits without a vector before MMR")
+        elif dropped:
+            logger.info(f"[RerankAgent] ⚠️ No hit carries a vector; keeping the top {self.top_n} by relevance")
+        if len(usable) <= self.top_n:
+            return usable or matches[: self.top_n]
+
+        vectors = np.asarray([m["vector"] for m in usable], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1.0, norms)
+        relevance = np.asarray([m["score"] for m in usable], dtype=np.float32)
+
+        first = int(np.argmax(relevance))
+        selected = [first]
+        # Highest similarity of every candidate to anything already selected
+        max_sim = vectors @ vectors[first]
+        available = np.ones(len(usable), dtype=bool)
+        available[first] = False
+
+        while len(selected) < self.top_n:
+            scores = self.lambda_mult * relevance - (1.0 - self.lambda_mult) * max_sim
+            scores[~available] = -np.inf
+            nxt = int(np.argmax(scores))
+            selected.append(nxt)
+            available[nxt] = False
+            np.maximum(max_sim, vectors @ vectors[nxt], out=max_sim)
+
+        logger.info(f"[RerankAgent] 🔀 MMR kept {len(selected)}/{len(usable)} chunks (λ={self.lambda_mult})")
+        return [usable[i] for i in selected]
@@ -0,0 +1,43 @@
+from benchmarks.corpus import COMPONENTS, PRODUCTS, generate_corpus, select_pairs, spec_for
+from benchmarks.fakes import canned_dfmea_entries
+
+
+def test_corpus_is_reproducible_per_seed():
+    assert generate_corpus(spec_for("tiny")) == generate_corpus(spec_for("tiny"))
+    assert generate_corpus(spec_for("tiny", seed=1)) != generate_corpus(spec_for("tiny"))
+
+
+def test_rows_only_use_real_product_subproduct_pairs():
+    corpus = generate_corpus(spec_for("tiny"))
+    for row in corpus["prds"] + corpus["field_issues"]:
+        assert row["Subproduct"] in PRODUCTS[row["Product"]]
+    for row in corpus["knowledge_base"]:
+        assert row["Subproducts"] in PRODUCTS[row["Product"]]
+        assert row["Potential Failure Mode"] in COMPONENTS[row["Subproducts"]]["failure_modes"]
+
+
+def test_selected_pairs_all_exist():
+    products, subproducts = select_pairs(2, 3)
+    assert len(products) == 2 and len(subproducts) == 3
+    assert all(s in PRODUCTS[p] for p in products for s in subproducts)
+
+
+def test_fake_entries_honour_the_allowed_pairs_of_a_fused_prompt():
+    prompt = (
+        "- Products: TC52 Mobile Computer, ZT411 Industrial Printer\n"
+        "- Subproducts: Battery, Printhead\n"
+        "- Allowed Product/Subproduct pairs (tag every entry with exactly one of these): "
+        "TC52 Mobile Computer / Battery; ZT411 Industrial Printer / Printhead\n"
+        "chunk: cell swelling traced to charging at high ambient temperature"
+    )
+    allowed = {("TC52 Mobile Computer", "Battery"), ("ZT411 Industrial Printer", "Printhead")}
+    entries = canned_dfmea_entries(prompt, entries=20)
+    assert {(e["Product"], e["Subproducts"]) for e in entries} <= allowed
+    battery = [e for e in entries if e["Subproducts"] == "Battery"]
+    assert battery and {e["Potential Failure Mode"] for e in battery} == {"cell swelling"}
+
+
+def test_fake_entries_skip_listed_combinations_that_do_not_exist():
+    prompt = "- Products: ZT411 Industrial Printer\n- Subproducts: Battery, Printhead\n"
+    entries = canned_dfmea_entries(prompt, entries=10)
+    assert {(e["Product"], e["Subproducts"]) for e in entries} == {("ZT411 Industrial Printer", "Printhead")}
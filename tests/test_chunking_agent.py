@@ -0,0 +1,44 @@
+from server.agents.chunking_agent import ChunkingAgent
+
+PRDS = [
+    {"Requirement": " ".join(f"word{n}" for n in range(25)), "Product": "TC52"},
+    {"Requirement": "short", "Product": "ZT411"},
+    {"Requirement": "", "Product": ""},
+]
+KB = [{"Failure Mode": " ".join(f"kb{n}" for n in range(40))}]
+
+
+def _agent():
+    return ChunkingAgent(max_tokens=10, overlap=3)
+
+
+def test_pool_results_report_the_same_stats_as_run(word_encoder):
+    serial = _agent()
+    chunks = serial.run(PRDS, KB, [])
+
+    pooled = _agent()
+    results = [
+        {"source": "knowledge_bank", **pooled.slice_rows(KB)},
+        {"source": "prds", **pooled.slice_rows(PRDS)},
+    ]
+    assembled = pooled.from_results(results)
+
+    assert [c["text"] for c in assembled] == [c["text"] for c in chunks]
+    assert pooled.global_stats == serial.global_stats
+
+
+def test_overlapping_slices_count_the_row_once(word_encoder):
+    agent = _agent()
+    row = {"Requirement": " ".join(f"w{n}" for n in range(20))}
+    text_tokens = len(agent._format_row_as_text(row).split(" "))
+    agent.from_results([{"source": "prds", **agent.slice_rows([row])}])
+    assert agent.global_stats["sources"]["prds"]["chunks"] > 1
+    assert agent.global_stats["total_tokens"] == text_tokens
+
+
+def test_slices_of_a_row_share_its_metadata(word_encoder):
+    agent = _agent()
+    chunks = agent.from_results([{"source": "prds", **agent.slice_rows(PRDS)}])
+    first_row = [c for c in chunks if c["metadata"] is chunks[0]["metadata"]]
+    assert len(first_row) > 1
+    assert len({id(c["metadata"]) for c in chunks}) == 2
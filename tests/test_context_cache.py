@@ -0,0 +1,75 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from server.agents.context_agent import ContextAgent
+from server.agents.llm_cache import LLMResponseCache
+from server.agents.llm_scheduler import LLMScheduler
+
+RESPONSE = json.dumps({"entries": [{"Product": "TC52", "Potential Failure Mode": "Cell swelling"}]})
+MESSAGES = [{"role": "user", "content": "TC52 battery chunks"}]
+
+
+class FakeClient:
+    """Stands in for the AzureOpenAI client; counts completions."""
+
+    def __init__(self, content=RESPONSE):
+        self.content = content
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=SimpleNamespace(completion_tokens=7))
+
+
+@pytest.fixture
+def make_agent(word_encoder, tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "cache.sqlite3"))
+
+    def make(client, **kwargs):
+        return ContextAgent(llm_client=client, scheduler=LLMScheduler(), cache=cache, **kwargs)
+
+    return make
+
+
+def test_raw_calls_are_answered_from_the_cache(make_agent):
+    client = FakeClient()
+    agent = make_agent(client)
+    assert agent._call_azure_openai(MESSAGES) == RESPONSE
+    assert agent._call_azure_openai(MESSAGES) == RESPONSE
+    assert client.calls == 1
+    assert agent.stats["cache"] == {"hits": 1, "misses": 1}
+
+
+def test_cache_bypass_skips_reads_but_still_writes(make_agent):
+    client = FakeClient()
+    bypass = make_agent(client, cache_bypass=True)
+    bypass._call_azure_openai(MESSAGES)
+    bypass._call_azure_openai(MESSAGES)
+    assert client.calls == 2
+    assert bypass.stats["cache"] == {"hits": 0, "misses": 2}
+    assert make_agent(client)._call_azure_openai(MESSAGES) == RESPONSE
+    assert client.calls == 2
+
+
+def test_unparseable_responses_are_not_cached(make_agent):
+    client = FakeClient(content="Sorry, no JSON today")
+    agent = make_agent(client)
+    agent._call_azure_openai(MESSAGES)
+    agent._call_azure_openai(MESSAGES)
+    assert client.calls == 2
+
+
+def test_a_late_hit_after_a_counted_miss_is_not_a_model_call(make_agent):
+    agent = make_agent(FakeClient())
+    agent._call_azure_openai(MESSAGES)
+    usage = {"calls": 1, "completion_tokens": 0}
+    client = FakeClient()
+    agent.llm_client = client
+    assert agent._call_azure_openai(MESSAGES, usage=usage, miss_counted=True) == RESPONSE
+    assert client.calls == 0
+    assert usage == {"calls": 0, "completion_tokens": 0}
+    assert agent.stats["cache"] == {"hits": 1, "misses": 1}
@@ -0,0 +1,43 @@
+from server.agents.corpus_registry import CorpusRegistry
+
+FILES = [
+    {"source": "prds", "name": "prd.xlsx", "sha256": "aa"},
+    {"source": "knowledge_bank", "name": "kb.xlsx", "sha256": "bb"},
+]
+
+
+def test_fingerprint_ignores_file_order_but_not_model_or_source():
+    fingerprint = CorpusRegistry.fingerprint(FILES, "text-embedding-3-large")
+    assert CorpusRegistry.fingerprint(FILES[::-1], "text-embedding-3-large") == fingerprint
+    assert CorpusRegistry.fingerprint(FILES, "text-embedding-3-small") != fingerprint
+    swapped = [dict(FILES[0], source="field_issues"), FILES[1]]
+    assert CorpusRegistry.fingerprint(swapped, "text-embedding-3-large") != fingerprint
+
+
+def test_register_find_and_reregister(tmp_path):
+    registry = CorpusRegistry(str(tmp_path))
+    record = registry.register(FILES, "model", "dfmea_collection__v1", {"prds": 3})
+    corpus_id = record["corpus_id"]
+    assert registry.get(corpus_id) == record
+    assert registry.find(CorpusRegistry.fingerprint(FILES, "model")) == record
+
+    # Re-indexing points the same corpus at the new version and keeps its creation time
+    updated = registry.register(FILES, "model", "dfmea_collection__v2", {"prds": 3}, corpus_id=corpus_id)
+    assert updated["created_at"] == record["created_at"]
+    assert registry.get(corpus_id)["collection_version"] == "dfmea_collection__v2"
+    assert len(registry.all()) == 1
+
+
+def test_versions_are_kept_for_every_registered_corpus(tmp_path):
+    registry = CorpusRegistry(str(tmp_path))
+    registry.register(FILES, "model", "dfmea_collection__v1", {})
+    registry.register(FILES[:1], "model", "dfmea_collection__v2", {})
+    (tmp_path / "broken.json").write_text("{not json")
+    assert registry.versions() == {"dfmea_collection__v1", "dfmea_collection__v2"}
+
+
+def test_get_rejects_ids_that_are_not_plain_names(tmp_path):
+    registry = CorpusRegistry(str(tmp_path))
+    assert registry.get("") is None
+    assert registry.get("../secrets") is None
+    assert registry.get("missing") is None
@@ -0,0 +1,71 @@
+import json
+
+from server.agents.entry_parser import IncrementalEntryParser, repair_entries
+
+ENTRIES = [
+    {"Function": "Store energy", "Potential Failure Mode": "Cell swelling {heat}", "RPN": 120},
+    {"Function": "Seal housing", "Potential Failure Mode": "Gasket \"creep\"", "Controls": ["A", "B"]},
+    {"Function": "Vent gas", "Potential Failure Mode": "Vent blocked", "nested": {"a": [1, {"b": 2}]}},
+]
+
+
+def _feed_in_pieces(text, size):
+    parser = IncrementalEntryParser()
+    entries = []
+    for start in range(0, len(text), size):
+        entries.extend(parser.feed(text[start:start + size]))
+    return parser, entries
+
+
+def test_incremental_parser_yields_entries_across_any_split():
+    text = json.dumps({"entries": ENTRIES}, indent=2)
+    for size in (1, 3, 7, 64, len(text)):
+        parser, entries = _feed_in_pieces(text, size)
+        assert entries == ENTRIES
+        assert parser.complete and not parser.pending
+        assert parser.emitted == len(ENTRIES)
+
+
+def test_incremental_parser_emits_each_entry_once_its_brace_closes():
+    parser = IncrementalEntryParser()
+    assert parser.feed('{"entries": [{"a": 1}, {"b"') == [{"a": 1}]
+    assert parser.pending
+    assert parser.feed(': "}"}]}') == [{"b": "}"}]
+    assert parser.complete
+    assert parser.feed('{"c": 3}') == []
+
+
+def test_incremental_parser_accepts_fenced_bare_list():
+    parser, entries = _feed_in_pieces("```json\n" + json.dumps(ENTRIES) + "\n```", 5)
+    assert entries == ENTRIES
+    assert parser.complete
+
+
+def test_incremental_parser_reports_truncated_entry():
+    parser = IncrementalEntryParser()
+    assert parser.feed('{"entries": [{"a": 1}, {"b": 2') == [{"a": 1}]
+    assert parser.pending and not parser.complete
+
+
+def test_repair_entries_valid_json():
+    assert repair_entries(json.dumps({"entries": ENTRIES})) == (ENTRIES, "ok")
+    assert repair_entries(json.dumps(ENTRIES)) == (ENTRIES, "ok")
+
+
+def test_repair_entries_strips_fences_and_trailing_commas():
+    raw = '```json\n{"entries": [{"a": 1,}, {"b": [1, 2,],},]}\n```'
+    assert repair_entries(raw) == ([{"a": 1}, {"b": [1, 2]}], "repaired")
+
+
+def test_repair_entries_salvages_truncated_output():
+    raw = json.dumps({"entries": ENTRIES})[:-30]
+    entries, status = repair_entries(raw)
+    assert status == "repaired"
+    assert entries == ENTRIES[:2]
+
+
+def test_repair_entries_failures():
+    assert repair_entries("") == ([], "failed")
+    assert repair_entries(None) == ([], "failed")
+    assert repair_entries("Sorry, I cannot help with that.") == ([], "failed")
+    assert repair_entries('{"entries": "none"}') == ([], "failed")
@@ -0,0 +1,79 @@
+import csv
+import os
+
+import pytest
+
+from server.agents.export_agent import DFMEA_COLUMNS, ExportAgent
+
+ENTRIES = [
+    {"Product": "TC52", "Subproducts": "Battery", "Potential Failure Mode": "Cell swelling",
+     "Potential Causes": ["Overcharge", "Heat"], "RPN": 120},
+    {"Product": "ZT411", "Subproducts": "Printhead", "Controls Detection": {"test": "burn-in"}},
+]
+
+
+@pytest.fixture
+def agent(tmp_path):
+    return ExportAgent(export_dir=str(tmp_path))
+
+
+def test_reserve_marks_the_export_pending(agent, tmp_path):
+    agent.reserve("abc", "csv")
+    assert os.listdir(tmp_path) == ["abc.csv.part"]
+    with pytest.raises(ValueError):
+        agent.reserve("abc", "pdf")
+
+
+def test_export_renames_the_partial_file_when_complete(agent, tmp_path):
+    agent.reserve("abc", "csv")
+    final = agent.export(ENTRIES, "abc", "csv")
+    assert final == tmp_path / "abc.csv"
+    assert os.listdir(tmp_path) == ["abc.csv"]
+
+    with open(final, newline="", encoding="utf-8-sig") as fh:
+        rows = list(csv.reader(fh))
+    assert rows[0] == DFMEA_COLUMNS
+    assert rows[1][DFMEA_COLUMNS.index("Potential Causes")] == "Overcharge; Heat"
+    assert rows[2][DFMEA_COLUMNS.index("Controls Detection")] == '{"test": "burn-in"}'
+    assert rows[2][DFMEA_COLUMNS.index("RPN")] == ""
+
+
+def test_xlsx_export_is_written_row_by_row(agent):
+    openpyxl = pytest.importorskip("openpyxl")
+    final = agent.export(ENTRIES, "abc", "xlsx")
+    rows = list(openpyxl.load_workbook(final, read_only=True)["DFMEA"].values)
+    assert list(rows[0]) == DFMEA_COLUMNS
+    assert len(rows) == 3
+
+
+def test_failed_export_leaves_no_file_behind(agent, tmp_path, monkeypatch):
+    def broken(entries, path):
+        path.write_text("half")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(agent, "_write_csv", broken)
+    agent.reserve("abc", "csv")
+    with pytest.raises(OSError):
+        agent.export(ENTRIES, "abc", "csv")
+    assert os.listdir(tmp_path) == []
+
+
+def test_parquet_export(agent):
+    pq = pytest.importorskip("pyarrow.parquet")
+    agent.parquet_row_group = 1
+    table = pq.read_table(agent.export(ENTRIES, "abc", "parquet"))
+    assert table.column_names == DFMEA_COLUMNS
+    assert table.num_rows == 2
+
+
+def test_sweep_removes_only_old_exports(agent, tmp_path):
+    old, abandoned, fresh = "a" * 32, "b" * 32, "c" * 32
+    agent.export(ENTRIES, old, "csv")
+    agent.reserve(abandoned, "xlsx")
+    agent.export(ENTRIES, fresh, "csv")
+    (tmp_path / "notes.txt").write_text("not an export")
+    for name in (f"{old}.csv", f"{abandoned}.xlsx.part", "notes.txt"):
+        os.utime(tmp_path / name, (0, 0))
+
+    assert agent.sweep(max_age_seconds=3600) == 2
+    assert sorted(os.listdir(tmp_path)) == [f"{fresh}.csv", "notes.txt"]
@@ -0,0 +1,71 @@
+import pytest
+
+from server.agents.context_agent import ContextAgent
+from server.agents.llm_cache import LLMResponseCache
+from server.agents.llm_scheduler import LLMScheduler
+
+
+@pytest.fixture
+def agent(word_encoder, tmp_path):
+    return ContextAgent(
+        llm_client=None,
+        scheduler=LLMScheduler(),
+        cache=LLMResponseCache(path=str(tmp_path / "cache.sqlite3")),
+        fusion=True,
+        fusion_threshold=0.8,
+        fusion_max_pairs=3,
+    )
+
+
+def _plan(idx, product, subproduct, chunks):
+    return {"idx": idx, "pairs": [(product, subproduct)], "chunks": list(chunks)}
+
+
+def _grouped(agent, plans):
+    return [[plan["idx"] for plan in group] for group in agent._group_pairs(plans)]
+
+
+def test_pairs_group_at_the_jaccard_threshold(agent):
+    shared = [f"chunk {n}" for n in range(8)]
+    plans = [
+        _plan(0, "TC52", "Battery", shared),
+        _plan(1, "TC57", "Battery", shared + ["tc57 only", "tc57 other"]),  # 8/10 = 0.8
+        _plan(2, "TC58", "Battery", shared + ["a", "b", "c"]),  # 8/11 < 0.8
+    ]
+    assert _grouped(agent, plans) == [[0, 1], [2]]
+
+
+def test_group_size_is_capped(agent):
+    plans = [_plan(n, f"TC5{n}", "Battery", ["same chunk"]) for n in range(5)]
+    assert _grouped(agent, plans) == [[0, 1, 2], [3, 4]]
+
+
+def test_non_overlapping_pair_stays_alone(agent):
+    plans = [
+        _plan(0, "TC52", "Battery", ["battery swell", "charger contacts"]),
+        _plan(1, "ZT411", "Printhead", ["printhead wear", "ribbon wrinkle"]),
+    ]
+    assert _grouped(agent, plans) == [[0], [1]]
+    assert agent._fuse(plans, focus=None) == plans
+    assert agent.stats["fusion"]["groups"] == 0
+
+
+def test_assign_pair_maps_entries_back_to_their_pair(agent):
+    fused = {"pairs": [("TC52", "Battery"), ("TC57", "Battery Door")]}
+    entry = {"Product": " tc57 ", "Subproducts": "BATTERY DOOR"}
+    assert agent._assign_pair(fused, entry) == ("TC57", "Battery Door")
+    assert entry["Product"] == "TC57" and entry["Subproducts"] == "Battery Door"
+    assert agent.stats["fusion"]["unmatched_entries"] == 0
+
+
+def test_assign_pair_counts_entries_matching_no_pair(agent):
+    fused = {"pairs": [("TC52", "Battery"), ("TC57", "Battery Door")]}
+    assert agent._assign_pair(fused, {"Product": "TC52", "Subproducts": "Battery Door"}) is None
+    assert agent._assign_pair(fused, {"Function": "no product tags"}) is None
+    assert agent.stats["fusion"]["unmatched_entries"] == 2
+
+
+def test_single_pair_plan_takes_every_entry(agent):
+    plan = {"pairs": [("ZT411", "Printhead")]}
+    assert agent._assign_pair(plan, {"Product": "something else"}) == ("ZT411", "Printhead")
+    assert agent.stats["fusion"]["unmatched_entries"] == 0
@@ -0,0 +1,99 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+from server.agents.job_manager import CLAIM_FILE, QUEUED, RUNNING, SUCCEEDED, JobManager, write_json_atomic
+
+
+def test_write_json_atomic_replaces_the_file(tmp_path):
+    path = tmp_path / "job.json"
+    write_json_atomic(path, {"status": QUEUED})
+    write_json_atomic(path, {"status": RUNNING, "stage": "émbedding"})
+    assert json.loads(path.read_text(encoding="utf-8")) == {"status": RUNNING, "stage": "émbedding"}
+    assert os.listdir(tmp_path) == ["job.json"]
+
+
+def test_write_json_atomic_keeps_the_old_file_on_failure(tmp_path):
+    path = tmp_path / "job.json"
+    write_json_atomic(path, {"status": QUEUED})
+    with pytest.raises(TypeError):
+        write_json_atomic(path, {"status": object()})
+    assert json.loads(path.read_text(encoding="utf-8")) == {"status": QUEUED}
+    assert os.listdir(tmp_path) == ["job.json"]
+
+
+def _job(tmp_path, job_id, status, owner=None):
+    path = tmp_path / job_id
+    path.mkdir()
+    write_json_atomic(path / "job.json", {"id": job_id, "status": status, "stage": status, "percent": 0,
+                                          "params": {}, "files": {}})
+    if owner is not None:
+        (path / CLAIM_FILE).write_text(json.dumps(owner))
+
+
+def _dead_pid():
+    pid = 2 ** 22 + 12345
+    while True:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return pid
+        except PermissionError:
+            pass
+        pid += 1
+
+
+def test_claims_are_exclusive_until_released(tmp_path):
+    _job(tmp_path, "job1", QUEUED)
+    first, second = JobManager(str(tmp_path), runner=None), JobManager(str(tmp_path), runner=None)
+    assert first._claim("job1")
+    assert not second._claim("job1")
+    assert second._is_claimed("job1")
+    first._release("job1")
+    assert second._claim("job1")
+
+
+def test_stale_claims_are_taken_over(tmp_path):
+    manager = JobManager(str(tmp_path), runner=None)
+    _job(tmp_path, "dead", RUNNING, owner={"pid": _dead_pid(), "host": manager._host})
+    _job(tmp_path, "old", RUNNING, owner={"pid": 1, "host": "elsewhere"})
+    _job(tmp_path, "live", RUNNING, owner={"pid": 1, "host": "elsewhere"})
+    os.utime(tmp_path / "old" / CLAIM_FILE, (0, 0))  # heartbeat far older than CLAIM_TTL
+
+    assert manager._claim("dead")
+    assert manager._claim("old")
+    assert not manager._claim("live")
+    assert sorted(os.listdir(tmp_path / "dead")) == [CLAIM_FILE, "job.json"]
+
+
+def test_each_unfinished_job_runs_once_across_managers(tmp_path):
+    runs = []
+
+    async def runner(job, progress):
+        runs.append(job["id"])
+        progress("generating", 50)
+        await asyncio.sleep(0.05)
+        return {"status": "success"}
+
+    async def main():
+        first, second = JobManager(str(tmp_path), runner), JobManager(str(tmp_path), runner)
+        first.start()
+        second.start()
+        await asyncio.sleep(0.3)
+        await first.stop()
+        await second.stop()
+
+    _job(tmp_path, "queued", QUEUED)
+    _job(tmp_path, "orphan", RUNNING, owner={"pid": _dead_pid(), "host": JobManager(str(tmp_path), None)._host})
+    _job(tmp_path, "owned", RUNNING, owner={"pid": 1, "host": "elsewhere"})
+    _job(tmp_path, "done", SUCCEEDED)
+    asyncio.run(main())
+
+    assert sorted(runs) == ["orphan", "queued"]
+    for job_id in ("queued", "orphan"):
+        state = json.loads((tmp_path / job_id / "job.json").read_text())
+        assert state["status"] == SUCCEEDED
+        assert not (tmp_path / job_id / CLAIM_FILE).exists()
+    assert (tmp_path / "owned" / CLAIM_FILE).exists()
@@ -0,0 +1,66 @@
+import types
+
+import pytest
+
+from server.agents import llm_cache
+from server.agents.llm_cache import LLMResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = types.SimpleNamespace(value=1_000_000.0)
+    monkeypatch.setattr(llm_cache, "time", types.SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def _cache(tmp_path, **kwargs):
+    return LLMResponseCache(str(tmp_path / "cache.sqlite3"), **kwargs)
+
+
+def test_make_key_is_stable_and_covers_every_input():
+    messages = [{"role": "user", "content": "prompt"}]
+    key = LLMResponseCache.make_key("gpt", {"temperature": 0, "seed": 1}, messages)
+    assert key == LLMResponseCache.make_key("gpt", {"seed": 1, "temperature": 0}, [dict(m) for m in messages])
+    assert key != LLMResponseCache.make_key("gpt-2", {"temperature": 0, "seed": 1}, messages)
+    assert key != LLMResponseCache.make_key("gpt", {"temperature": 0, "seed": 2}, messages)
+    assert key != LLMResponseCache.make_key("gpt", {"temperature": 0, "seed": 1}, [{"role": "user", "content": "x"}])
+
+
+def test_get_put_and_hit_rate(tmp_path, clock):
+    cache = _cache(tmp_path)
+    assert cache.get("k") is None
+    cache.put("k", "gpt", '{"entries": []}')
+    assert cache.get("k") == '{"entries": []}'
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1 and cache.stats["writes"] == 1
+    assert cache.hit_rate() == 0.5
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_seconds=60)
+    cache.put("k", "gpt", "response")
+    clock.value += 60
+    assert cache.get("k") == "response"
+    clock.value += 1
+    assert cache.get("k") is None
+    assert cache.stats["expired"] == 1
+    # Expired rows are deleted, not just hidden
+    assert cache._conn.execute("SELECT COUNT(*) FROM responses").fetchone() == (0,)
+
+
+def test_lru_eviction_keeps_recently_read_entries(tmp_path, clock):
+    cache = _cache(tmp_path, max_entries=2)
+    cache.put("a", "gpt", "A")
+    clock.value += 1
+    cache.put("b", "gpt", "B")
+    clock.value += 1
+    assert cache.get("a") == "A"  # "b" is now least recently used
+    clock.value += 1
+    cache.put("c", "gpt", "C")
+    assert cache.stats["evictions"] == 1
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+
+
+def test_cache_persists_across_instances(tmp_path, clock):
+    _cache(tmp_path).put("k", "gpt", "response")
+    assert _cache(tmp_path).get("k") == "response"
@@ -0,0 +1,187 @@
+import time
+import asyncio
+
+from server.agents.llm_scheduler import LLMScheduler
+
+
+def _admitted_at(scheduler, calls):
+    """Submit ``calls`` (lists of submit kwargs) at once; seconds until each one ran."""
+    async def main():
+        start = time.monotonic()
+        ran = {}
+
+        def work(n):
+            ran[n] = time.monotonic() - start
+            return n
+
+        results = await asyncio.gather(*(scheduler.submit(work, n, **kw) for n, kw in enumerate(calls)))
+        return results, [ran.get(n) for n in range(len(calls))]
+
+    return asyncio.run(main())
+
+
+def test_concurrency_limit_follows_budgets_and_latency():
+    scheduler = LLMScheduler(rpm_limit=120, max_concurrency=32, initial_latency=10.0)
+    assert scheduler.concurrency_limit() == 20  # 2 req/s × 10 s in flight
+    scheduler = LLMScheduler(tpm_limit=120_000, max_concurrency=32, initial_latency=10.0)
+    assert scheduler.concurrency_limit() == 10  # 2000 tok/s × 10 s / 2000 tok per call
+    scheduler = LLMScheduler(rpm_limit=6, min_concurrency=2, initial_latency=1.0)
+    assert scheduler.concurrency_limit() == 2
+    assert LLMScheduler(max_concurrency=7).concurrency_limit() == 7
+
+
+def test_request_bucket_delays_admission_once_empty():
+    scheduler = LLMScheduler(rpm_limit=600)  # refills one request per 0.1 s
+    scheduler._requests = 1.0
+    results, ran = _admitted_at(scheduler, [{}, {}])
+    assert results == [0, 1]
+    assert ran[0] < 0.05
+    assert 0.08 <= ran[1] < 0.5
+
+
+def test_token_bucket_delays_admission_by_estimated_tokens():
+    scheduler = LLMScheduler(tpm_limit=60_000)  # 1000 tokens/s
+    scheduler._tokens = 100.0
+    _, ran = _admitted_at(scheduler, [{"est_tokens": 100}, {"est_tokens": 200}])
+    assert ran[0] < 0.05
+    assert 0.15 <= ran[1] < 0.6
+
+
+def test_requests_larger_than_the_bucket_are_capped_at_a_full_bucket():
+    scheduler = LLMScheduler(tpm_limit=1_000)
+    results, _ = _admitted_at(scheduler, [{"est_tokens": 50_000}])
+    assert results == [0]
+    assert scheduler._tokens < 1.0
+
+
+def test_admission_is_fifo():
+    scheduler = LLMScheduler(tpm_limit=60_000)
+    scheduler._tokens = 0.0
+    # The big head-of-line call holds back the small one queued behind it
+    _, ran = _admitted_at(scheduler, [{"est_tokens": 200}, {"est_tokens": 1}])
+    assert ran[0] <= ran[1]
+
+
+def test_skip_if_refunds_slot_and_budget():
+    scheduler = LLMScheduler(tpm_limit=60_000, rpm_limit=600)
+    results, ran = _admitted_at(scheduler, [{"est_tokens": 500, "skip_if": lambda: True}])
+    assert results == [None] and ran == [None]
+    assert scheduler.stats["skipped"] == 1
+    assert scheduler._in_flight == 0
+    assert scheduler._tokens == 60_000 and scheduler._requests == 600
+
+
+def test_in_flight_never_exceeds_the_limit():
+    scheduler = LLMScheduler(max_concurrency=3)
+
+    async def main():
+        await asyncio.gather(*(scheduler.submit(time.sleep, 0.02) for _ in range(12)))
+
+    asyncio.run(main())
+    assert scheduler.stats["max_in_flight"] == 3
+    assert scheduler.stats["completed"] == 12 and scheduler._in_flight == 0
+
+
+def _hedging_scheduler(**kwargs):
+    scheduler = LLMScheduler(max_hedge_rate=1.0, hedge_min_samples=2, **kwargs)
+    scheduler._latencies.extend([0.05, 0.05])
+    return scheduler
+
+
+def _slow_then_fast(calls):
+    """First attempt hangs until abandoned; the duplicate answers at once."""
+    def fn(attempt):
+        calls.append(attempt)
+        if len(calls) == 1:
+            while not attempt.cancelled.is_set():
+                time.sleep(0.005)
+            attempt.record_latency(9.0)
+            attempt.check()
+        attempt.record_latency(0.01)
+        return len(calls)
+    return fn
+
+
+def test_hedge_delay_needs_enough_samples():
+    scheduler = LLMScheduler(hedge_min_samples=3)
+    scheduler._latencies.extend([1.0, 2.0])
+    assert scheduler.hedge_delay() is None
+    scheduler._latencies.append(3.0)
+    assert scheduler.hedge_delay() == 3.0
+    scheduler._latencies.extend([1.0] * 97)
+    assert scheduler.latency_quantile(0.95) == 1.0
+
+
+def test_slow_call_is_hedged_and_the_duplicate_wins():
+    scheduler = _hedging_scheduler()
+    calls = []
+
+    async def main():
+        result = await scheduler.submit(_slow_then_fast(calls), hedge=True)
+        await asyncio.gather(*scheduler._attempt_tasks, return_exceptions=True)
+        return result
+
+    assert asyncio.run(main()) == 2
+    assert scheduler.stats["hedged"] == 1 and scheduler.stats["hedge_wins"] == 1
+    assert scheduler.stats["completed"] == 1 and scheduler.stats["failed"] == 0
+    assert calls[0].cancelled.is_set()
+    # Only the winner's backend latency feeds the hedge delay
+    assert list(scheduler._latencies) == [0.05, 0.05, 0.01]
+    assert scheduler._in_flight == 0
+
+
+def test_only_one_attempt_can_claim_side_effects():
+    scheduler = _hedging_scheduler()
+    claims = []
+
+    def fn(attempt):
+        time.sleep(0.1 if not claims else 0.0)
+        claims.append(attempt.claim())
+        return len(claims)
+
+    async def main():
+        await scheduler.submit(fn, hedge=True)
+        await asyncio.gather(*scheduler._attempt_tasks, return_exceptions=True)
+
+    asyncio.run(main())
+    assert claims == [True, False]
+
+
+def test_hedges_respect_the_rate_cap():
+    scheduler = _hedging_scheduler()
+    scheduler.max_hedge_rate = 0.0
+    calls = []
+
+    def fn(attempt):
+        calls.append(attempt)
+        time.sleep(0.15)
+        attempt.record_latency(0.15)
+        return "done"
+
+    assert asyncio.run(scheduler.submit(fn, hedge=True)) == "done"
+    assert len(calls) == 1 and scheduler.stats["hedged"] == 0
+
+
+def test_cancelling_the_caller_flags_the_attempt_and_keeps_its_slot():
+    scheduler = LLMScheduler()
+    started = []
+
+    def fn(attempt):
+        started.append(attempt)
+        while not attempt.cancelled.is_set():
+            time.sleep(0.005)
+        attempt.check()
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.submit(fn, cancellable=True))
+        while not started:
+            await asyncio.sleep(0.005)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        in_flight = scheduler._in_flight
+        await asyncio.gather(*scheduler._attempt_tasks, return_exceptions=True)
+        return in_flight
+
+    assert asyncio.run(main()) == 1  # held until the worker thread returned
+    assert started[0].cancelled.is_set()
+    assert scheduler.stats["cancelled"] == 1 and scheduler._in_flight == 0
@@ -0,0 +1,106 @@
+import tracemalloc
+
+import pytest
+
+from server.agents.memory import (
+    _CELL_BYTES, MemoryBudgetExceeded, MemoryTracker, UPSERT_BATCH, plan_window, precheck_uploads,
+    projected_bytes, projected_text_bytes,
+)
+
+MB = 1 << 20
+DIM = 1536
+
+
+def test_projected_bytes_grows_with_chunks_and_dimension():
+    assert projected_bytes(0, DIM) == 0
+    assert projected_bytes(200, DIM) > projected_bytes(100, DIM) > 0
+    assert projected_bytes(100, 3072) > projected_bytes(100, DIM)
+    # Only one upsert batch of PointStruct copies is alive at a time
+    per_chunk = projected_bytes(10 * UPSERT_BATCH, DIM) - projected_bytes(10 * UPSERT_BATCH - 1, DIM)
+    assert per_chunk == projected_bytes(2 * UPSERT_BATCH, DIM) - projected_bytes(2 * UPSERT_BATCH - 1, DIM)
+
+
+def test_no_budget_or_no_chunks_means_one_pass():
+    assert plan_window(5000, min_window=64, dim=DIM, budget=0, used=10 * MB) == 5000
+    assert plan_window(0, min_window=64, dim=DIM, budget=1, used=10 * MB) == 0
+
+
+def test_everything_fits_in_one_pass():
+    budget = 100 * MB + projected_bytes(1000, DIM)
+    assert plan_window(1000, min_window=64, dim=DIM, budget=budget, used=100 * MB) == 1000
+
+
+def test_window_is_a_multiple_of_min_window_within_the_headroom():
+    used, budget = 100 * MB, 120 * MB
+    window = plan_window(100_000, min_window=64, dim=DIM, budget=budget, used=used)
+    assert 64 <= window < 100_000
+    assert window % 64 == 0
+    assert projected_bytes(window, DIM) <= budget - used
+    assert projected_bytes(window + 64, DIM) > budget - used
+
+
+def test_budget_too_small_for_min_window_raises():
+    with pytest.raises(MemoryBudgetExceeded, match="memory budget"):
+        plan_window(1000, min_window=64, dim=DIM, budget=100 * MB, used=100 * MB)
+    with pytest.raises(MemoryBudgetExceeded):
+        plan_window(1000, min_window=64, dim=DIM, budget=100 * MB + projected_bytes(63, DIM), used=100 * MB)
+
+
+def test_precheck_projects_every_upload_type(tmp_path):
+    csv, pdf = tmp_path / "prd.csv", tmp_path / "spec.pdf"
+    csv.write_bytes(b"x" * MB)
+    pdf.write_bytes(b"x" * 10 * MB)
+    window = projected_bytes(64, DIM)
+
+    assert projected_text_bytes(str(pdf)) == MB
+    precheck_uploads([str(csv), str(pdf)], min_window=64, dim=DIM, budget=2 * MB + window, used=0)
+    precheck_uploads([str(csv)], min_window=64, dim=DIM, budget=0, used=10 * MB)
+    with pytest.raises(MemoryBudgetExceeded, match="Uploads need"):
+        precheck_uploads([str(csv)], min_window=64, dim=DIM, budget=MB + window, used=1)
+    with pytest.raises(MemoryBudgetExceeded):
+        precheck_uploads([str(pdf)], min_window=64, dim=DIM, budget=MB + window, used=1)
+
+
+def test_xlsx_uploads_are_sized_from_their_sheet_dimensions(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    path = tmp_path / "field_issues.xlsx"
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in range(2000):
+        sheet.append([f"CASE-{row}", "TC52", "Battery", "Cell swelling"])
+    workbook.save(path)
+
+    projected = projected_text_bytes(str(path))
+    assert projected == 2000 * 4 * _CELL_BYTES
+    assert projected > path.stat().st_size
+    with pytest.raises(MemoryBudgetExceeded):
+        precheck_uploads([str(path)], min_window=64, dim=DIM, budget=projected, used=0)
+
+
+def test_unreadable_xlsx_falls_back_to_the_expansion_factor(tmp_path):
+    path = tmp_path / "broken.xlsx"
+    path.write_bytes(b"not a zip" * 100)
+    assert projected_text_bytes(str(path)) == 900 * 4
+
+
+def test_tracker_off_records_nothing():
+    tracker = MemoryTracker("off")
+    tracker.mark("start")
+    assert not tracker.enabled
+    assert tracker.report() == {"mode": "off", "stages": {}, "peak_stage": None}
+
+
+def test_tracemalloc_tracker_keeps_the_maximum_of_repeated_stages():
+    tracker = MemoryTracker("tracemalloc")
+    try:
+        tracker.mark("embedded")
+        blob = bytearray(8 * MB)
+        tracker.mark("embedded")
+        first_peak = tracker.stages["embedded"]["traced_peak_mb"]
+        del blob
+        tracker.mark("embedded")
+        assert tracker.stages["embedded"]["traced_peak_mb"] == first_peak >= 8
+        tracker.mark("indexed")
+        assert tracker.report()["peak_stage"] == "embedded"
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,69 @@
+import pytest
+
+from server.agents import metrics
+from server.agents.metrics import Counter, Gauge, Histogram
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    # Test metrics register themselves like the real ones; drop them afterwards
+    before = list(metrics._REGISTRY)
+    yield
+    metrics._REGISTRY[:] = before
+
+
+def test_counter_text_format_and_label_escaping():
+    counter = Counter("test_calls_total", "Calls.", ["component"])
+    counter.inc(component="llm")
+    counter.inc(2, component="llm")
+    counter.inc(component='say "hi"\n')
+    assert counter.render() == [
+        "# HELP test_calls_total Calls.",
+        "# TYPE test_calls_total counter",
+        'test_calls_total{component="llm"} 3',
+        'test_calls_total{component="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Latency.", ["stage"], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 7):
+        histogram.observe(value, stage="llm")
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{stage="llm",le="0.1"} 2',
+        'test_seconds_bucket{stage="llm",le="1"} 3',
+        'test_seconds_bucket{stage="llm",le="+Inf"} 4',
+        'test_seconds_sum{stage="llm"} 7.65',
+        'test_seconds_count{stage="llm"} 4',
+    ]
+
+
+def test_histogram_timer_observes_once_even_on_error():
+    histogram = Histogram("test_timer_seconds", "Timer.", ["stage"])
+    with pytest.raises(RuntimeError):
+        with histogram.time(stage="embed"):
+            raise RuntimeError("boom")
+    assert 'test_timer_seconds_count{stage="embed"} 1' in histogram.render()
+
+
+def test_gauge_function_is_read_at_scrape_time():
+    values = iter([1.0, 2.0])
+    gauge = Gauge("test_rss_bytes", "RSS.", function=lambda: next(values))
+    assert gauge.render()[-1] == "test_rss_bytes 1.0"
+    assert gauge.render()[-1] == "test_rss_bytes 2.0"
+
+
+def test_render_joins_every_registered_metric():
+    Counter("test_render_total", "Rendered.").inc()
+    text = metrics.render()
+    assert text.endswith("test_render_total 1\n")
+    assert "# TYPE dfmea_stage_seconds histogram" in text
+
+
+def test_is_rate_limit():
+    class RateLimitError(Exception):
+        pass
+
+    assert metrics.is_rate_limit(RateLimitError("slow down"))
+    assert metrics.is_rate_limit(RuntimeError("Error code: 429"))
+    assert not metrics.is_rate_limit(RuntimeError("Error code: 500"))
@@ -0,0 +1,46 @@
+from server.agents.novelty_tracker import NoveltyTracker, entry_signatures
+
+
+def _entry(mode, *causes):
+    return {"Potential Failure Mode": mode, "Potential Causes": list(causes)}
+
+
+def test_signatures_ignore_order_case_punctuation_and_stopwords():
+    assert entry_signatures(_entry("Swelling of the cell", "Over-charge, heat")) == \
+        entry_signatures(_entry("cell swelling", "heat and over charge"))
+    assert entry_signatures({"Potential Failure Mode": "Leak", "Potential Causes": "Seal wear"}) == [("leak", "seal wear")]
+    assert entry_signatures({"Potential Failure Mode": "Leak"}) == [("leak", "")]
+
+
+def test_one_signature_per_cause():
+    assert len(entry_signatures(_entry("Leak", "Seal wear", "Crack"))) == 2
+
+
+def test_never_stops_before_a_full_window_follows_the_first_batch():
+    tracker = NoveltyTracker(window=2, min_new_fraction=0.2)
+    batch = [_entry("Leak", "Seal wear")]
+    assert tracker.observe(batch) is False
+    assert tracker.observe(batch) is False  # nothing new, but only one batch after the first
+    assert tracker.observe(batch) is True
+    assert tracker.stopped and tracker.batches == 3
+
+
+def test_keeps_going_while_batches_add_new_failure_modes():
+    tracker = NoveltyTracker(window=2, min_new_fraction=0.2)
+    for n in range(6):
+        assert tracker.observe([_entry(f"Mode {n}", "cause"), _entry("Leak", "Seal wear")]) is False
+
+
+def test_stops_when_new_fraction_falls_below_threshold():
+    tracker = NoveltyTracker(window=2, min_new_fraction=0.5)
+    tracker.observe([_entry(f"Mode {n}", "c") for n in range(4)])
+    # 1 new of 4 entries in each of the next two batches → 2/8 < 0.5
+    assert tracker.observe([_entry("Mode 0", "c"), _entry("Mode 1", "c"), _entry("Mode 2", "c"), _entry("New A", "c")]) is False
+    assert tracker.observe([_entry("Mode 0", "c"), _entry("Mode 1", "c"), _entry("Mode 2", "c"), _entry("New B", "c")]) is True
+
+
+def test_stopped_is_sticky_and_empty_batches_count():
+    tracker = NoveltyTracker(window=1, min_new_fraction=0.2)
+    tracker.observe([_entry("Leak", "Seal wear")])
+    assert tracker.observe([]) is True
+    assert tracker.observe([_entry("Brand new", "cause"), "not an entry"]) is True
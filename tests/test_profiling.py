@@ -0,0 +1,90 @@
+import json
+import asyncio
+import time
+
+import pytest
+
+from server.agents import profiling
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ALL", False)
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "s3cret")
+
+
+def test_requests_are_profiled_only_with_the_configured_token(token, monkeypatch):
+    assert profiling.requested({profiling.PROFILE_HEADER: "s3cret"})
+    assert not profiling.requested({profiling.PROFILE_HEADER: "guess"})
+    assert not profiling.requested({})
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", None)
+    assert not profiling.requested({profiling.PROFILE_HEADER: "s3cret"})
+
+
+def test_profile_all_ignores_the_header(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ALL", True)
+    assert profiling.requested({})
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(100))
+
+
+def test_profile_is_written_as_speedscope(tmp_path):
+    profiler = profiling.SamplingProfiler("req123", interval=0.002).start()
+    assert profiling.active()
+    _busy(0.1)
+    profiler.stop()
+    assert not profiling.active()
+
+    path = profiler.write(tmp_path)
+    assert path.name == "req123.speedscope.json"
+    profile = json.loads(path.read_text())
+    frames = profile["shared"]["frames"]
+    main = profile["profiles"][0]
+    assert main["type"] == "sampled" and len(main["samples"]) == len(main["weights"]) > 0
+    assert any(frames[i]["name"] == "_busy" for stack in main["samples"] for i in stack)
+    assert main["endValue"] == pytest.approx(sum(main["weights"]))
+
+
+def _sampled_functions(profiler):
+    profile = profiler.speedscope()
+    frames = profile["shared"]["frames"]
+    return {frames[i]["name"] for p in profile["profiles"] for stack in p["samples"] for i in stack}
+
+
+def test_only_the_profiled_request_threads_are_sampled():
+    def profiled_work():
+        _busy(0.1)
+
+    def other_request():
+        _busy(0.3)
+
+    async def main():
+        other = asyncio.ensure_future(asyncio.to_thread(other_request))
+        profiler = profiling.SamplingProfiler("req456", interval=0.002).start()
+        await profiling.to_thread(profiled_work)
+        profiler.stop()
+        await other
+        return profiler
+
+    functions = _sampled_functions(asyncio.run(main()))
+    assert "profiled_work" in functions
+    assert "other_request" not in functions
+
+
+def test_one_profile_at_a_time():
+    first = profiling.try_start("first")
+    try:
+        assert first is not None
+        assert profiling.try_start("second") is None
+    finally:
+        first.stop()
+    second = profiling.try_start("second")
+    assert second is not None
+    second.stop()
+    second.stop()  # idempotent: the lock is released once
+    assert profiling._PROFILE_LOCK.acquire(blocking=False)
+    profiling._PROFILE_LOCK.release()
@@ -0,0 +1,62 @@
+import pytest
+
+from server.agents.prompt_builder import STATIC_INSTRUCTIONS, PromptBuilder
+
+
+@pytest.fixture
+def builder(word_encoder):
+    return PromptBuilder(evidence_samples=2)
+
+
+def _context(builder, product, subproduct, focus=None):
+    return builder.pair_context(
+        [product], [subproduct], focus,
+        prd_chunks=[f"{subproduct} shall survive a 1.8 m drop", "shared PRD row"],
+        kb_chunks=["shared PRD row", f"{subproduct} latch cracked"],
+        field_chunks=[],
+    )
+
+
+def test_static_prefix_is_byte_identical_across_pairs_and_batches(builder):
+    prompts = [
+        builder.build(_context(builder, "TC52", "Battery", focus="drop"), ["chunk a", "chunk b"]),
+        builder.build(_context(builder, "ZT411", "Printhead"), ["chunk c"]),
+        builder.build(_context(builder, "ZT411", "Printhead"), []),
+    ]
+    system = [p["messages"][0] for p in prompts]
+    assert all(m == {"role": "system", "content": STATIC_INSTRUCTIONS} for m in system)
+    assert len({m["content"].encode("utf-8") for m in system}) == 1
+    # Nothing that varies per pair or batch leaks into the cached prefix
+    for word in ("TC52", "ZT411", "Battery", "Printhead", "chunk a", "drop"):
+        assert word not in STATIC_INSTRUCTIONS
+
+
+def test_pair_context_is_rendered_once_and_reused_by_every_batch(builder):
+    context = _context(builder, "TC52", "Battery")
+    first = builder.build(context, ["chunk a"])["messages"][1]["content"]
+    second = builder.build(context, ["chunk b", "chunk c"])["messages"][1]["content"]
+    assert first.startswith(context["text"]) and second.startswith(context["text"])
+    assert first.endswith("chunk a") and second.endswith("chunk b\n\nchunk c")
+
+
+def test_pair_context_dedupes_evidence_and_marks_empty_sources(builder):
+    text = _context(builder, "TC52", "Battery", focus="drop")["text"]
+    assert text.startswith("Zebra Engineering Focus: drop\n\nContext:\n- Products: TC52\n")
+    assert text.count("shared PRD row") == 1
+    assert "- Field Issue Evidence (sample):\n(none retrieved)" in text
+
+
+def test_evidence_samples_are_capped(builder):
+    context = builder.pair_context(["TC52"], ["Battery"], None, ["a", "b", "c"], [], [])
+    assert "- PRD Evidence (sample):\na\nb\n" in context["text"]
+    assert "\nc\n" not in context["text"]
+
+
+def test_token_breakdown_adds_up(builder):
+    context = _context(builder, "TC52", "Battery")
+    tokens = builder.build(context, ["one two", "three"])["tokens"]
+    assert tokens["static"] == builder.count_tokens(STATIC_INSTRUCTIONS)
+    assert tokens["pair"] == context["tokens"] == builder.count_tokens(context["text"])
+    # Header and chunk separator are part of the batch section, not just the chunks
+    assert tokens["batch"] == builder.batch_header_tokens + builder.separator_tokens + 3
+    assert tokens["total"] == tokens["static"] + tokens["pair"] + tokens["batch"]
@@ -0,0 +1,39 @@
+import pytest
+
+from server.agents.context_agent import ContextAgent
+from server.agents.llm_cache import LLMResponseCache
+from server.agents.llm_scheduler import LLMScheduler
+
+
+@pytest.fixture
+def agent(word_encoder, tmp_path):
+    return ContextAgent(
+        llm_client=None,
+        scheduler=LLMScheduler(),
+        cache=LLMResponseCache(path=str(tmp_path / "cache.sqlite3")),
+        batching="tokens",
+    )
+
+
+def test_batches_count_the_header_and_separators(agent):
+    builder = agent.prompt_builder
+    chunks = ["a b", "c d", "e"]
+    budget = builder.batch_header_tokens + 2 + builder.separator_tokens + 2
+    batches = agent._batch_by_tokens(chunks, budget)
+    assert batches == [["a b", "c d"], ["e"]]
+    for batch in batches:
+        assert builder.batch_tokens(batch) <= budget
+
+
+def test_batch_tokens_match_what_build_reports(agent):
+    context = {"text": "ctx", "tokens": 1}
+    batch = ["one two three", "four", "five six"]
+    assert agent.prompt_builder.build(context, batch)["tokens"]["batch"] == agent.prompt_builder.batch_tokens(batch)
+
+
+def test_oversized_chunk_is_trimmed_to_fit_with_the_header(agent):
+    builder = agent.prompt_builder
+    budget = builder.batch_header_tokens + 4
+    batches = agent._batch_by_tokens(["w " * 20, "x"], budget)
+    assert batches[0] == ["w w w w"]
+    assert all(builder.batch_tokens(batch) <= budget for batch in batches)
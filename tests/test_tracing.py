@@ -0,0 +1,78 @@
+import json
+import asyncio
+
+import pytest
+
+from server.agents import tracing
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    """Enable tracing with a JSONL exporter; yields a function returning the exported spans."""
+    path = tmp_path / "spans.jsonl"
+    exporter = tracing._Exporter(str(path), None)
+    monkeypatch.setattr(tracing, "_exporter", exporter)
+
+    def spans():
+        exporter.shutdown()
+        return {s["name"]: s for s in map(json.loads, path.read_text().splitlines())}
+
+    return spans
+
+
+def test_spans_are_noops_when_tracing_is_off(monkeypatch):
+    monkeypatch.setattr(tracing, "_exporter", None)
+    with tracing.span("request") as span:
+        span.set(pairs=3)
+        assert tracing.current_span() is span is tracing._NOOP
+    assert not tracing.enabled()
+
+
+def test_spans_nest_across_tasks_and_worker_threads(trace_file):
+    def embed():
+        with tracing.span("embed", texts=2):
+            pass
+
+    async def pair():
+        with tracing.span("pair"):
+            with tracing.span("llm"):
+                await asyncio.sleep(0)
+
+    async def main():
+        with tracing.span("request", route="/dfmea/generate") as root:
+            await asyncio.gather(asyncio.to_thread(embed), asyncio.create_task(pair()))
+            root.set(entries=5)
+
+    asyncio.run(main())
+    spans = trace_file()
+    root = spans["request"]
+    assert root["parent_id"] is None
+    assert root["attributes"] == {"route": "/dfmea/generate", "entries": 5}
+    assert spans["embed"]["parent_id"] == root["span_id"]
+    assert spans["pair"]["parent_id"] == root["span_id"]
+    assert spans["llm"]["parent_id"] == spans["pair"]["span_id"]
+    assert {s["trace_id"] for s in spans.values()} == {root["trace_id"]}
+    assert all(s["end_ns"] >= s["start_ns"] for s in spans.values())
+
+
+def test_errors_are_recorded_and_reraised(trace_file):
+    with pytest.raises(ValueError):
+        with tracing.span("parse"):
+            raise ValueError("bad json")
+    assert tracing.current_span() is tracing._NOOP
+    assert trace_file()["parse"]["error"] == "ValueError: bad json"
+
+
+def test_otlp_payload_encoding():
+    span = tracing.Span("llm", None, {"tokens": 12, "cached": False, "ratio": 0.5, "model": "gpt-4o"})
+    span.end = span.start + 1
+    span.error = "RateLimitError: 429"
+    encoded = tracing._otlp_payload([span])["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert "parentSpanId" not in encoded
+    assert encoded["attributes"] == [
+        {"key": "tokens", "value": {"intValue": "12"}},
+        {"key": "cached", "value": {"boolValue": False}},
+        {"key": "ratio", "value": {"doubleValue": 0.5}},
+        {"key": "model", "value": {"stringValue": "gpt-4o"}},
+    ]
+    assert encoded["status"] == {"code": 2, "message": "RateLimitError: 429"}
@@ -0,0 +1,97 @@
+import os
+import json
+import uuid
+
+import pytest
+from qdrant_client.models import Distance, VectorParams
+
+from server.agents import vectorstore_agent
+from server.agents.vectorstore_agent import VERSION_SEPARATOR, VectorStoreAgent
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Agent on the shared in-memory Qdrant, under an alias of its own, with pins in ``tmp_path``."""
+    monkeypatch.setenv("QDRANT_LOCATION", ":memory:")
+    monkeypatch.setattr(vectorstore_agent, "PIN_DIR", tmp_path)
+    store = VectorStoreAgent(collection_name=f"test_{uuid.uuid4().hex[:8]}")
+    store.gc_grace_seconds = 0
+    return store
+
+
+def _old_version(store, suffix):
+    name = f"{store.alias}{VERSION_SEPARATOR}1000_{suffix}"
+    store.client.create_collection(name, vectors_config=VectorParams(size=2, distance=Distance.COSINE))
+    return name
+
+
+def _pin_file(directory, version, pid):
+    path = directory / f"{uuid.uuid4().hex}.pin"
+    path.write_text(json.dumps({"version": version, "pid": pid, "host": vectorstore_agent._HOST}))
+    return path
+
+
+def _dead_pid():
+    pid = 2 ** 22 + 12345
+    while True:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return pid
+        except PermissionError:
+            pass
+        pid += 1
+
+
+def test_pins_are_shared_through_the_pin_dir(store, tmp_path):
+    version = _old_version(store, "mine")
+    store.pin_version(version)
+    store.pin_version(version)
+    assert len(list(tmp_path.glob("*.pin"))) == 1
+    assert store.garbage_collect_versions() == []
+
+    store.unpin_version(version)
+    assert len(list(tmp_path.glob("*.pin"))) == 1
+    store.unpin_version(version)
+    assert list(tmp_path.glob("*.pin")) == []
+    assert store.garbage_collect_versions() == [version]
+
+
+def test_gc_keeps_versions_pinned_by_other_live_workers(store, tmp_path):
+    other = _old_version(store, "other")
+    crashed = _old_version(store, "crashed")
+    _pin_file(tmp_path, other, os.getppid())
+    stale = _pin_file(tmp_path, crashed, _dead_pid())
+
+    assert store.garbage_collect_versions() == [crashed]
+    assert not stale.exists()
+    assert store.client.collection_exists(other)
+
+
+def test_promote_replaces_a_legacy_collection_with_the_alias(store):
+    store.client.create_collection(store.alias, vectors_config=VectorParams(size=2, distance=Distance.COSINE))
+    version = store.create_versioned_collection(3)
+    store.unpin_version(version)
+
+    store.promote_version(version)
+    assert store.resolve_alias() == version
+    assert store.alias not in {c.name for c in store.client.get_collections().collections}
+    assert store.client.get_collection(store.alias).config.params.vectors.size == 3
+
+
+def test_promote_drops_the_legacy_collection_first_when_the_alias_is_refused(store, monkeypatch):
+    store.client.create_collection(store.alias, vectors_config=VectorParams(size=2, distance=Distance.COSINE))
+    version = _old_version(store, "new")
+    update = store.client.update_collection_aliases
+    calls = []
+
+    def refuse_while_taken(**kwargs):
+        calls.append(store.client.collection_exists(store.alias))
+        if calls[-1]:
+            raise RuntimeError("Collection with the same name already exists")
+        return update(**kwargs)
+
+    monkeypatch.setattr(store.client, "update_collection_aliases", refuse_while_taken)
+    store.promote_version(version)
+    assert calls == [True, False]
+    assert store.resolve_alias() == version
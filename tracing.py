@@ -0,0 +1,219 @@
+# server/agents/tracing.py
+
+import os
+import json
+import time
+import queue
+import atexit
+import secrets
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from server.utils.logger import logger
+
+# Exporters (tracing is off unless at least one is configured)
+TRACE_FILE = os.getenv("DFMEA_TRACE_FILE")  # JSON lines, one finished span per line
+OTLP_ENDPOINT = os.getenv("DFMEA_OTLP_ENDPOINT") or os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+SERVICE_NAME = os.getenv("DFMEA_TRACE_SERVICE", "dfmea-server")
+EXPORT_BATCH = 256
+
+_CURRENT: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("dfmea_span", default=None)
+
+
+class Span:
+    """One timed operation; children find their parent through a contextvar.
+
+    The contextvar is copied by ``asyncio.create_task``/``gather`` and by
+    ``asyncio.to_thread``, so spans opened inside worker threads and sub-tasks nest
+    under the span that was current when they were started.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start,
+            "end_ns": self.end,
+            "duration_ms": round((self.end - self.start) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    trace_id = span_id = None
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+# ----------------------------------------------------------------------
+# Exporters
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(spans: List[Span]) -> Dict:
+    """OTLP/HTTP JSON encoding of finished spans (``POST <endpoint>/v1/traces``)."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": "server.agents.tracing"},
+            "spans": [{
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start),
+                "endTimeUnixNano": str(s.end),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            } for s in spans],
+        }],
+    }]}
+
+
+class _Exporter:
+    """Ships finished spans from a daemon thread, so request paths never block on I/O."""
+
+    def __init__(self, trace_file: Optional[str], otlp_endpoint: Optional[str]):
+        self.trace_file = trace_file
+        self.otlp_url = None
+        if otlp_endpoint:
+            endpoint = otlp_endpoint.rstrip("/")
+            self.otlp_url = endpoint if endpoint.endswith("/v1/traces") else endpoint + "/v1/traces"
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=100_000)
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._loop, name="dfmea-trace-exporter", daemon=True)
+        self._thread.start()
+
+    def put(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self._dropped += 1
+
+    def _loop(self):
+        while True:
+            span = self._queue.get()
+            if span is None:
+                return
+            batch = [span]
+            while len(batch) < EXPORT_BATCH:
+                try:
+                    span = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    break
+                if span is None:
+                    self._export(batch)
+                    return
+                batch.append(span)
+            self._export(batch)
+
+    def _export(self, batch: List[Span]):
+        if self.trace_file:
+            try:
+                with open(self.trace_file, "a", encoding="utf-8") as fh:
+                    for span in batch:
+                        fh.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+            except OSError as e:
+                logger.warning(f"[Tracing] ⚠️ Could not write {len(batch)} spans to {self.trace_file}: {e}")
+        if self.otlp_url:
+            request = urllib.request.Request(
+                self.otlp_url,
+                data=json.dumps(_otlp_payload(batch), default=str).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                logger.warning(f"[Tracing] ⚠️ OTLP export of {len(batch)} spans failed: {type(e).__name__}: {e}")
+
+    def shutdown(self, timeout: float = 5.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._dropped:
+            logger.warning(f"[Tracing] ⚠️ Dropped {self._dropped} spans (export queue full)")
+
+
+_exporter: Optional[_Exporter] = None
+if TRACE_FILE or OTLP_ENDPOINT:
+    _exporter = _Exporter(TRACE_FILE, OTLP_ENDPOINT)
+    atexit.register(_exporter.shutdown)
+    logger.info(f"[Tracing] 🛰️ Exporting spans to {', '.join(filter(None, (TRACE_FILE, _exporter.otlp_url)))}")
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def shutdown():
+    """Flush queued spans (call on application shutdown)."""
+    global _exporter
+    if _exporter is not None:
+        _exporter.shutdown()
+        _exporter = None
+
+
+# ----------------------------------------------------------------------
+# Instrumentation API
+def current_span():
+    """The innermost open span, or a no-op span when tracing is off / outside any span."""
+    return _CURRENT.get() or _NOOP
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a child of the current span (no-op when tracing is off)."""
+    if _exporter is None:
+        yield _NOOP
+        return
+    parent = _CURRENT.get()
+    current = Span(name, parent, attributes)
+    token = _CURRENT.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end = time.time_ns()
+        try:
+            _CURRENT.reset(token)
+        except ValueError:
+            # Closed from another context (e.g. an async generator finished by a different task)
+            _CURRENT.set(parent)
+        exporter = _exporter
+        if exporter is not None:
+            exporter.put(current)
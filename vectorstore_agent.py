@@ -1,17 +1,139 @@
 import os
+import json
 import uuid
 import math
-from typing import List, Dict
+import socket
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional, Iterable, Set
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import (
+    VectorParams,
+    Distance,
+    PointStruct,
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+    SearchRequest,
+)
 from server.utils.logger import logger
+from .job_manager import write_json_atomic
+from .metrics import STAGE_SECONDS, BATCH_SIZE, RATE_LIMITED, RETRIES, is_rate_limit
+from .tracing import span, current_span
 import time 
 import random 
 
 load_dotenv()
 
+# Versioned collections are named "<alias>__v<timestamp>_<suffix>" and made live by
+# swapping the alias onto them. Pins are counted per process and mirrored as one file
+# per (version, process) in QDRANT_PIN_DIR, so every worker process sharing that
+# directory sees which versions running jobs are still reading from. A pin file is
+# ignored once its owner process is gone (same host) or it is older than QDRANT_PIN_TTL.
+VERSION_SEPARATOR = "__v"
+PIN_DIR = Path(os.getenv("QDRANT_PIN_DIR", os.path.join(tempfile.gettempdir(), "dfmea_version_pins")))
+PIN_TTL = float(os.getenv("QDRANT_PIN_TTL_SECONDS", str(24 * 3600)))
+_HOST = socket.gethostname()
+_PIN_LOCK = threading.Lock()
+_PINNED_VERSIONS: Dict[str, int] = {}
+_PIN_FILES: Dict[str, Path] = {}
+
+# Payload keys returned by search() unless the caller asks for more
+DEFAULT_PAYLOAD_FIELDS = ("text", "source")
+
+# Embedded (local-mode) Qdrant clients, one per location: ":memory:" is per client and an
+# on-disk path can only be opened once, so every agent in the process must share it.
+# Local mode is not thread-safe, and agents call it from asyncio.to_thread workers, so
+# each shared client is wrapped to serialize its calls.
+_LOCAL_CLIENTS: Dict[str, "_SerializedClient"] = {}
+_LOCAL_LOCK = threading.Lock()
+
+
+class _SerializedClient:
+    """Proxy running every method of a local-mode ``QdrantClient`` under one lock."""
+
+    def __init__(self, client: QdrantClient):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        return call
+
+
+def _local_client(location: str) -> "_SerializedClient":
+    with _LOCAL_LOCK:
+        if location not in _LOCAL_CLIENTS:
+            if location == ":memory:":
+                client = QdrantClient(location=location)
+            else:
+                client = QdrantClient(path=location)
+            _LOCAL_CLIENTS[location] = _SerializedClient(client)
+        return _LOCAL_CLIENTS[location]
+
+
+def _pin_is_stale(owner: Dict, age: float) -> bool:
+    if owner.get("host") == _HOST and owner.get("pid") != os.getpid():
+        try:
+            os.kill(int(owner["pid"]), 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, KeyError, TypeError, ValueError):
+            pass
+    return age > PIN_TTL
+
+
+def _shared_pins() -> Set[str]:
+    """Versions pinned by any live process sharing ``PIN_DIR``; stale pin files are removed."""
+    pinned = set()
+    try:
+        paths = list(PIN_DIR.glob("*.pin"))
+    except OSError:
+        return pinned
+    for path in paths:
+        try:
+            age = time.time() - path.stat().st_mtime
+            with open(path, encoding="utf-8") as fh:
+                owner = json.load(fh)
+        except (OSError, ValueError):
+            continue  # removed meanwhile (or unreadable): its version stays protected by the grace window
+        if _pin_is_stale(owner, age):
+            logger.warning(f"[VectorStoreAgent] ⚠️ Removing stale pin of '{owner.get('version')}' "
+                           f"(pid {owner.get('pid')} on {owner.get('host')})")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        pinned.add(owner.get("version"))
+    return pinned
+
+
+class _HitPreview:
+    """Lazy one-line rendering of a search hit; only formatted when actually logged."""
+
+    __slots__ = ("hit",)
+
+    def __init__(self, hit: Dict):
+        self.hit = hit
+
+    def __str__(self) -> str:
+        text_preview = self.hit["text"][:120].replace("\n", " ")
+        meta = {k: v for k, v in self.hit["metadata"].items() if k != "text"}
+        return f"score={self.hit['score']:.4f} | preview='{text_preview}...' | meta={meta}"
+
 # class VectorStoreAgent:
 #     def __init__(self, collection_name: str = None):
 #         self.qdrant_url = os.getenv("QDRANT_ENDPOINT")
@@ -101,15 +223,29 @@ class VectorStoreAgent:
         self.qdrant_api_key = os.getenv("QDRANT_API_KEY")
         # Always use fixed name unless explicitly overridden
         self.collection_name = collection_name or os.getenv("QDRANT_COLLECTION", "dfmea_collection")
-
-        self.client = QdrantClient(
-            url=self.qdrant_url,
-            api_key=self.qdrant_api_key,
-            prefer_grpc=False,  # Make HTTP-based async fallback smoother
-            https=True,
-            timeout=120,  # increased from 30s to 120s for stability
-            verify=False
-        )
+        # Alias that serves the live version; versioned collections hang off it
+        self.alias = self.collection_name.split(VERSION_SEPARATOR)[0]
+        # Never GC versions younger than this (covers pins that could not be shared)
+        self.gc_grace_seconds = int(os.getenv("QDRANT_VERSION_GC_GRACE", "3600"))
+        # Per-hit preview logging is opt-in and sampled
+        self.log_hits = os.getenv("VECTORSTORE_LOG_HITS", "0") == "1"
+        self.log_sample = int(os.getenv("VECTORSTORE_LOG_SAMPLE", "5"))
+        # Query-embedding client is created once per agent, on first search
+        self._embedding_client = None
+
+        # QDRANT_LOCATION=":memory:" or a directory → embedded Qdrant (benchmarks, offline runs)
+        self.qdrant_location = os.getenv("QDRANT_LOCATION")
+        if self.qdrant_location:
+            self.client = _local_client(self.qdrant_location)
+        else:
+            self.client = QdrantClient(
+                url=self.qdrant_url,
+                api_key=self.qdrant_api_key,
+                prefer_grpc=False,  # Make HTTP-based async fallback smoother
+                https=True,
+                timeout=120,  # increased from 30s to 120s for stability
+                verify=False
+            )
         self.ssl_verify = False
 
     def create_collection(self, vector_dim: int):
@@ -120,6 +256,134 @@ class VectorStoreAgent:
         )
         logger.info(f"[VectorStoreAgent] ✅ Collection ready: {self.collection_name}")
 
+    # ------------------------------------------------------------------
+    # Versioned collections + alias swapping
+    # ------------------------------------------------------------------
+    def create_versioned_collection(self, vector_dim: int) -> str:
+        """Create a job-private collection version and bind this agent to it.
+
+        The new version is pinned before it exists, so a concurrent GC can never
+        drop it mid-ingest. Callers must ``unpin_version`` when the job ends.
+        """
+        version = f"{self.alias}{VERSION_SEPARATOR}{int(time.time())}_{uuid.uuid4().hex[:8]}"
+        self.pin_version(version)
+        logger.info(f"[VectorStoreAgent] Creating collection version '{version}'...")
+        try:
+            with span("qdrant.create_collection", collection=version, dim=vector_dim):
+                self.client.create_collection(
+                    collection_name=version,
+                    vectors_config=VectorParams(size=vector_dim, distance=Distance.COSINE)
+                )
+        except Exception:
+            self.unpin_version(version)
+            raise
+        self.collection_name = version
+        logger.info(f"[VectorStoreAgent] ✅ Collection version ready: {version}")
+        return version
+
+    def resolve_alias(self) -> Optional[str]:
+        """Return the collection version the alias currently points at, if any."""
+        for alias in self.client.get_aliases().aliases:
+            if alias.alias_name == self.alias:
+                return alias.collection_name
+        return None
+
+    def promote_version(self, version: str):
+        """Atomically repoint the alias at ``version`` (delete + create in one request)."""
+        current = self.resolve_alias()
+        if current == version:
+            return
+
+        operations = []
+        legacy = False
+        if current:
+            operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=self.alias)))
+        else:
+            # A legacy fixed-name collection may still occupy the alias name
+            legacy = self.client.collection_exists(self.alias)
+        operations.append(
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=version, alias_name=self.alias))
+        )
+
+        with span("qdrant.update_aliases", alias=self.alias, collection=version):
+            try:
+                self.client.update_collection_aliases(change_aliases_operations=operations)
+            except Exception as e:
+                if not legacy:
+                    raise
+                # The server refuses an alias named like an existing collection → drop, then alias at once
+                logger.warning(f"[VectorStoreAgent] ⚠️ Alias '{self.alias}' is taken by the legacy collection "
+                               f"({type(e).__name__}); dropping it first")
+                self.client.delete_collection(self.alias)
+                self.client.update_collection_aliases(change_aliases_operations=operations)
+                legacy = False
+        if legacy:
+            # The alias already points at `version`, so dropping the legacy collection leaves no gap
+            logger.warning(f"[VectorStoreAgent] ⚠️ Dropping legacy collection '{self.alias}' now shadowed by the alias")
+            self.client.delete_collection(self.alias)
+        logger.info(f"[VectorStoreAgent] 🔀 Alias '{self.alias}' → '{version}' (was: {current})")
+
+    def pin_version(self, version: str):
+        """Mark a version as in use by a running job so GC (in any worker) leaves it alone."""
+        with _PIN_LOCK:
+            _PINNED_VERSIONS[version] = _PINNED_VERSIONS.get(version, 0) + 1
+            if version in _PIN_FILES:
+                return
+            path = PIN_DIR / f"{uuid.uuid4().hex}.pin"
+            try:
+                PIN_DIR.mkdir(parents=True, exist_ok=True)
+                write_json_atomic(path, {"version": version, "pid": os.getpid(), "host": _HOST,
+                                         "pinned_at": time.time()})
+                _PIN_FILES[version] = path
+            except OSError as e:
+                logger.warning(f"[VectorStoreAgent] ⚠️ Could not share pin of '{version}' with other workers: {e}")
+
+    def unpin_version(self, version: str):
+        with _PIN_LOCK:
+            count = _PINNED_VERSIONS.get(version, 0) - 1
+            if count > 0:
+                _PINNED_VERSIONS[version] = count
+                return
+            _PINNED_VERSIONS.pop(version, None)
+            path = _PIN_FILES.pop(version, None)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def garbage_collect_versions(self, keep: Iterable[str] = ()) -> List[str]:
+        """Drop versions of this alias that are neither live, pinned, kept nor too young."""
+        live = self.resolve_alias()
+        keep = set(keep)
+        with _PIN_LOCK:
+            pinned = set(_PINNED_VERSIONS)
+        pinned |= _shared_pins()
+        now = time.time()
+        prefix = f"{self.alias}{VERSION_SEPARATOR}"
+
+        deleted = []
+        for collection in self.client.get_collections().collections:
+            name = collection.name
+            if not name.startswith(prefix) or name == live or name in pinned or name in keep:
+                continue
+            try:
+                created = int(name[len(prefix):].split("_")[0])
+            except ValueError:
+                continue
+            if now - created < self.gc_grace_seconds:
+                continue
+            try:
+                with span("qdrant.delete_collection", collection=name):
+                    self.client.delete_collection(name)
+                deleted.append(name)
+            except Exception as e:
+                logger.warning(f"[VectorStoreAgent] ⚠️ GC could not drop '{name}': {type(e).__name__}: {e}")
+
+        if deleted:
+            logger.info(f"[VectorStoreAgent] 🗑️ Garbage-collected {len(deleted)} stale versions of '{self.alias}'")
+        return deleted
+
     # def add_embeddings(self, embedded_chunks: List[Dict], batch_limit: int = 100):
     #     total = len(embedded_chunks)
     #     points = [
@@ -144,37 +408,44 @@ class VectorStoreAgent:
     #             logger.error(f"[VectorStoreAgent] ❌ Batch {i+1}/{num_batches} failed: {type(e).__name__}: {e}")
 
     #     logger.info(f"[VectorStoreAgent] 🎯 Upload complete: {total} vectors stored in {self.collection_name}")
-    def add_embeddings(self, embedded_chunks: List[Dict], batch_limit: int = 100):
-        total = len(embedded_chunks)
-        points = []
-
-        for idx, chunk in enumerate(embedded_chunks):
-            metadata = chunk.get("metadata", {})
-
-            # ✅ Ensure core metadata fields are always present
-            payload = {
-                "source": metadata.get("source", "unknown"),          # prds / knowledge_base / field_issues
-                "product": metadata.get("product", "unspecified"),
-                "subproduct": metadata.get("subproduct", "unspecified"),
-                "tokens": chunk.get("tokens", 0),
-                "text": chunk["text"],                               # keep full text for context
-            }
-
-            points.append(
-                PointStruct(
-                    id=idx,
-                    vector=chunk["embedding"],
-                    payload=payload
-                )
-            )
+    def add_embeddings(self, embedded_chunks: List[Dict], batch_limit: int = 100, id_offset: int = 0):
+        """Upsert embedded chunks as points ``id_offset + i``.
 
+        Points are built one upsert batch at a time, so only ``batch_limit`` pydantic
+        copies of the vectors exist at once; windowed ingestion passes each window's
+        start as ``id_offset`` to keep ids unique within the collection version.
+        """
+        total = len(embedded_chunks)
         num_batches = math.ceil(total / batch_limit)
         logger.info(f"[VectorStoreAgent] 🚀 Uploading {total} vectors in {num_batches} batches...")
 
         for i in range(num_batches):
-            batch = points[i * batch_limit : (i + 1) * batch_limit]
+            start = i * batch_limit
+            batch = []
+            for idx, chunk in enumerate(embedded_chunks[start:start + batch_limit], start=start):
+                metadata = chunk.get("metadata", {})
+
+                # ✅ Ensure core metadata fields are always present
+                payload = {
+                    "source": metadata.get("source", "unknown"),          # prds / knowledge_base / field_issues
+                    "product": metadata.get("product", "unspecified"),
+                    "subproduct": metadata.get("subproduct", "unspecified"),
+                    "tokens": chunk.get("tokens", 0),
+                    "text": chunk["text"],                               # keep full text for context
+                }
+
+                batch.append(
+                    PointStruct(
+                        id=id_offset + idx,
+                        vector=chunk["embedding"],
+                        payload=payload
+                    )
+                )
             try:
-                self.client.upsert(collection_name=self.collection_name, points=batch)
+                BATCH_SIZE.observe(len(batch), kind="upsert")
+                with STAGE_SECONDS.time(stage="upsert"), \
+                        span("qdrant.upsert", collection=self.collection_name, batch=i, points=len(batch)):
+                    self.client.upsert(collection_name=self.collection_name, points=batch)
                 percent = ((i+1) / num_batches) * 100
                 logger.info(f"[VectorStoreAgent] 📊 Progress: {percent:.0f}% ({i+1}/{num_batches} batches done)")
             except Exception as e:
@@ -236,65 +507,138 @@ class VectorStoreAgent:
 
     #     logger.info(f"[VectorStoreAgent] 🎯 Found {len(output)} matches")
     #     return output
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        payload_fields: Optional[Iterable[str]] = DEFAULT_PAYLOAD_FIELDS,
+        log_hits: Optional[bool] = None,
+        log_sample: Optional[int] = None,
+        with_vectors: bool = False,
+    ) -> List[Dict]:
+        """Embed ``query`` and return the top hits with a slim payload.
+
+        ``payload_fields`` selects which payload keys Qdrant returns (``None`` → all).
+        Per-hit previews are only logged when ``log_hits`` (or VECTORSTORE_LOG_HITS=1)
+        is set, sampled down to ``log_sample`` lines. ``with_vectors`` adds each hit's
+        stored vector under ``"vector"`` (used for diversity reranking).
+        """
         logger.info(f"[VectorStoreAgent] 🔎 Searching for: '{query}' in '{self.collection_name}'")
+        start = time.perf_counter()
 
-        embedding_client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION")
-        )
+        query_vectors = self.embed_queries([query])
+        if not query_vectors:
+            return []
+
+        with span("qdrant.search", collection=self.collection_name, top_k=top_k) as search_span:
+            results = self.client.search(
+                collection_name=self.collection_name,
+                query_vector=query_vectors[0],
+                limit=top_k,
+                # Only ship the payload keys callers actually read (None → full payload)
+                with_payload=list(payload_fields) if payload_fields is not None else True,
+                with_vectors=with_vectors
+            )
+            search_span.set(hits=len(results))
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="search")
+        return self._to_matches(results, with_vectors, log_hits, log_sample)
+
+    def search_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        payload_fields: Optional[Iterable[str]] = DEFAULT_PAYLOAD_FIELDS,
+        with_vectors: bool = False,
+    ) -> List[List[Dict]]:
+        """Batched ``search``: one embeddings call and one Qdrant search_batch for all queries."""
+        if not queries:
+            return []
+        logger.info(f"[VectorStoreAgent] 🔎 Batch-searching {len(queries)} queries in '{self.collection_name}'")
+        start = time.perf_counter()
+
+        query_vectors = self.embed_queries(queries)
+        if not query_vectors:
+            return [[] for _ in queries]
+
+        with_payload = list(payload_fields) if payload_fields is not None else True
+        with span("qdrant.search_batch", collection=self.collection_name, queries=len(queries), top_k=top_k):
+            batch_results = self.client.search_batch(
+                collection_name=self.collection_name,
+                requests=[
+                    SearchRequest(vector=vector, limit=top_k, with_payload=with_payload, with_vector=with_vectors)
+                    for vector in query_vectors
+                ],
+            )
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="search")
+        return [self._to_matches(results, with_vectors) for results in batch_results]
+
+    def embed_queries(self, queries: List[str]) -> Optional[List[List[float]]]:
+        """Embed one or more query strings in a single request, with 429 backoff."""
+        if self._embedding_client is None:
+            self._embedding_client = AzureOpenAI(
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION")
+            )
         deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
 
         # Retry loop for 429 errors
         delay = 2
         for attempt in range(5):
             try:
-                response = embedding_client.embeddings.create(input=query, model=deployment)
-                break
+                with span("embedding.query", queries=len(queries), attempt=attempt):
+                    response = self._embedding_client.embeddings.create(input=queries, model=deployment)
+                return [item.embedding for item in response.data]
             except Exception as e:
-                if "429" in str(e):
+                if is_rate_limit(e):
+                    RATE_LIMITED.inc(component="query_embedding")
+                    RETRIES.inc(component="query_embedding")
+                    current_span().set(query_embed_retries=attempt + 1)
                     logger.warning(f"[VectorStoreAgent] ⚠️ 429 during search embed: attempt {attempt+1}/5, retrying in {delay}s...")
                     time.sleep(delay + random.uniform(0, 1))
                     delay = min(delay * 2, 30)
                 else:
                     logger.error(f"[VectorStoreAgent] ❌ Non-429 search error: {type(e).__name__}: {e}")
-                    return []
-        else:
-            logger.error("[VectorStoreAgent] ❌ Max retries exceeded while embedding query.")
-            return []
+                    return None
 
-        query_vector = response.data[0].embedding
-
-        results = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_vector,
-            limit=top_k,
-            with_payload=True
-        )
+        logger.error("[VectorStoreAgent] ❌ Max retries exceeded while embedding query.")
+        return None
 
+    def _to_matches(
+        self,
+        results,
+        with_vectors: bool,
+        log_hits: Optional[bool] = None,
+        log_sample: Optional[int] = None,
+    ) -> List[Dict]:
         output = []
-        preview_lines = []
-        for idx, hit in enumerate(results):
-            text_preview = hit.payload.get("text", "")[:120].replace("\n", " ")
-            metadata = hit.payload
-            output.append({
+        for hit in results:
+            payload = hit.payload or {}
+            match = {
                 "score": hit.score,
-                "text": hit.payload.get("text", ""),
-                "metadata": metadata
-            })
-            preview_lines.append(
-                f"  {idx+1}. score={hit.score:.4f} | preview='{text_preview}...' | meta={ {k:v for k,v in metadata.items() if k!='text'} }"
-            )
+                "text": payload.get("text", ""),
+                "metadata": payload
+            }
+            if with_vectors:
+                match["vector"] = hit.vector
+            output.append(match)
 
-        if preview_lines:
-            logger.info("[VectorStoreAgent] 📊 Retrieved top chunks:\n" + "\n".join(preview_lines))
-        else:
+        if not output:
             logger.warning("[VectorStoreAgent] ⚠️ No results found in search.")
+            return output
 
-        return output
+        logger.info("[VectorStoreAgent] 📊 Retrieved %d chunks (top score=%.4f)", len(output), output[0]["score"])
+        log_hits = self.log_hits if log_hits is None else log_hits
+        if log_hits and logger.isEnabledFor(logging.INFO):
+            self._log_hit_sample(output, self.log_sample if log_sample is None else log_sample)
 
+        return output
 
+    def _log_hit_sample(self, hits: List[Dict], sample: int):
+        """Log an evenly spaced sample of hits; previews are only formatted if emitted."""
+        step = max(1, math.ceil(len(hits) / max(1, sample)))
+        for idx in range(0, len(hits), step):
+            logger.info("[VectorStoreAgent]   %d. %s", idx + 1, _HitPreview(hits[idx]))
 
     def delete_collection(self):
         logger.info(f"[VectorStoreAgent] Dropping collection '{self.collection_name}'...")